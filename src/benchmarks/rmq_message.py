@@ -0,0 +1,73 @@
+"""Per-message cost of building rmq_alternative messages: pydantic BaseRmqMessage vs RmqMessage.
+
+Usage (from src directory):
+    python -m benchmarks.rmq_message [--messages 100000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+
+from pika.channel import Channel
+from pika.spec import Basic, BasicProperties
+
+from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
+from rmq_alternative.schemas.messages.rmq_message import RmqMessage
+
+
+def build_consumed_data(messages):
+    channel = Channel.__new__(Channel)
+    properties = BasicProperties(content_type="application/json", delivery_mode=2)
+    body = json.dumps({"id": 1, "url": "https://example.com", "status": 0}).encode("utf-8")
+    return [
+        {
+            "channel": channel,
+            "method": Basic.Deliver(delivery_tag=i + 1),
+            "properties": properties,
+            "body": body,
+        }
+        for i in range(messages)
+    ]
+
+
+def run(message_type, consumed_data, repeat, validate=False, read_body=False):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for dict_message in consumed_data:
+            message = message_type(
+                channel=dict_message["channel"],
+                deliver=dict_message["method"],
+                basic_properties=dict_message["properties"],
+                body=dict_message["body"],
+                _rmq_connection=None,
+                _crawler=None,
+            )
+            if validate:
+                message.validate()
+            if read_body:
+                message.body
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(consumed_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    consumed_data = build_consumed_data(args.messages)
+    pydantic_cost = run(BaseRmqMessage, consumed_data, args.repeat)
+    lazy_cost = run(RmqMessage, consumed_data, args.repeat)
+    lazy_body_cost = run(RmqMessage, consumed_data, args.repeat, read_body=True)
+    validated_cost = run(RmqMessage, consumed_data, args.repeat, validate=True)
+    print(f"pydantic:            {pydantic_cost * 1e6:.2f} us/message")
+    print(f"slots:               {lazy_cost * 1e6:.2f} us/message (body not read)")
+    print(f"slots + body:        {lazy_body_cost * 1e6:.2f} us/message")
+    print(f"slots + validation:  {validated_cost * 1e6:.2f} us/message")
+    print(f"speedup:             {pydantic_cost / lazy_body_cost:.1f}x (body read)")
+
+
+if __name__ == "__main__":
+    main()
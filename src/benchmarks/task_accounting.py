@@ -0,0 +1,106 @@
+"""Per-item overhead of rmq_callback accounting: pydispatch signals vs direct accountant calls.
+
+Usage (from src directory):
+    python -m benchmarks.task_accounting [--items 100000] [--repeat 5]
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import scrapy
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from rmq.signals import callback_completed, item_scheduled
+from rmq.utils import RMQConstants, Task, TaskAccountant, TaskObserver, set_task_accountant
+from rmq.utils.decorators import rmq_callback
+
+
+class BenchmarkItem(scrapy.Item):
+    value = scrapy.Field()
+
+
+class BenchmarkSpider(scrapy.Spider):
+    name = "task_accounting_benchmark"
+    items_per_response = 1
+
+    def parse_plain(self, response, **kwargs):
+        for i in range(self.items_per_response):
+            yield BenchmarkItem(value=i)
+
+    parse = rmq_callback(parse_plain)
+
+
+class CountingAccountant(TaskAccountant):
+    """Updates TaskObserver counters the same way RPCTaskConsumer does"""
+
+    def __init__(self, delivery_tag_meta_key):
+        self.delivery_tag_meta_key = delivery_tag_meta_key
+
+    def on_item_scheduled(self, response, spider, delivery_tag):
+        if response is not None and spider is not None:
+            if not delivery_tag:
+                delivery_tag = response.meta.get(self.delivery_tag_meta_key, None)
+            spider.processing_tasks.handle_item_scheduled(delivery_tag)
+
+    def on_callback_completed(self, response=None, spider=None, delivery_tag=None):
+        if response is not None and spider is not None:
+            spider.processing_tasks.handle_response(delivery_tag, response.status)
+
+
+def build_spider(direct):
+    crawler = get_crawler(BenchmarkSpider)
+    spider = BenchmarkSpider.from_crawler(crawler)
+    crawler.spider = spider
+    spider.processing_tasks = TaskObserver()
+    delivery_tag_meta_key = RMQConstants.DELIVERY_TAG_META_KEY.value
+    accountant = CountingAccountant(delivery_tag_meta_key)
+    if direct:
+        set_task_accountant(spider, accountant)
+    else:
+        crawler.signals.connect(accountant.on_item_scheduled, signal=item_scheduled)
+        crawler.signals.connect(accountant.on_callback_completed, signal=callback_completed)
+
+    consumed_data = {
+        "method": SimpleNamespace(delivery_tag=1),
+        "properties": SimpleNamespace(reply_to=None, headers=None),
+        "body": "{}",
+    }
+    spider.processing_tasks.add_task(Task(consumed_data))
+    request = Request("https://example.com", meta={delivery_tag_meta_key: 1})
+    response = HtmlResponse("https://example.com", body=b"", request=request)
+    return spider, response
+
+
+def run(direct, items, repeat, plain=False):
+    spider, response = build_spider(direct)
+    spider.items_per_response = items
+    callback = spider.parse_plain if plain else spider.parse
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _item in callback(response):
+            pass
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # undecorated callback cost (item creation) is subtracted to get accounting overhead only
+    baseline = run(False, args.items, args.repeat, plain=True)
+    signals_cost = run(False, args.items, args.repeat) - baseline
+    direct_cost = run(True, args.items, args.repeat) - baseline
+    print(f"baseline: {baseline * 1e6:.2f} us/item (undecorated callback)")
+    print(f"signals:  {signals_cost * 1e6:.2f} us/item accounting overhead")
+    print(f"direct:   {direct_cost * 1e6:.2f} us/item accounting overhead")
+    print(f"speedup:  {signals_cost / direct_cost:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
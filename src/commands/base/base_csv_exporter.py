@@ -1,26 +1,36 @@
-import csv
 import datetime
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 from optparse import Values
 from os import path
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Union
 
-from MySQLdb.cursors import DictCursor
-from sqlalchemy import select, Table
+import MySQLdb
+from MySQLdb.cursors import DictCursor, SSDictCursor
+from sqlalchemy import and_, func, literal, or_, select, text, Table
 from sqlalchemy.dialects.mysql import dialect
 from sqlalchemy.sql import update
 from sqlalchemy.sql.base import Executable as SQLAlchemyExecutable
 from twisted.enterprise import adbapi
 from twisted.enterprise.adbapi import Transaction
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, threads
 
 from commands.base import BaseCommand
+from commands.base.export_shards import assemble_parts, export_shard, split_id_range
+from commands.base.export_watermark import ExportWatermark
+from commands.base.export_writers import BaseExportWriter, get_export_writer
 
 
 class BaseCSVExporter(BaseCommand):
     table: Table
     file_timestamp_format: str = '%Y%b%d%H%M%S'
     export_date_column: str = 'sent_to_customer'
+    # export format: csv, csv.gz, csv.zst, jsonl, jsonl.gz, jsonl.zst, parquet
+    # (EXPORT_FILE_EXTENSION setting overrides it). Parquet file is complete only when it is closed,
+    # so its rows are marked as exported (watermark is saved) after export is finished
     file_extension: str = 'csv'
     chunk_size: int = 1000
     excluded_columns: List[str] = []
@@ -31,15 +41,80 @@ class BaseCSVExporter(BaseCommand):
     filename_postfix: str = ''
     file_path: str = ''
     file_exists: bool = False
+    writer: Optional[BaseExportWriter] = None
+    # streaming mode: rows are read by server-side cursor and written to one open file,
+    # exported flags are updated in background per stream_buffer_size rows
+    streaming: bool = False
+    stream_buffer_size: int = 10000
+    max_pending_updates: int = 4
+    # watermark mode: rows past persisted (watermark_column, id) position are streamed,
+    # source rows are not updated. Rows updated within last watermark_lag seconds wait for next run
+    use_watermark: bool = False
+    watermark_column: str = 'updated_at'
+    watermark_lag: int = 1
+    # parallel mode: id space is split into parallel_shards * ranges_per_shard ranges, exported
+    # by parallel_shards worker processes (own DB connections) into part files joined in id order
+    parallel_shards: int = 0
+    ranges_per_shard: int = 4
+    write_header: bool = True
 
     def init(self) -> None:
         if not isinstance(self.table.__table__, Table):
             raise ValueError(f'{type(self).__name__} must have a valid table object')
+        self.file_extension = self.settings.get('EXPORT_FILE_EXTENSION') or self.file_extension
+        self.writer_class = get_export_writer(self.file_extension)
         self.file_path = self.get_file_path()
         self.init_db_connection_pool()
+        self._pending_updates = set()
+        self._update_connection = None
+        self._updates_semaphore = threading.BoundedSemaphore(self.max_pending_updates)
+        # ids of rows written by writer without durable flush, marked after writer is closed
+        self._written_ids: List[List[int]] = []
         self.logger.debug('Connection established.')
 
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            '--streaming',
+            action='store_true',
+            default=False,
+            dest='streaming',
+            help='Stream rows by server-side cursor instead of chunked queries',
+        )
+        parser.add_argument(
+            '--watermark',
+            action='store_true',
+            default=False,
+            dest='use_watermark',
+            help='Export rows updated after last exported row, source rows are not marked',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=0,
+            dest='parallel_shards',
+            help='Count of worker processes exporting id ranges in parallel',
+        )
+
     def produce_data(self) -> None:
+        if self.parallel_shards > 1:
+            if self.use_watermark:
+                raise ValueError('Parallel export is not supported in watermark mode')
+            d = self.db_connection_pool.runInteraction(self.get_id_bounds)
+            d.addCallback(self._export_shards)
+            d.addErrback(self._on_data_export_error)
+            d.addBoth(lambda _: reactor.stop())
+            return
+        if self.use_watermark:
+            if self.watermark_column not in self.table.__table__.columns:
+                raise ValueError(f'Column "{self.watermark_column}" is not found in the table.')
+            self.watermark = ExportWatermark(self.get_watermark_path())
+        if self.streaming or self.use_watermark:
+            self.init_stream_connection_pool()
+            d = self.stream_connection_pool.runInteraction(self.stream_data)
+            d.addErrback(self._on_data_export_error)
+            d.addBoth(self._on_stream_finished)
+            return
         d = self.db_connection_pool.runInteraction(self.get_data, self.chunk_size)
         d.addCallback(self.export).addErrback(self._on_data_export_error)
 
@@ -47,6 +122,12 @@ class BaseCSVExporter(BaseCommand):
         if chunk_size is None:
             chunk_size = self.chunk_size
         stmt = self.build_select_query_stmt(chunk_size)
+        if not self.writer_class.durable_flush:
+            # written rows are not marked yet: chunks are selected in id order past last written row
+            id_column = self.table.__table__.columns.id
+            if self._written_ids:
+                stmt = stmt.where(id_column > self._written_ids[-1][-1])
+            stmt = stmt.order_by(id_column)
         if isinstance(stmt, SQLAlchemyExecutable):
             stmt_compiled = stmt.compile(compile_kwargs={"literal_binds": True}, dialect=dialect())
             transaction.execute(str(stmt_compiled))
@@ -56,38 +137,133 @@ class BaseCSVExporter(BaseCommand):
 
     def export(self, rows: Union[tuple, Dict]) -> None:
         if not rows:
+            try:
+                self.close_writer()
+            except Exception as exc:
+                self.logger.error(f'Export to {self.file_path} failed: {exc!r}')
+                reactor.stop()
+                return
             if self.file_exists:
                 self.logger.debug(f'Export finished successfully to {path.basename(self.file_path)}.')
             else:
                 self.logger.warning('Nothing found')
+            if self._written_ids:
+                written_ids, self._written_ids = self._written_ids, []
+                d = self.db_connection_pool.runInteraction(self.mark_exported_chunks, written_ids)
+                d.addErrback(self._on_row_update_error)
+                d.addBoth(lambda _: reactor.stop())
+                return
             reactor.stop()
         else:
             if self.chunk_size == 1:
                 rows = [rows]
             else:
                 rows = list(rows)
+            # ids are collected before mapping: "id" column may be renamed
+            ids = self.get_row_ids(rows)
             rows = self.map_columns(rows)
             self.get_headers(rows[0])
-            self.save(rows)
-            deferred_interactions = []
-            for row in rows:
-                deferred_interactions.append(self.db_connection_pool.runInteraction(self.update, row))
-            deferred_list = defer.DeferredList(deferred_interactions, consumeErrors=True)
-            deferred_list.addCallback(self._on_row_update_completed)
-            deferred_list.addErrback(self._on_row_update_error)
+            try:
+                self.save(rows)
+            except Exception as exc:
+                # rows of partially written chunk are not marked, they are exported again next run
+                self.logger.error(f'Export to {self.file_path} failed: {exc!r}')
+                self.close_writer()
+                reactor.stop()
+                return
+            if not self.writer_class.durable_flush:
+                self._written_ids.append(ids)
+                self._on_row_update_completed()
+                return
+            d = self.db_connection_pool.runInteraction(self.mark_exported, ids)
+            d.addCallback(self._on_row_update_completed)
+            d.addErrback(self._on_chunk_update_error)
+
+    def stream_data(self, transaction: Transaction, id_range: Optional[tuple] = None) -> int:
+        """Runs in connection pool thread, blocks on bounded count of pending updates"""
+        if self.use_watermark:
+            stmt = self.build_watermark_query_stmt(self.watermark.load())
+        else:
+            stmt = self.build_select_query_stmt(None)
+        if id_range is not None:
+            id_column = self.table.__table__.columns.id
+            stmt = stmt.where(id_column >= id_range[0], id_column < id_range[1])
+        stmt_compiled = stmt.compile(compile_kwargs={"literal_binds": True}, dialect=dialect())
+        transaction.execute(str(stmt_compiled))
+        rows_count = 0
+        position = None
+        try:
+            while rows := transaction.fetchmany(self.stream_buffer_size):
+                rows = list(rows)
+                if self.use_watermark:
+                    position = rows[-1][self.watermark_column], rows[-1]['id']
+                    self.strip_hidden_columns(rows)
+                else:
+                    ids = self.get_row_ids(rows)
+                rows = self.map_columns(rows)
+                self.get_headers(rows[0])
+                # rows are marked as exported only after they are written
+                self.save(rows)
+                rows_count += len(rows)
+                if not self.writer_class.durable_flush:
+                    if not self.use_watermark:
+                        self._written_ids.append(ids)
+                elif self.use_watermark:
+                    self.watermark.save(*position)
+                else:
+                    self.mark_streamed_rows(ids)
+        finally:
+            # rows of not durable writer are marked only if it is closed successfully
+            written_ids, self._written_ids = self._written_ids, []
+            self.close_writer()
+        if not self.writer_class.durable_flush:
+            if self.use_watermark and position is not None:
+                self.watermark.save(*position)
+            for ids in written_ids:
+                self.mark_streamed_rows(ids)
+        return rows_count
+
+    def mark_streamed_rows(self, ids: List[int]) -> None:
+        """Synchronously by separate connection in shard worker, otherwise in background"""
+        if self._update_connection is not None:
+            self.mark_exported(self._update_connection.cursor(), ids)
+            self._update_connection.commit()
+        else:
+            self._updates_semaphore.acquire()
+            reactor.callFromThread(self._schedule_mark_exported, ids)
+
+    def mark_exported(self, transaction: Transaction, ids: List[int]) -> None:
+        """Marks whole chunk by single statement in single transaction"""
+        if not ids:
+            return
+        stmt = self.build_bulk_update_query_stmt(ids)
+        stmt_compiled = stmt.compile(compile_kwargs={'literal_binds': True})
+        transaction.execute(str(stmt_compiled))
+
+    def mark_exported_chunks(self, transaction: Transaction, id_chunks: List[List[int]]) -> None:
+        for ids in id_chunks:
+            self.mark_exported(transaction, ids)
 
     def save(self, rows: List[Dict]) -> None:
-        with open(self.file_path, 'a', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=self.headers)
-            if not self.file_exists:
-                writer.writeheader()
-                self.file_exists = True
+        """Writer is opened by first chunk and kept open until export is finished"""
+        if self.writer is None:
             self.logger.debug(f'Exporting to {self.file_path}...')
-            writer.writerows(rows)
+            writer = self.writer_class(
+                self.file_path, self.headers, self.get_column_types(), self.write_header
+            )
+            writer.open()
+            self.writer = writer
+            self.file_exists = True
+        self.writer.write_rows(rows)
+        self.writer.flush()
 
-    def init_db_connection_pool(self) -> None:
-        self.db_connection_pool = adbapi.ConnectionPool(
-            "MySQLdb",
+    def close_writer(self) -> None:
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+
+    def get_db_connection_kwargs(self) -> Dict:
+        return dict(
             host=self.settings.get("DB_HOST"),
             port=self.settings.getint("DB_PORT"),
             user=self.settings.get("DB_USERNAME"),
@@ -95,26 +271,141 @@ class BaseCSVExporter(BaseCommand):
             db=self.settings.get("DB_DATABASE"),
             charset="utf8mb4",
             use_unicode=True,
-            cursorclass=DictCursor,
+        )
+
+    def init_db_connection_pool(self) -> None:
+        self.db_connection_pool = adbapi.ConnectionPool(
+            "MySQLdb", cursorclass=DictCursor, cp_reconnect=True, **self.get_db_connection_kwargs()
+        )
+
+    def init_stream_connection_pool(self) -> None:
+        """Single connection pool with unbuffered cursor: result set isn't loaded into memory"""
+        self.stream_connection_pool = adbapi.ConnectionPool(
+            "MySQLdb",
+            cursorclass=SSDictCursor,
+            cp_min=1,
+            cp_max=1,
             cp_reconnect=True,
+            **self.get_db_connection_kwargs(),
         )
 
-    def build_select_query_stmt(self, chunk_size: int) -> SQLAlchemyExecutable:
+    def get_id_bounds(self, transaction: Transaction) -> Optional[tuple]:
+        id_column = self.table.__table__.columns.id
+        stmt = select(
+            func.min(id_column).label('min_id'), func.max(id_column).label('max_id')
+        ).where(self.table.sent_to_customer == None)
+        stmt_compiled = stmt.compile(compile_kwargs={"literal_binds": True}, dialect=dialect())
+        transaction.execute(str(stmt_compiled))
+        row = transaction.fetchone()
+        if not row or row['min_id'] is None:
+            return None
+        return row['min_id'], row['max_id']
+
+    def prepare_shard(self, file_extension: str, part_path: str) -> None:
+        """Called in shard worker process, header is written once by parent process"""
+        self.file_extension = file_extension
+        self.writer_class = get_export_writer(file_extension)
+        self.file_path = part_path
+        self.write_header = False
+
+    def export_id_range(self, id_from: int, id_to: int) -> tuple:
+        """Runs in shard worker process: chunks are marked synchronously by separate connection
+        (unbuffered cursor connection is busy until result set is read)"""
+        connection_kwargs = self.get_db_connection_kwargs()
+        stream_connection = MySQLdb.connect(cursorclass=SSDictCursor, **connection_kwargs)
+        self._update_connection = MySQLdb.connect(cursorclass=DictCursor, **connection_kwargs)
+        try:
+            rows_count = self.stream_data(stream_connection.cursor(), (id_from, id_to))
+        finally:
+            stream_connection.close()
+            self._update_connection.close()
+            self._update_connection = None
+        return rows_count, self.headers
+
+    def get_part_path(self, index: int) -> str:
+        base_path = self.file_path[: -len(self.file_extension) - 1]
+        return f'{base_path}.part{index:04d}.{self.file_extension}'
+
+    def run_shards(self, id_ranges: List[tuple]) -> int:
+        """Runs in reactor thread pool, waits for worker processes"""
+        command_path = f'{type(self).__module__}.{type(self).__qualname__}'
+        part_paths = [self.get_part_path(index) for index in range(len(id_ranges))]
+        rows_count, headers = 0, None
+        # spawn: worker processes mustn't inherit reactor threads
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.parallel_shards, mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    export_shard, command_path, self.file_extension, part_path, id_range
+                )
+                for part_path, id_range in zip(part_paths, id_ranges)
+            ]
+            for future, part_path, id_range in zip(futures, list(part_paths), id_ranges):
+                try:
+                    shard_rows_count, shard_headers = future.result()
+                except Exception as exc:
+                    self.logger.error(f'Export of ids {id_range} failed: {exc!r}')
+                    if not self.writer_class.durable_flush:
+                        # rows of failed shard are not marked and part may be truncated (killed worker),
+                        # they are exported again by next run
+                        part_paths.remove(part_path)
+                        if path.exists(part_path):
+                            os.remove(part_path)
+                    # otherwise exported chunks of failed shard are marked, its part is assembled too
+                    continue
+                rows_count += shard_rows_count
+                headers = headers or shard_headers or None
+        if headers is None:
+            return 0
+        assemble_parts(self.writer_class, self.file_path, headers, part_paths)
+        return rows_count
+
+    def build_select_query_stmt(self, chunk_size: Optional[int]) -> SQLAlchemyExecutable:
+        """chunk_size None means select without limit (streaming mode)"""
         if columns := self.specify_columns():
-            return select(*columns).limit(chunk_size).where(self.table.sent_to_customer == None)
+            stmt = select(*columns).where(self.table.sent_to_customer == None)
         else:
-            return select(self.table).limit(chunk_size).where(self.table.sent_to_customer == None)
+            stmt = select(self.table).where(self.table.sent_to_customer == None)
+        if chunk_size is not None:
+            stmt = stmt.limit(chunk_size)
+        return stmt
 
-    def update(self, transaction: Transaction, row: Dict) -> None:
-        stmt = self.build_update_query_stmt(row)
-        if isinstance(stmt, SQLAlchemyExecutable):
-            stmt_compiled = stmt.compile(compile_kwargs={'literal_binds': True})
-            transaction.execute(str(stmt_compiled))
+    def build_watermark_query_stmt(self, position: Optional[tuple]) -> SQLAlchemyExecutable:
+        """Rows are ordered by (watermark_column, id) index, watermark column is selected always"""
+        columns = self.specify_columns() or list(self.table.__table__.columns)
+        watermark_column = self.table.__table__.columns[self.watermark_column]
+        id_column = self.table.__table__.columns.id
+        self._hidden_columns = []
+        if self.watermark_column not in {column.key for column in columns}:
+            columns.append(watermark_column)
+            self._hidden_columns.append(self.watermark_column)
+        # rows of current second may be not committed yet
+        cutoff = func.date_sub(func.now(), text(f'INTERVAL {int(self.watermark_lag)} SECOND'))
+        stmt = select(*columns).where(watermark_column < cutoff)
+        if position is not None:
+            last_updated_at, last_id = position
+            last_updated_at = literal(last_updated_at.isoformat(sep=' '))
+            stmt = stmt.where(
+                or_(
+                    watermark_column > last_updated_at,
+                    and_(watermark_column == last_updated_at, id_column > last_id),
+                )
+            )
+        return stmt.order_by(watermark_column, id_column)
 
-    def build_update_query_stmt(self, row: Dict) -> SQLAlchemyExecutable:
+    def strip_hidden_columns(self, rows: List[Dict]) -> None:
+        for row in rows:
+            for column_name in self._hidden_columns:
+                row.pop(column_name, None)
+
+    def build_bulk_update_query_stmt(self, ids: List[int]) -> SQLAlchemyExecutable:
+        """Marks exported rows of chunk, override it to set other columns"""
         export_date = {self.export_date_column: date.today().strftime('%Y-%m-%d')}
-        update_date_stmt = update(self.table).values(**export_date)
-        return update_date_stmt.where(self.table.id == row['id'])
+        return update(self.table).values(**export_date).where(self.table.id.in_(ids))
+
+    @staticmethod
+    def get_row_ids(rows: List[Dict]) -> List[int]:
+        return [row['id'] for row in rows]
 
     def map_columns(self, rows: List[Dict]) -> List[Dict]:
         if self.new_mapping:
@@ -145,6 +436,11 @@ class BaseCSVExporter(BaseCommand):
             return columns
         return None
 
+    def get_column_types(self) -> Dict:
+        """Column types by exported (mapped) names, used by typed formats (parquet)"""
+        columns = self.specify_columns() or list(self.table.__table__.columns)
+        return {self.new_mapping.get(column.key, column.key): column.type for column in columns}
+
     def get_headers(self, row: Dict) -> None:
         if not self.headers:
             self.headers = list(row.keys())
@@ -163,15 +459,54 @@ class BaseCSVExporter(BaseCommand):
         return path.join(export_path, file_name)
 
     def run(self, args: Values, opts: List) -> None:
+        if getattr(opts, 'streaming', False):
+            self.streaming = True
+        if getattr(opts, 'use_watermark', False):
+            self.use_watermark = True
+        if getattr(opts, 'parallel_shards', 0):
+            self.parallel_shards = opts.parallel_shards
         reactor.callFromThread(self.produce_data)
         reactor.run()
 
+    def get_watermark_path(self) -> str:
+        return path.join(path.abspath('..'), 'storage', 'watermarks', f'{type(self).__name__}.json')
+
     def add_postfix(self, file):
         return file + self.filename_postfix
 
     def _on_row_update_completed(self, _result=None):
         reactor.callFromThread(self.produce_data)
 
+    def _schedule_mark_exported(self, ids: List[int]) -> None:
+        d = self.db_connection_pool.runInteraction(self.mark_exported, ids)
+        self._pending_updates.add(d)
+        d.addErrback(self._on_row_update_error)
+        d.addBoth(self._on_rows_update_finished, d)
+
+    def _on_rows_update_finished(self, _result, d) -> None:
+        self._pending_updates.discard(d)
+        self._updates_semaphore.release()
+
+    def _export_shards(self, id_bounds: Optional[tuple]):
+        if id_bounds is None:
+            self.logger.warning('Nothing found')
+            return None
+        id_ranges = split_id_range(*id_bounds, self.parallel_shards * self.ranges_per_shard)
+        d = threads.deferToThread(self.run_shards, id_ranges)
+        d.addCallback(self._log_export_result)
+        return d
+
+    def _log_export_result(self, rows_count: Optional[int]) -> None:
+        if rows_count:
+            self.logger.info(f'{rows_count} rows exported to {path.basename(self.file_path)}.')
+        elif rows_count == 0:
+            self.logger.warning('Nothing found')
+
+    def _on_stream_finished(self, rows_count: Optional[int]) -> None:
+        self._log_export_result(rows_count)
+        d = defer.DeferredList(list(self._pending_updates), consumeErrors=True)
+        d.addBoth(lambda _: reactor.stop())
+
     def _on_data_export_error(self, failure):
         self.logger.error("failure: {}".format(failure.getErrorMessage()))
         failure.trap(Exception)
@@ -179,3 +514,9 @@ class BaseCSVExporter(BaseCommand):
     def _on_row_update_error(self, failure):
         self.logger.error("failure: {}".format(failure.getErrorMessage()))
         failure.trap(Exception)
+
+    def _on_chunk_update_error(self, failure):
+        """Unmarked chunk would be selected again, so chunked export is stopped"""
+        self._on_row_update_error(failure)
+        self.close_writer()
+        reactor.stop()
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+from importlib import import_module
+from typing import List, Tuple, Type
+
+from commands.base.export_writers import BaseExportWriter, path_has_data
+
+
+def split_id_range(min_id: int, max_id: int, count: int) -> List[Tuple[int, int]]:
+    """Half-open [id_from, id_to) ranges of equal width"""
+    step = max(1, -(-(max_id - min_id + 1) // count))
+    return [(start, min(start + step, max_id + 1)) for start in range(min_id, max_id + 1, step)]
+
+
+def export_shard(
+    command_path: str, file_extension: str, part_path: str, id_range: Tuple[int, int]
+) -> Tuple[int, List[str]]:
+    """Shard worker process entry point: command is instantiated by import path"""
+    module_name, class_name = command_path.rsplit('.', 1)
+    exporter = getattr(import_module(module_name), class_name)()
+    exporter._init()
+    exporter.init()
+    exporter.prepare_shard(file_extension, part_path)
+    return exporter.export_id_range(*id_range)
+
+
+def assemble_parts(
+    writer_class: Type[BaseExportWriter], file_path: str, headers: List[str], part_paths: List[str]
+) -> List[str]:
+    """Concatenates parts in id order after single header (gzip members and zstd frames
+    may be concatenated). Parts of other formats are kept and listed in manifest file"""
+    part_paths = [part_path for part_path in part_paths if path_has_data(part_path)]
+    if not part_paths:
+        return []
+    if not writer_class.concatenable:
+        with open(f'{file_path}.manifest.json', 'w', encoding='utf-8') as file:
+            json.dump({'parts': [os.path.basename(part_path) for part_path in part_paths]}, file)
+        return part_paths
+    header_writer = writer_class(file_path, headers)
+    header_writer.open()
+    header_writer.close()
+    with open(file_path, 'ab') as file:
+        for part_path in part_paths:
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, file, 1024 * 1024)
+        file.flush()
+        os.fsync(file.fileno())
+    for part_path in part_paths:
+        os.remove(part_path)
+    return part_paths
@@ -0,0 +1,36 @@
+import datetime
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+
+class ExportWatermark:
+    """Persisted (updated_at, id) position of last exported row.
+
+    File is replaced atomically, so it holds either previous or new position after a crash.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def load(self) -> Optional[Tuple[datetime.datetime, int]]:
+        if not os.path.exists(self.file_path):
+            return None
+        with open(self.file_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return datetime.datetime.fromisoformat(data['updated_at']), int(data['id'])
+
+    def save(self, updated_at: datetime.datetime, row_id: int) -> None:
+        directory = os.path.dirname(self.file_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.watermark-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({'updated_at': updated_at.isoformat(), 'id': row_id}, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,237 @@
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import json
+import os
+from typing import Callable, Dict, List, Optional, Type
+
+from sqlalchemy import types as sqltypes
+
+
+def _import_optional(module_name: str, extra: str):
+    """Optional dependencies are imported only when their format is requested"""
+    try:
+        return __import__(module_name, fromlist=['_'])
+    except ImportError as exc:
+        raise ImportError(
+            f'"{module_name}" package is required for this export format, '
+            f'install it with "poetry install -E {extra}"'
+        ) from exc
+
+
+class BaseExportWriter:
+    """Streaming writer: opened once per export, rows are written by chunks.
+
+    If durable_flush is set, flush() makes written rows durable, so they can be marked as exported
+    after it. Otherwise rows are durable only after close(), exporter marks them after it.
+    Files of concatenable formats may be joined byte by byte (parallel export parts).
+    """
+
+    concatenable: bool = False
+    durable_flush: bool = False
+
+    def __init__(
+        self,
+        file_path: str,
+        fieldnames: List[str],
+        column_types: Optional[Dict] = None,
+        write_header: bool = True,
+    ):
+        self.file_path = file_path
+        self.fieldnames = fieldnames
+        self.column_types = column_types or {}
+        self.write_header = write_header
+
+    def open(self) -> None:
+        raise NotImplementedError('"open" method must be overridden')
+
+    def write_rows(self, rows: List[Dict]) -> None:
+        raise NotImplementedError('"write_rows" method must be overridden')
+
+    def flush(self) -> None:
+        raise NotImplementedError('"flush" method must be overridden')
+
+    def close(self) -> None:
+        raise NotImplementedError('"close" method must be overridden')
+
+
+class TextExportWriter(BaseExportWriter):
+    """Line based formats, file is appended (compressed files get new gzip member / zstd frame).
+
+    Compressed data is flushed, but gzip member / zstd frame is completed only on close, so rows of
+    compressed files are durable after close.
+    """
+
+    compression: Optional[str] = None
+    concatenable = True
+    durable_flush = True
+
+    def open(self) -> None:
+        zstandard = _import_optional('zstandard', 'zstd') if self.compression == 'zstd' else None
+        self.is_new_file = not path_has_data(self.file_path)
+        self._raw_file = open(self.file_path, 'ab')
+        if self.compression == 'gzip':
+            self._compressed_file = gzip.GzipFile(fileobj=self._raw_file, mode='ab')
+        elif zstandard is not None:
+            self._compressed_file = zstandard.ZstdCompressor().stream_writer(
+                self._raw_file, closefd=False
+            )
+        else:
+            self._compressed_file = None
+        self._file = io.TextIOWrapper(self._compressed_file or self._raw_file, encoding='utf-8')
+
+    def flush(self) -> None:
+        # compressed data is flushed (gzip sync flush / zstd block), member or frame isn't finished
+        self._file.flush()
+        self._raw_file.flush()
+        os.fsync(self._raw_file.fileno())
+
+    def close(self) -> None:
+        self._file.flush()
+        # TextIOWrapper.close closes wrapped streams: gzip member/zstd frame is finished there
+        self._file.close()
+        if not self._raw_file.closed:
+            self._raw_file.close()
+
+
+class CSVExportWriter(TextExportWriter):
+    def open(self) -> None:
+        super().open()
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+        if self.is_new_file and self.write_header:
+            self._writer.writeheader()
+
+    def write_rows(self, rows: List[Dict]) -> None:
+        self._writer.writerows(rows)
+
+
+class GzipCSVExportWriter(CSVExportWriter):
+    compression = 'gzip'
+    durable_flush = False
+
+
+class ZstdCSVExportWriter(CSVExportWriter):
+    compression = 'zstd'
+    durable_flush = False
+
+
+class JsonLinesExportWriter(TextExportWriter):
+    def write_rows(self, rows: List[Dict]) -> None:
+        self._file.writelines(
+            json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows
+        )
+
+
+class GzipJsonLinesExportWriter(JsonLinesExportWriter):
+    compression = 'gzip'
+    durable_flush = False
+
+
+class ZstdJsonLinesExportWriter(JsonLinesExportWriter):
+    compression = 'zstd'
+    durable_flush = False
+
+
+class ParquetExportWriter(BaseExportWriter):
+    """Each chunk is written as row group. File footer is written on close,
+    so file is readable only after export is finished and its rows are marked after close"""
+
+    compression: str = 'zstd'
+
+    def open(self) -> None:
+        self._pa = _import_optional('pyarrow', 'parquet')
+        self._pq = _import_optional('pyarrow.parquet', 'parquet')
+        self._schema, self._converters = self.build_schema()
+        self._writer = None
+
+    def build_schema(self):
+        """Arrow schema from sqlalchemy column types, None - schema is inferred from first chunk"""
+        if not self.column_types:
+            return None, {}
+        fields, converters = [], {}
+        for name in self.fieldnames:
+            arrow_type, converter = self.arrow_type(self.column_types.get(name))
+            fields.append(self._pa.field(name, arrow_type))
+            if converter is not None:
+                converters[name] = converter
+        return self._pa.schema(fields), converters
+
+    def arrow_type(self, column_type) -> tuple:
+        pa = self._pa
+        if isinstance(column_type, sqltypes.Boolean):
+            # mysql returns tinyint(1) as int
+            return pa.bool_(), bool
+        if isinstance(column_type, sqltypes.Integer):
+            return pa.int64(), None
+        if isinstance(column_type, sqltypes.Float):
+            return pa.float64(), None
+        if isinstance(column_type, sqltypes.Numeric) and column_type.precision:
+            return pa.decimal128(column_type.precision, column_type.scale or 0), decimal.Decimal
+        if isinstance(column_type, sqltypes.DateTime):
+            return pa.timestamp('us'), None
+        if isinstance(column_type, sqltypes.Date):
+            return pa.date32(), _to_date
+        if isinstance(column_type, sqltypes.LargeBinary):
+            return pa.binary(), None
+        return pa.string(), _to_string
+
+    def write_rows(self, rows: List[Dict]) -> None:
+        if self._converters:
+            for row in rows:
+                for name, converter in self._converters.items():
+                    if row.get(name) is not None:
+                        row[name] = converter(row[name])
+        table = self._pa.Table.from_pylist(rows, schema=self._schema)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = self._pq.ParquetWriter(
+                self.file_path, self._schema, compression=self.compression
+            )
+        self._writer.write_table(table, row_group_size=len(rows))
+
+    def flush(self) -> None:
+        # row groups are not readable without footer
+        pass
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _to_string(value) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=str) if isinstance(value, (dict, list)) else str(value)
+
+
+def _to_date(value) -> datetime.date:
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def path_has_data(file_path: str) -> bool:
+    return os.path.exists(file_path) and os.path.getsize(file_path) > 0
+
+
+EXPORT_WRITERS: Dict[str, Type[BaseExportWriter]] = {
+    'csv': CSVExportWriter,
+    'csv.gz': GzipCSVExportWriter,
+    'csv.zst': ZstdCSVExportWriter,
+    'jsonl': JsonLinesExportWriter,
+    'jsonl.gz': GzipJsonLinesExportWriter,
+    'jsonl.zst': ZstdJsonLinesExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+def get_export_writer(file_extension: str) -> Callable[..., BaseExportWriter]:
+    try:
+        return EXPORT_WRITERS[file_extension]
+    except KeyError:
+        raise ValueError(
+            f'Export format "{file_extension}" is not supported, use one of: '
+            f'{", ".join(EXPORT_WRITERS)}'
+        )
@@ -0,0 +1,49 @@
+from optparse import Values
+from typing import List
+
+from commands.base import BaseCommand
+from utils import PackFileStorage
+
+
+class Command(BaseCommand):
+    """Rewrites live records of pack files with deleted/duplicate/torn records and merges index"""
+
+    requires_project = True
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return 'Compact pack file storage'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            '--folder',
+            default=None,
+            dest='folder',
+            help='Pack storage folder (PACK_STORAGE_FOLDER setting by default)',
+        )
+        parser.add_argument(
+            '--min-garbage-ratio',
+            type=float,
+            default=0.3,
+            dest='min_garbage_ratio',
+            help='Packs with smaller share of garbage are kept as is',
+        )
+
+    def init(self) -> None:
+        pass
+
+    def run(self, args: List[str], opts: Values) -> None:
+        folder = opts.folder or self.settings.get('PACK_STORAGE_FOLDER')
+        # writer lock: fails if storage is used by running spider
+        storage = PackFileStorage(folder, self.settings.getint('PACK_STORAGE_MAX_PACK_SIZE'))
+        try:
+            stats = storage.compact(opts.min_garbage_ratio)
+        finally:
+            storage.close()
+        self.logger.info(
+            f'{stats["packs_compacted"]} packs compacted, {stats["records_moved"]} records moved, '
+            f'{stats["bytes_reclaimed"]} bytes reclaimed'
+        )
@@ -0,0 +1,5 @@
+from rmq.commands import RmqBenchmark
+
+
+class Command(RmqBenchmark):
+    """Usage: scrapy rmq_benchmark -n 10000 -i 1 [--live]"""
@@ -27,5 +27,7 @@ class FeedbooksBook(Base, MysqlTimestampsMixin, MysqlPrimaryKeyMixin):
     price = Column('price', FLOAT(10, 2), nullable=True)
     currency = Column('currency', String(3), unique=False, nullable=True)
     image_url = Column('image_url', TEXT, unique=False, nullable=True)
-    # image_filename = Column('image_filename', String(255), unique=False, nullable=True)
+    image_filename = Column('image_filename', String(255), unique=False, nullable=True)
+    # image_url of stored image_filename, image_url is overwritten by re-crawl
+    image_filename_url = Column('image_filename_url', TEXT, unique=False, nullable=True)
 
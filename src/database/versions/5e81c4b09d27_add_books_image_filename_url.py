@@ -0,0 +1,24 @@
+"""add_books_image_filename_url
+
+Revision ID: 5e81c4b09d27
+Revises: 9c3f2a7d51b8
+Create Date: 2026-10-19 15:21:08.304716
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5e81c4b09d27'
+down_revision = '9c3f2a7d51b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('books', sa.Column('image_filename_url', sa.Text, nullable=True))
+
+
+def downgrade():
+    op.drop_column('books', 'image_filename_url')
@@ -0,0 +1,24 @@
+"""add_books_image_filename
+
+Revision ID: 9c3f2a7d51b8
+Revises: 44515769e0f3
+Create Date: 2026-10-19 12:04:37.512930
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3f2a7d51b8'
+down_revision = '44515769e0f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('books', sa.Column('image_filename', sa.String(255), nullable=True))
+
+
+def downgrade():
+    op.drop_column('books', 'image_filename')
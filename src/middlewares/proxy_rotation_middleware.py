@@ -1,13 +1,28 @@
 from scrapy import Spider, Request, Spider, signals
+from scrapy.core.downloader.handlers.http11 import TunnelError
+from scrapy.http import Response
 import logging
-from datetime import datetime, timedelta
-import random
 import json
-from w3lib.http import basic_auth_header
+from twisted.internet import defer, error
+from twisted.web.client import ResponseFailed
 from pathlib import Path
 
+from utils import ProxyPool
+
 logger = logging.getLogger('proxy_rotation')
 
+# download errors caused by proxy
+PROXY_EXCEPTIONS = (
+    defer.TimeoutError,
+    error.TimeoutError,
+    error.TCPTimedOutError,
+    error.ConnectionRefusedError,
+    error.ConnectError,
+    error.ConnectionLost,
+    ResponseFailed,
+    TunnelError,
+)
+
 class ProxyMode:
     RANDOMIZE_EVERY_REQUESTS = 1
     IN_ORDER_EVERY_REQUESTS = 2
@@ -28,16 +43,32 @@ class ProxyRotationMiddleware:
             proxy_mode=1 or 2
         Do not use a proxy for the spider:
             proxy_enabled=False
+
+    Proxies are selected from ProxyPool by health score. Responses with PROXY_BAN_HTTP_CODES or
+    PROXY_BAN_MARKERS in body and connection errors put proxy into exponential cooldown,
+    banned requests are retried with another proxy (up to PROXY_BAN_MAX_RETRIES times).
+    Per-proxy stats: proxy_pool/<host:port>/(success|bans|errors|cooldowns|score|latency)
     """
 
+    ban_retries_meta_key = 'proxy_ban_retries'
+
     logging_enabled = True
 
-    def __init__(self, settings) -> None:
+    def __init__(self, settings, stats=None) -> None:
         self.mode: int = int(settings['PROXY_MODE']) if settings['PROXY_MODE'] else None
         self.proxy: str = settings['PROXY']
         self.proxy_auth: str = settings['PROXY_AUTH']
         self.proxy_enabled: bool = bool(settings['PROXY_ENABLED']) if settings['PROXY_ENABLED'] else None
         self.proxy_list: list = self.get_proxy_list(settings)
+        self.stats = stats
+        self.ban_http_codes = {int(code) for code in settings.getlist('PROXY_BAN_HTTP_CODES', [403, 429])}
+        self.ban_markers = [marker.encode() for marker in settings.getlist('PROXY_BAN_MARKERS', [])]
+        self.ban_max_retries: int = settings.getint('PROXY_BAN_MAX_RETRIES', 3)
+        self.proxy_pool = ProxyPool(
+            self.proxy_list,
+            cooldown_base=settings.getfloat('PROXY_COOLDOWN_BASE', 30),
+            cooldown_max=settings.getfloat('PROXY_COOLDOWN_MAX', 1800),
+        ) if self.proxy_list else None
 
     def get_proxy_list(self, settings):
         proxy_list = None
@@ -73,8 +104,9 @@ class ProxyRotationMiddleware:
 
     @classmethod
     def from_crawler(cls, crawler):
-        o = cls(crawler.settings)
+        o = cls(crawler.settings, crawler.stats)
         crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
         return o
 
     def spider_opened(self, spider: Spider):
@@ -89,26 +121,67 @@ class ProxyRotationMiddleware:
                 spider.logger.warning('PROXY DISABLED')
                 self.logging_enabled = False
 
+    def spider_closed(self, spider: Spider):
+        if self.proxy_pool and self.stats:
+            for state in self.proxy_pool.proxies.values():
+                self.stats.set_value(f'proxy_pool/{state.name}/score', round(state.score, 4))
+                self.stats.set_value(f'proxy_pool/{state.name}/latency', round(state.latency, 3))
+
+    def process_response(self, request: Request, response: Response, spider: Spider):
+        state = self.proxy_pool.get(request.meta.get('proxy')) if self.proxy_pool else None
+        if state is None:
+            return response
+        if not self.is_ban(response):
+            self.proxy_pool.record_success(state, request.meta.get('download_latency'))
+            self.inc_stats(state, 'success')
+            return response
+
+        self.inc_stats(state, 'bans')
+        reason = f'response status {response.status}' if response.status in self.ban_http_codes else 'ban marker'
+        self.on_proxy_failure(state, spider, reason)
+        retries = request.meta.get(self.ban_retries_meta_key, 0)
+        if retries >= self.ban_max_retries:
+            return response
+        retry_request = request.copy()
+        retry_request.meta[self.ban_retries_meta_key] = retries + 1
+        retry_request.dont_filter = True
+        return retry_request
+
+    def process_exception(self, request: Request, exception: Exception, spider: Spider):
+        state = self.proxy_pool.get(request.meta.get('proxy')) if self.proxy_pool else None
+        if state is not None and isinstance(exception, PROXY_EXCEPTIONS):
+            self.inc_stats(state, 'errors')
+            self.on_proxy_failure(state, spider, repr(exception))
+
+    def is_ban(self, response: Response) -> bool:
+        if response.status in self.ban_http_codes:
+            return True
+        return any(marker in response.body for marker in self.ban_markers)
+
+    def on_proxy_failure(self, state, spider: Spider, reason: str) -> None:
+        cooldown = self.proxy_pool.record_failure(state)
+        if cooldown is not None:
+            self.inc_stats(state, 'cooldowns')
+            spider.logger.info(f'Proxy {state.name} is in cooldown for {cooldown:.0f}s: {reason}')
+        if self.stats:
+            self.stats.set_value('proxy_pool/available', self.proxy_pool.available_count)
+
+    def inc_stats(self, state, key: str) -> None:
+        if self.stats:
+            self.stats.inc_value(f'proxy_pool/{state.name}/{key}')
+
     def update_request(self, request: Request, spider: Spider) -> Request:
-        if self.proxy_list:
+        if self.proxy_pool:
             if self.mode == ProxyMode.RANDOMIZE_EVERY_REQUESTS:
-                proxy_item = random.choice(list(self.proxy_list))
+                state = self.proxy_pool.choose()
             elif self.mode == ProxyMode.IN_ORDER_EVERY_REQUESTS:
-                proxy_item = self.proxy_list.pop(0)
-                self.proxy_list.append(proxy_item)
+                state = self.proxy_pool.next_in_order()
             else:
                 raise Exception(f"PROXY_MODE is {self.mode}, need to be 1 or 2")
 
-            if proxy_item and proxy_item.get("proxy"):
-                proxy = proxy_item.get("proxy")
-                proxy_auth = proxy_item.get("auth")
-                if proxy_auth:
-                    request.headers["Proxy-Authorization"] = basic_auth_header(*proxy_auth.split(":"))
-                elif request.headers.get("Proxy-Authorization"):
-                    del request.headers["Proxy-Authorization"]
-                if "http" not in proxy:
-                    proxy = "http://{}".format(proxy)
-                request.meta["proxy"] = proxy
-                return request
-            else:
-                raise Exception(f"Proxy ({self.proxy_list.index(proxy_item)}) from list is empty")
+            if state.auth_header:
+                request.headers["Proxy-Authorization"] = state.auth_header
+            elif request.headers.get("Proxy-Authorization"):
+                del request.headers["Proxy-Authorization"]
+            request.meta["proxy"] = state.proxy
+            return request
@@ -1,2 +1,3 @@
 # -*- coding: utf-8 -*-
-from .feedbooks_sqlalchemy_pipeline import FeedbooksSQLAlchemyPipeline
\ No newline at end of file
+from .feedbooks_sqlalchemy_pipeline import FeedbooksSQLAlchemyPipeline
+from .feedbooks_cover_pipeline import FeedbooksCoverPipeline
@@ -0,0 +1,217 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+from MySQLdb.cursors import DictCursor
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider
+from sqlalchemy import case, select, update
+from twisted.enterprise import adbapi
+from twisted.internet import defer, task
+
+from database.models import FeedbooksBook
+from rmq.utils.sql_expressions import compile_expression
+from utils import ContentAddressedFileSaver
+
+
+class FeedbooksCoverPipeline:
+    """Downloads covers (item image_urls) to ContentAddressedFileSaver during the crawl.
+
+    Covers are downloaded by engine downloader (downloader middlewares only, no scheduler), so they
+    take CONCURRENT_REQUESTS slots like pages do; at most COVERS_CONCURRENT_DOWNLOADS of them at once.
+    Covers are written by saver thread pool, equal covers of different urls share one file.
+    Books which already have image_filename saved from same image_url are skipped (looked up by batches
+    of item urls), saved paths (relative to COVERS_FOLDER) and their image urls are written to books
+    rows by batches. Must run after FeedbooksSQLAlchemyPipeline, which passes item on after its row
+    is stored.
+    """
+
+    logger = logging.getLogger(name=__name__)
+    # image url -> saved path of covers downloaded by this run (covers shared by several books)
+    saved_urls_cache_size: int = 100000
+
+    def __init__(self, crawler, db_settings):
+        self.crawler = crawler
+        self.db_settings = db_settings
+        self.stats = crawler.stats
+        settings = crawler.settings
+        self.file_saver = ContentAddressedFileSaver(
+            settings.get('COVERS_FOLDER'), settings.getint('COVERS_SAVE_THREADS')
+        )
+        self.semaphore = defer.DeferredSemaphore(settings.getint('COVERS_CONCURRENT_DOWNLOADS'))
+        self.batch_size: int = settings.getint('COVERS_BATCH_SIZE')
+        self.flush_interval: float = settings.getfloat('COVERS_FLUSH_INTERVAL')
+
+        self._pending_lookups: List[Tuple[str, str]] = []
+        # (item url, saved path, image url)
+        self._pending_updates: List[Tuple[str, str, str]] = []
+        # image url -> item urls waiting for its download
+        self._downloading: Dict[str, List[str]] = {}
+        self._saved_urls: OrderedDict = OrderedDict()
+        self._in_progress: Set[defer.Deferred] = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        db_settings = {
+            'host': crawler.settings.get('DB_HOST'),
+            'port': crawler.settings.getint('DB_PORT'),
+            'user': crawler.settings.get('DB_USERNAME'),
+            'password': crawler.settings.get('DB_PASSWORD'),
+            'database': crawler.settings.get('DB_DATABASE')
+        }
+        o = cls(crawler, db_settings)
+        crawler.signals.connect(o.spider_idle, signal=signals.spider_idle)
+        return o
+
+    def open_spider(self, spider):
+        self.db_pool = adbapi.ConnectionPool(
+            'MySQLdb',
+            host=self.db_settings['host'],
+            port=self.db_settings['port'],
+            user=self.db_settings['user'],
+            passwd=self.db_settings['password'],
+            db=self.db_settings['database'],
+            charset='utf8mb4',
+            use_unicode=True,
+            cursorclass=DictCursor,
+            cp_reconnect=True
+        )
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        # downloads are finished before spider is closed (spider_idle), updates are flushed here
+        self.flush_lookups()
+        while self._in_progress:
+            yield defer.DeferredList(list(self._in_progress))
+        self.flush_updates()
+        while self._in_progress:
+            yield defer.DeferredList(list(self._in_progress))
+        self.db_pool.close()
+        self.file_saver.close()
+
+    def spider_idle(self, spider):
+        if self._pending_lookups or self._downloading or self._in_progress:
+            self.flush_lookups()
+            raise DontCloseSpider
+
+    def process_item(self, item, spider):
+        image_url = item['image_urls'][0] if item.get('image_urls') else None
+        if image_url:
+            self._pending_lookups.append((item['item_url'], image_url))
+            if len(self._pending_lookups) >= self.batch_size:
+                self.flush_lookups()
+        return item
+
+    def flush(self):
+        self.flush_lookups()
+        self.flush_updates()
+
+    def flush_lookups(self):
+        if not self._pending_lookups:
+            return
+        covers, self._pending_lookups = self._pending_lookups, []
+        d = self.db_pool.runInteraction(self.select_stored_covers, [item_url for item_url, _ in covers])
+        d.addCallback(self.schedule_downloads, covers)
+        d.addErrback(self._on_lookup_failed, covers)
+        self._track(d)
+
+    def flush_updates(self):
+        if not self._pending_updates:
+            return
+        updates, self._pending_updates = self._pending_updates, []
+        d = self.db_pool.runInteraction(self.update_image_filenames, updates)
+        d.addCallback(lambda _: self.stats.inc_value('covers/rows_updated', len(updates)))
+        d.addErrback(
+            lambda failure: self.logger.error(
+                'Failed to store %s cover paths: %s', len(updates), failure.getErrorMessage()
+            )
+        )
+        self._track(d)
+
+    def select_stored_covers(self, transaction, item_urls: List[str]) -> Dict[str, str]:
+        """item url -> image url of stored cover (books row image_url is already overwritten by re-crawl)"""
+        stmt = select(FeedbooksBook.item_url, FeedbooksBook.image_filename_url).where(
+            FeedbooksBook.item_url.in_(item_urls), FeedbooksBook.image_filename.is_not(None)
+        )
+        transaction.execute(*compile_expression(stmt))
+        return {row['item_url']: row['image_filename_url'] for row in transaction.fetchall()}
+
+    def update_image_filenames(self, transaction, updates: List[Tuple[str, str, str]]) -> None:
+        filenames = {item_url: image_filename for item_url, image_filename, _ in updates}
+        image_urls = {item_url: image_url for item_url, _, image_url in updates}
+        stmt = (
+            update(FeedbooksBook)
+            .where(FeedbooksBook.item_url.in_(list(filenames)))
+            .values(
+                image_filename=case(filenames, value=FeedbooksBook.item_url),
+                image_filename_url=case(image_urls, value=FeedbooksBook.item_url),
+            )
+        )
+        transaction.execute(*compile_expression(stmt))
+
+    def schedule_downloads(self, stored: Dict[str, str], covers: List[Tuple[str, str]]) -> None:
+        for item_url, image_url in covers:
+            if stored.get(item_url) == image_url:
+                self.stats.inc_value('covers/skipped')
+            elif image_url in self._saved_urls:
+                self.stats.inc_value('covers/reused')
+                self._add_update(item_url, self._saved_urls[image_url], image_url)
+            elif image_url in self._downloading:
+                self._downloading[image_url].append(item_url)
+            else:
+                self._downloading[image_url] = [item_url]
+                self._track(self.semaphore.run(self.download_cover, image_url))
+
+    def download_cover(self, image_url: str) -> defer.Deferred:
+        request = Request(image_url, dont_filter=True)
+        d = defer.maybeDeferred(self.crawler.engine.download, request)
+        d.addCallback(self._on_cover_downloaded, image_url)
+        d.addErrback(self._on_cover_failed, image_url)
+        return d
+
+    def _on_cover_downloaded(self, response, image_url: str) -> defer.Deferred:
+        if response.status != 200:
+            raise ValueError(f'Response status {response.status}')
+        d = self.file_saver.save_file(response)
+        d.addCallback(self._on_cover_saved, image_url)
+        return d
+
+    def _on_cover_saved(self, result: Tuple[str, str], image_url: str) -> None:
+        path_to_file, _ = result
+        image_filename = os.path.relpath(path_to_file, self.file_saver.base_folder)
+        self.stats.inc_value('covers/downloaded')
+
+        self._saved_urls[image_url] = image_filename
+        if len(self._saved_urls) > self.saved_urls_cache_size:
+            self._saved_urls.popitem(last=False)
+        for item_url in self._downloading.pop(image_url, []):
+            self._add_update(item_url, image_filename, image_url)
+
+    def _on_cover_failed(self, failure, image_url: str) -> None:
+        self.stats.inc_value('covers/failed')
+        item_urls = self._downloading.pop(image_url, [])
+        self.logger.warning(
+            'Cover %s of %s is not downloaded: %s', image_url, item_urls, failure.getErrorMessage()
+        )
+
+    def _on_lookup_failed(self, failure, covers: List[Tuple[str, str]]) -> None:
+        self.stats.inc_value('covers/failed', len(covers))
+        self.logger.error('Failed to look up %s stored covers: %s', len(covers), failure.getErrorMessage())
+
+    def _add_update(self, item_url: str, image_filename: str, image_url: str) -> None:
+        self._pending_updates.append((item_url, image_filename, image_url))
+        if len(self._pending_updates) >= self.batch_size:
+            self.flush_updates()
+
+    def _track(self, d: defer.Deferred) -> None:
+        self._in_progress.add(d)
+        d.addBoth(self._untrack, d)
+
+    def _untrack(self, result, d: defer.Deferred):
+        self._in_progress.discard(d)
+        return result
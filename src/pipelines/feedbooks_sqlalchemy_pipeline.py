@@ -41,8 +41,10 @@ class FeedbooksSQLAlchemyPipeline:
         self.db_pool.close()
 
     def process_item(self, item, spider):
-        self.db_pool.runInteraction(self.process_transaction, item)
-        return item
+        # item is passed to next pipelines after its row is stored (FeedbooksCoverPipeline updates it)
+        d = self.db_pool.runInteraction(self.process_transaction, item)
+        d.addCallback(lambda _: item)
+        return d
 
     def process_transaction(self, transaction, item):
         stmt = self.build_store_stmt(item)
@@ -52,7 +54,7 @@ class FeedbooksSQLAlchemyPipeline:
             transaction.execute(stmt)
 
     def build_store_stmt(self, item):
-        stmt = insert(FeedbooksBook).values(
+        values = dict(
             item_url=item['item_url'],
             title=item['title'],
             authors=item['authors'],
@@ -73,4 +75,9 @@ class FeedbooksSQLAlchemyPipeline:
             currency=item['currency'],
             image_url=item['image_urls'][0] if item['image_urls'] else None
         )
+        stmt = insert(FeedbooksBook).values(values)
+        # re-crawled book is updated, its item is passed on to cover pipeline too
+        stmt = stmt.on_duplicate_key_update({
+            key: stmt.inserted[key] for key in values if key != 'item_url'
+        })
         return stmt
@@ -1,2 +1,3 @@
 from .consumer import Consumer
 from .producer import Producer
+from .benchmark import RmqBenchmark
@@ -0,0 +1,234 @@
+import json
+import time
+from argparse import Namespace
+
+import pika
+import scrapy
+from scrapy.commands import ScrapyCommand
+from scrapy.crawler import CrawlerProcess
+from scrapy.http import HtmlResponse
+from twisted.internet import defer, reactor
+
+from rmq.commands.consumer import Consumer
+from rmq.connections import get_connection_class, get_connection_factory
+from rmq.items import RMQItem
+from rmq.pipelines import ItemProducerPipeline
+from rmq.spiders import TaskToSingleResultSpider
+from rmq.utils import RMQConstants, get_import_full_name
+from rmq.utils.decorators import rmq_callback, rmq_errback
+
+FAKE_CONNECTION_FACTORY = "rmq.connections.fake_broker.FakeBrokerConnectionFactory"
+
+
+class BenchmarkItem(RMQItem):
+    task_id = scrapy.Field()
+    index = scrapy.Field()
+    published_at = scrapy.Field()
+
+
+class InstantDownloadHandler:
+    """Responds without network, so broker/pipeline path is measured only.
+
+    Note: scrapy defers each response by 0.1 second before spider callback, so throughput is
+    bounded by about CONCURRENT_REQUESTS / 0.1 tasks per second
+    """
+
+    lazy = False
+
+    def __init__(self, settings=None, crawler=None):
+        pass
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        return defer.succeed(
+            HtmlResponse(url=request.url, status=200, body=b"<html></html>", request=request)
+        )
+
+
+class BenchmarkSpider(TaskToSingleResultSpider):
+    name = "rmq_benchmark"
+    items_per_task = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.task_queue_name = f"{self.name}_task_queue"
+        self.result_queue_name = f"{self.name}_result_queue"
+
+    def start_requests(self):
+        return []
+
+    def next_request(self, _delivery_tag, msg_body):
+        data = json.loads(msg_body)
+        return scrapy.Request(f"https://benchmark.local/{data['task_id']}", callback=self.parse)
+
+    @rmq_callback
+    def parse(self, response):
+        task = response.meta[RMQConstants.MSG_BODY_META_KEY.value]
+        for index in range(self.items_per_task):
+            yield BenchmarkItem(
+                task_id=task["task_id"], index=index, published_at=task["published_at"]
+            )
+
+    @rmq_errback
+    def _errback(self, failure):
+        self.logger.warning(f"IN ERRBACK: {repr(failure)}")
+
+
+class _InMemoryConnectionPool:
+    """adbapi.ConnectionPool stand-in: benchmark consumer stores nothing"""
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        return defer.maybeDeferred(interaction, None, *args, **kwargs)
+
+
+class BenchmarkConsumer(Consumer):
+    """Consumer command which records result latency instead of storing messages to database"""
+
+    def __init__(self, settings, expected_count, on_completed):
+        super().__init__()
+        self.project_settings = settings
+        self.connection_class = get_connection_class(settings)
+        self.expected_count = expected_count
+        self.on_completed = on_completed
+        self.latencies = []
+
+    def init_db_connection_pool(self):
+        self.db_connection_pool = _InMemoryConnectionPool()
+
+    def process_message(self, transaction, message_body):
+        self.latencies.append(time.time() - message_body["published_at"])
+        if len(self.latencies) == self.expected_count:
+            reactor.callFromThread(self.on_completed)
+        return True
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RmqBenchmark(ScrapyCommand):
+    """Pushes synthetic tasks through RPCTaskConsumer -> ItemProducerPipeline -> Consumer command
+    and reports throughput and task-to-result latency.
+
+    In-process fake broker is used unless --live is passed.
+    """
+
+    requires_project = True
+    default_settings = {"LOG_LEVEL": "WARNING"}
+
+    _DEFAULT_TASKS_COUNT = 10000
+    _DEFAULT_TIMEOUT = 300  # seconds
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Benchmark RabbitMQ task -> item -> consumer throughput"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument(
+            "-n", "--tasks", type=int, default=self._DEFAULT_TASKS_COUNT, dest="tasks_count",
+            help="Count of synthetic tasks",
+        )
+        parser.add_argument(
+            "-i", "--items-per-task", type=int, default=1, dest="items_per_task",
+            help="Count of items produced by each task",
+        )
+        parser.add_argument(
+            "--live", action="store_true", default=False, dest="live",
+            help="Use configured RabbitMQ instead of in-process fake broker",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=self._DEFAULT_TIMEOUT, dest="timeout",
+            help="Benchmark is aborted after timeout (seconds)",
+        )
+
+    def run(self, args: list[str], opts: Namespace):
+        settings = self.settings
+        if not opts.live:
+            settings.set("RABBITMQ_CONNECTION_FACTORY", FAKE_CONNECTION_FACTORY, priority="cmdline")
+        settings.set(
+            "ITEM_PIPELINES", {get_import_full_name(ItemProducerPipeline): 310}, priority="cmdline"
+        )
+        settings.set(
+            "DOWNLOAD_HANDLERS",
+            {"https": get_import_full_name(InstantDownloadHandler)},
+            priority="cmdline",
+        )
+        expected_count = opts.tasks_count * opts.items_per_task
+        spider = BenchmarkSpider
+
+        self._prepare_queues(settings, opts.tasks_count)
+
+        crawler_process = CrawlerProcess(settings, install_root_handler=False)
+        started_at = time.monotonic()
+        completed = {"at": None}
+
+        def on_completed():
+            completed["at"] = time.monotonic()
+            crawler_process.stop()
+
+        consumer = BenchmarkConsumer(settings, expected_count, on_completed)
+        consumer.crawler_process = crawler_process
+        reactor.callLater(
+            0,
+            consumer.execute,
+            [],
+            Namespace(queue_name=f"{spider.name}_result_queue", mode="worker", prefetch_count=None),
+        )
+        reactor.callLater(opts.timeout, crawler_process.stop)
+        crawler_process.crawl(spider, items_per_task=opts.items_per_task)
+        # consumer connection is stopped on reactor shutdown
+        crawler_process.start()
+
+        self._report(settings, opts, started_at, completed["at"], consumer.latencies, expected_count)
+
+    @staticmethod
+    def _prepare_queues(settings, tasks_count):
+        parameters = pika.ConnectionParameters(
+            host=settings.get("RABBITMQ_HOST"),
+            port=int(settings.get("RABBITMQ_PORT")),
+            virtual_host=settings.get("RABBITMQ_VIRTUAL_HOST"),
+            credentials=pika.credentials.PlainCredentials(
+                username=settings.get("RABBITMQ_USERNAME"),
+                password=settings.get("RABBITMQ_PASSWORD"),
+            ),
+        )
+        connection = get_connection_factory(settings).blocking_connection(parameters)
+        channel = connection.channel()
+        task_queue_name = f"{BenchmarkSpider.name}_task_queue"
+        result_queue_name = f"{BenchmarkSpider.name}_result_queue"
+        reply_queue_name = f"{BenchmarkSpider.name}_reply_queue"
+        for queue_name in (task_queue_name, result_queue_name, reply_queue_name):
+            channel.queue_declare(queue=queue_name, durable=True)
+            channel.queue_purge(queue_name)
+        properties = pika.BasicProperties(
+            content_type="application/json", delivery_mode=2, reply_to=reply_queue_name
+        )
+        for task_id in range(tasks_count):
+            body = json.dumps({"task_id": task_id, "published_at": time.time()})
+            channel.basic_publish("", task_queue_name, body, properties)
+        connection.close()
+
+    @staticmethod
+    def _report(settings, opts, started_at, completed_at, latencies, expected_count):
+        if completed_at is None:
+            print(f"Benchmark is not completed: {len(latencies)} of {expected_count} results consumed")
+            completed_at = time.monotonic()
+        elapsed = completed_at - started_at
+        latencies = sorted(latencies)
+        print(f"broker:     {'live' if opts.live else 'in-process fake'}")
+        print(f"tasks:      {opts.tasks_count} ({opts.items_per_task} items per task)")
+        print(f"concurrency: {settings.getint('CONCURRENT_REQUESTS')}")
+        print(f"elapsed:    {elapsed:.2f} s")
+        print(f"tasks/sec:  {opts.tasks_count / elapsed:.0f}")
+        print(f"items/sec:  {len(latencies) / elapsed:.0f}")
+        for percent in (50, 90, 99, 100):
+            print(f"p{percent} latency: {percentile(latencies, percent) * 1000:.1f} ms")
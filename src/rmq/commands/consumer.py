@@ -1,5 +1,4 @@
 import functools
-import json
 import logging
 from argparse import Namespace
 from enum import Enum
@@ -15,8 +14,9 @@ from sqlalchemy.sql import ClauseElement
 from twisted.enterprise import adbapi
 from twisted.internet import reactor
 
-from rmq.connections import PikaSelectConnection
-from rmq.utils import RMQConstants, RMQDefaultOptions
+from rmq.connections import get_connection_class
+from rmq.exceptions import MessageNotProcessed
+from rmq.utils import RMQConstants, RMQDefaultOptions, unpack_message
 from rmq.utils.decorators import call_once
 from rmq.utils.sql_expressions import compile_expression
 
@@ -47,6 +47,7 @@ class Consumer(ScrapyCommand):
 
         self.queue_name = None
 
+        self.connection_class = get_connection_class(self.project_settings)
         self.rmq_connection = None
         self._can_interact = False
         self._can_get_next_message = False
@@ -144,32 +145,44 @@ class Consumer(ScrapyCommand):
             ),
             heartbeat=RMQDefaultOptions.CONNECTION_HEARTBEAT.value,
         )
-        reactor.callInThread(self.connect, parameters, self.queue_name)
+        self.connection_class.dispatch(self.connect, parameters, self.queue_name)
 
     def on_basic_get_message(self, message):
         delivery_tag = message.get("method").delivery_tag
-        ack_cb = nack_cb = None
-        if isinstance(self.rmq_connection.connection, pika.SelectConnection):
-            ack_cb = call_once(
+        ack_cb = call_once(
+            functools.partial(
+                self.rmq_connection.add_callback_threadsafe,
                 functools.partial(
-                    self.rmq_connection.connection.ioloop.add_callback_threadsafe,
-                    functools.partial(
-                        self.rmq_connection.acknowledge_message, delivery_tag=delivery_tag
-                    ),
-                )
+                    self.rmq_connection.acknowledge_message, delivery_tag=delivery_tag
+                ),
             )
-            nack_cb = call_once(
+        )
+        nack_cb = call_once(
+            functools.partial(
+                self.rmq_connection.add_callback_threadsafe,
                 functools.partial(
-                    self.rmq_connection.connection.ioloop.add_callback_threadsafe,
-                    functools.partial(
-                        self.rmq_connection.negative_acknowledge_message, delivery_tag=delivery_tag
-                    ),
-                )
+                    self.rmq_connection.negative_acknowledge_message, delivery_tag=delivery_tag
+                ),
             )
+        )
 
-        message_body = json.loads(message["body"])
+        # batched message (see rmq.utils.item_batch) is processed within single interaction
+        try:
+            message_bodies = unpack_message(message["body"], message.get("properties"))
+        except ValueError as exc:
+            # undecodable message is never processable: it is dead-lettered (or dropped) by broker
+            self.logger.error(f"Message {delivery_tag} is not decoded, rejecting it: {exc}")
+            self.rmq_connection.add_callback_threadsafe(
+                functools.partial(
+                    self.rmq_connection.negative_acknowledge_message,
+                    delivery_tag=delivery_tag,
+                    requeue=False,
+                )
+            )
+            self._can_get_next_message = True
+            return
 
-        d = self.db_connection_pool.runInteraction(self.process_message, message_body)
+        d = self.db_connection_pool.runInteraction(self.process_messages, message_bodies)
         d.addCallback(
             self.on_message_processed, ack_callback=ack_cb, nack_callback=nack_cb,
         ).addErrback(self.on_message_process_failure, nack_callback=nack_cb).addBoth(
@@ -178,6 +191,16 @@ class Consumer(ScrapyCommand):
 
         self._can_get_next_message = True
 
+    def process_messages(self, transaction, message_bodies):
+        """Processes all documents of consumed message in one transaction.
+        Message is acked only if all documents are processed successfully, otherwise
+        transaction is rolled back and message is nacked
+        """
+        for message_body in message_bodies:
+            if not self.process_message(transaction, message_body):
+                raise MessageNotProcessed("Document of consumed message is not processed")
+        return True
+
     def process_message(self, transaction, message_body):
         """If processing message task requires several queries to db or single query has extreme difficulty
         then this method could be overridden.
@@ -226,9 +249,12 @@ class Consumer(ScrapyCommand):
 
     def on_message_process_failure(self, failure, nack_callback=None):
         failure.trap(Exception)
-        self.logger.error("failure: {}".format(failure))
         if callable(nack_callback):
             nack_callback()
+        if failure.check(MessageNotProcessed):
+            self.logger.warning(failure.getErrorMessage())
+            return
+        self.logger.error("failure: {}".format(failure))
         if failure.check(NotImplementedError):
             self.logger.critical("Required method is not implemented. Shutting down...")
             reactor.callLater(0, self.crawler_process._graceful_stop_reactor)
@@ -261,7 +287,7 @@ class Consumer(ScrapyCommand):
         self._can_get_next_message = can_interact
 
     def connect(self, parameters, queue_name):
-        c = PikaSelectConnection(
+        c = self.connection_class(
             parameters,
             queue_name,
             owner=self,
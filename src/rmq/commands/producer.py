@@ -15,7 +15,7 @@ from sqlalchemy.sql import ClauseElement
 from twisted.enterprise import adbapi
 from twisted.internet import reactor, defer
 
-from rmq.connections import PikaSelectConnection
+from rmq.connections import get_connection_class
 from rmq.utils import RMQConstants, RMQDefaultOptions, TaskStatusCodes
 from rmq.utils.sql_expressions import compile_expression
 
@@ -48,8 +48,10 @@ class Producer(ScrapyCommand):
         self.task_queue_name = None
         self.reply_to_queue_name = None
 
+        self.connection_class = get_connection_class(self.project_settings)
         self.rmq_connection = None
         self._can_interact = False
+        self._is_blocked = False
 
         self.db_connection_pool = None
 
@@ -155,7 +157,7 @@ class Producer(ScrapyCommand):
             ),
             heartbeat=RMQDefaultOptions.CONNECTION_HEARTBEAT.value,
         )
-        reactor.callInThread(self.connect, parameters, self.task_queue_name)
+        self.connection_class.dispatch(self.connect, parameters, self.task_queue_name)
         reactor.callLater(self.check_interact_ready_delay, self.produce_tasks)
 
     def produce_tasks(self, is_message_count_validated=False):
@@ -164,6 +166,12 @@ class Producer(ScrapyCommand):
             reactor.callLater(self.check_interact_ready_delay, self.produce_tasks)
             return
 
+        if self._is_blocked is True:
+            """Wait until broker unblocks connection (memory/disk alarm), do not fetch next chunk"""
+            self.logger.warning("RabbitMQ connection is blocked. Waiting...")
+            reactor.callLater(self.check_interact_ready_delay, self.produce_tasks)
+            return
+
         """check current queue ready messages count (queue size)"""
         if is_message_count_validated is False:
             cb = functools.partial(
@@ -171,7 +179,7 @@ class Producer(ScrapyCommand):
                 self.task_queue_name,
                 functools.partial(reactor.callFromThread, self.validate_queue_message_count),
             )
-            self.rmq_connection.connection.ioloop.add_callback_threadsafe(cb)
+            self.rmq_connection.add_callback_threadsafe(cb)
             return
 
         """get chunk of records from db which represents tasks and produce to queue"""
@@ -299,7 +307,7 @@ class Producer(ScrapyCommand):
                 content_type="application/json", delivery_mode=2, reply_to=self.reply_to_queue_name
             ),
         )
-        self.rmq_connection.connection.ioloop.add_callback_threadsafe(cb)
+        self.rmq_connection.add_callback_threadsafe(cb)
 
     def _convert_unserializable_values(self, data):
         for key, val in data.items():
@@ -318,8 +326,11 @@ class Producer(ScrapyCommand):
     def set_can_interact(self, can_interact):
         self._can_interact = can_interact
 
+    def set_is_blocked(self, is_blocked):
+        self._is_blocked = is_blocked
+
     def connect(self, parameters, queue_name):
-        c = PikaSelectConnection(
+        c = self.connection_class(
             parameters,
             queue_name,
             owner=self,
@@ -1 +1,4 @@
 from .pika_select_connection import PikaSelectConnection
+from .pika_twisted_connection import PikaTwistedConnection
+from .connection_class import get_connection_class
+from .connection_factory import PikaConnectionFactory, get_connection_factory
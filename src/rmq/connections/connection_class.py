@@ -0,0 +1,43 @@
+import functools
+
+from scrapy.settings import Settings
+from scrapy.utils.misc import load_object
+
+from .connection_factory import get_connection_factory
+
+DEFAULT_CONNECTION_CLASS = "rmq.connections.PikaSelectConnection"
+
+
+def get_connection_class(settings: Settings):
+    """Returns connection backend class configured by RABBITMQ_CONNECTION_CLASS setting.
+
+    If RABBITMQ_CONNECTION_FACTORY is set, returned class opens connections with that factory.
+
+    Args:
+        settings (Settings): Spider or project settings.
+
+    Returns:
+        type: PikaSelectConnection (default) or PikaTwistedConnection or any class with the same interface.
+
+    """
+    connection_class = settings.get("RABBITMQ_CONNECTION_CLASS") or DEFAULT_CONNECTION_CLASS
+    if isinstance(connection_class, str):
+        connection_class = load_object(connection_class)
+    if settings.get("RABBITMQ_CONNECTION_FACTORY"):
+        connection_factory = get_connection_factory(settings)
+        if getattr(connection_class, "connection_factory", None) is not connection_factory:
+            connection_class = _bind_connection_factory(connection_class, connection_factory)
+    return connection_class
+
+
+@functools.lru_cache(maxsize=None)
+def _bind_connection_factory(connection_class, connection_factory):
+    if not hasattr(connection_class, "connection_factory"):
+        raise ValueError(
+            f"{connection_class.__name__} doesn't support RABBITMQ_CONNECTION_FACTORY setting"
+        )
+    return type(
+        connection_class.__name__,
+        (connection_class,),
+        {"connection_factory": connection_factory, "__module__": connection_class.__module__},
+    )
@@ -0,0 +1,46 @@
+import pika
+from scrapy.utils.misc import load_object
+
+DEFAULT_CONNECTION_FACTORY = "rmq.connections.connection_factory.PikaConnectionFactory"
+
+
+class PikaConnectionFactory:
+    """Creates pika connections to the real broker.
+
+    Connection factory replaces the way connections are opened (e.g. with in-process fake broker
+    for tests and benchmarks) and is configured by RABBITMQ_CONNECTION_FACTORY setting.
+    """
+
+    @staticmethod
+    def select_connection(
+        parameters: pika.ConnectionParameters,
+        on_open_callback=None,
+        on_open_error_callback=None,
+        on_close_callback=None,
+    ):
+        return pika.SelectConnection(
+            parameters,
+            on_open_callback=on_open_callback,
+            on_open_error_callback=on_open_error_callback,
+            on_close_callback=on_close_callback,
+        )
+
+    @staticmethod
+    def blocking_connection(parameters: pika.ConnectionParameters):
+        return pika.BlockingConnection(parameters)
+
+
+def get_connection_factory(settings):
+    """Returns connection factory configured by RABBITMQ_CONNECTION_FACTORY setting.
+
+    Args:
+        settings (Settings | dict): Spider or project settings.
+
+    Returns:
+        type: PikaConnectionFactory (default) or any class with the same interface.
+
+    """
+    connection_factory = settings.get("RABBITMQ_CONNECTION_FACTORY") or DEFAULT_CONNECTION_FACTORY
+    if isinstance(connection_factory, str):
+        return load_object(connection_factory)
+    return connection_factory
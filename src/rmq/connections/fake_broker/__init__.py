@@ -0,0 +1,32 @@
+"""In-process AMQP broker stand-in for tests and benchmarks.
+
+Enabled with RABBITMQ_CONNECTION_FACTORY=rmq.connections.fake_broker.FakeBrokerConnectionFactory
+(supported by PikaSelectConnection and rmq_alternative PikaBlockingConnection). Broker state is
+shared by all connections of the process, per virtual host.
+"""
+from .blocking_connection import FakeBlockingChannel, FakeBlockingConnection
+from .broker import FakeBroker, FakeMessage, FakeQueue, get_fake_broker, reset_fake_brokers
+from .io_loop import FakeIOLoop
+from .select_connection import FakeChannel, FakeSelectConnection
+
+
+def _virtual_host(parameters):
+    return getattr(parameters, "virtual_host", None) or "/"
+
+
+class FakeBrokerConnectionFactory:
+    @staticmethod
+    def select_connection(
+        parameters, on_open_callback=None, on_open_error_callback=None, on_close_callback=None
+    ):
+        return FakeSelectConnection(
+            parameters,
+            on_open_callback=on_open_callback,
+            on_open_error_callback=on_open_error_callback,
+            on_close_callback=on_close_callback,
+            broker=get_fake_broker(_virtual_host(parameters)),
+        )
+
+    @staticmethod
+    def blocking_connection(parameters):
+        return FakeBlockingConnection(parameters, broker=get_fake_broker(_virtual_host(parameters)))
@@ -0,0 +1,99 @@
+from pika.exceptions import ConnectionWrongStateError
+
+from .broker import FakeBroker
+from .select_connection import FakeChannel
+
+
+class FakeBlockingChannel:
+    """pika.adapters.blocking_connection.BlockingChannel subset: replies are returned directly"""
+
+    def __init__(self, broker: FakeBroker, channel_number: int):
+        self._channel = FakeChannel(broker, channel_number, schedule=lambda callback: callback())
+
+    @property
+    def is_open(self):
+        return self._channel.is_open
+
+    @property
+    def is_closed(self):
+        return self._channel.is_closed
+
+    def _call(self, method, *args, **kwargs):
+        replies = []
+        method(*args, callback=replies.append, **kwargs)
+        return replies[0] if replies else None
+
+    def queue_declare(
+        self, queue, passive=False, durable=False, exclusive=False, auto_delete=False, arguments=None
+    ):
+        return self._call(
+            self._channel.queue_declare,
+            queue,
+            passive=passive,
+            durable=durable,
+            exclusive=exclusive,
+            auto_delete=auto_delete,
+            arguments=arguments,
+        )
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        return self._call(self._channel.queue_delete, queue, if_unused=if_unused, if_empty=if_empty)
+
+    def queue_purge(self, queue):
+        return self._call(self._channel.queue_purge, queue)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._call(self._channel.basic_qos, prefetch_size, prefetch_count, global_qos)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._channel.basic_publish(exchange, routing_key, body, properties, mandatory)
+
+    def basic_get(self, queue, auto_ack=False):
+        """Returns (method, properties, body) or (None, None, None) for empty queue"""
+        replies = []
+        self._channel.basic_get(
+            queue, lambda _channel, method, properties, body: replies.append((method, properties, body)),
+            auto_ack=auto_ack,
+        )
+        return replies[0] if replies else (None, None, None)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._channel.basic_ack(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._channel.basic_nack(delivery_tag, multiple, requeue)
+
+    def close(self, reply_code=200, reply_text="Normal shutdown"):
+        self._channel.close(reply_code, reply_text)
+
+
+class FakeBlockingConnection:
+    """pika.BlockingConnection stand-in connected to in-process FakeBroker"""
+
+    def __init__(self, parameters=None, broker: FakeBroker = None):
+        self.parameters = parameters
+        self.broker = broker
+        self.is_open = True
+        self._channels = []
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self, channel_number=None):
+        if not self.is_open:
+            raise ConnectionWrongStateError("Channel allocation requires an open connection")
+        channel = FakeBlockingChannel(self.broker, channel_number or len(self._channels) + 1)
+        self._channels.append(channel)
+        return channel
+
+    def close(self, reply_code=200, reply_text="Normal shutdown"):
+        if not self.is_open:
+            raise ConnectionWrongStateError("Connection is closed or closing.")
+        self.is_open = False
+        for channel in self._channels:
+            if channel.is_open:
+                channel.close(reply_code, reply_text)
+
+    def process_data_events(self, time_limit=0):
+        pass
@@ -0,0 +1,172 @@
+import threading
+import weakref
+from collections import deque
+from typing import Dict, Optional
+
+import pika
+
+
+class FakeMessage:
+    __slots__ = ("body", "properties", "redelivered")
+
+    def __init__(self, body, properties: pika.BasicProperties, redelivered: bool = False):
+        self.body = body
+        self.properties = properties
+        self.redelivered = redelivered
+
+
+class FakeQueue:
+    def __init__(self, name: str):
+        self.name = name
+        self.messages = deque()
+        # consumer tag -> (channel, on_message_callback), dispatched round robin
+        self.consumers = {}
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class FakeBroker:
+    """In-process stand-in of RabbitMQ default exchange: durable queues, prefetch, ack/nack/requeue
+    and publisher confirms. Connections of any thread share broker state (guarded with single lock).
+
+    Failures could be injected for tests: nack_publishes, block_connections, close_connections,
+    is_available.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.queues: Dict[str, FakeQueue] = {}
+        self.is_available = True
+        # count of next publishes to be nacked (publisher confirms)
+        self.nack_publishes = 0
+        self.published_count = 0
+        self.delivered_count = 0
+        self.acked_count = 0
+        self._connections = weakref.WeakSet()
+
+    def register_connection(self, connection):
+        with self.lock:
+            self._connections.add(connection)
+
+    def declare_queue(self, name: str) -> FakeQueue:
+        with self.lock:
+            queue = self.queues.get(name)
+            if queue is None:
+                queue = self.queues[name] = FakeQueue(name)
+            return queue
+
+    def get_queue(self, name: str) -> Optional[FakeQueue]:
+        return self.queues.get(name)
+
+    def delete_queue(self, name: str) -> int:
+        with self.lock:
+            queue = self.queues.pop(name, None)
+            if queue is None:
+                return 0
+            for channel, _callback in list(queue.consumers.values()):
+                channel.cancel_by_broker(queue.name)
+            return len(queue.messages)
+
+    def purge_queue(self, name: str) -> int:
+        with self.lock:
+            queue = self.queues.get(name)
+            if queue is None:
+                return 0
+            count = len(queue.messages)
+            queue.messages.clear()
+            return count
+
+    def publish(self, routing_key: str, body, properties: pika.BasicProperties) -> bool:
+        """Routes message with default exchange. Returns False if publish has to be nacked"""
+        with self.lock:
+            self.published_count += 1
+            if self.nack_publishes > 0:
+                self.nack_publishes -= 1
+                return False
+            queue = self.queues.get(routing_key)
+            # unroutable messages are dropped (and confirmed) like by default exchange
+            if queue is not None:
+                queue.messages.append(FakeMessage(body, properties))
+                self.dispatch(queue)
+            return True
+
+    def get(self, queue_name: str) -> Optional[FakeMessage]:
+        with self.lock:
+            queue = self.queues.get(queue_name)
+            if queue is None or not queue.messages:
+                return None
+            self.delivered_count += 1
+            return queue.messages.popleft()
+
+    def requeue(self, queue_name: str, messages):
+        """Returns messages to queue head keeping their order"""
+        with self.lock:
+            queue = self.queues.get(queue_name)
+            if queue is None:
+                return
+            for message in reversed(messages):
+                message.redelivered = True
+                queue.messages.appendleft(message)
+            self.dispatch(queue)
+
+    def add_consumer(self, queue_name: str, consumer_tag: str, channel, on_message_callback):
+        with self.lock:
+            queue = self.declare_queue(queue_name)
+            queue.consumers[consumer_tag] = (channel, on_message_callback)
+            self.dispatch(queue)
+
+    def remove_consumer(self, queue_name: str, consumer_tag: str):
+        with self.lock:
+            queue = self.queues.get(queue_name)
+            if queue is not None:
+                queue.consumers.pop(consumer_tag, None)
+
+    def dispatch(self, queue: FakeQueue):
+        """Pushes ready messages to consumers with free prefetch capacity"""
+        with self.lock:
+            while queue.messages and queue.consumers:
+                delivered = False
+                for consumer_tag, (channel, callback) in list(queue.consumers.items()):
+                    if not queue.messages:
+                        break
+                    if not channel.has_capacity():
+                        continue
+                    self.delivered_count += 1
+                    channel.deliver(consumer_tag, queue.name, queue.messages.popleft(), callback)
+                    delivered = True
+                if not delivered:
+                    return
+
+    def block_connections(self, reason: str = "low on memory"):
+        with self.lock:
+            for connection in list(self._connections):
+                connection.notify_blocked(reason)
+
+    def unblock_connections(self):
+        with self.lock:
+            for connection in list(self._connections):
+                connection.notify_unblocked()
+
+    def close_connections(self, reply_code: int = 320, reply_text: str = "CONNECTION_FORCED"):
+        with self.lock:
+            for connection in list(self._connections):
+                connection.close_by_broker(reply_code, reply_text)
+
+
+_brokers: Dict[str, FakeBroker] = {}
+_brokers_lock = threading.Lock()
+
+
+def get_fake_broker(virtual_host: str = "/") -> FakeBroker:
+    """Returns process wide broker of virtual host"""
+    with _brokers_lock:
+        broker = _brokers.get(virtual_host)
+        if broker is None:
+            broker = _brokers[virtual_host] = FakeBroker()
+        return broker
+
+
+def reset_fake_brokers():
+    with _brokers_lock:
+        _brokers.clear()
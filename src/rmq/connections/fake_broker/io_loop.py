@@ -0,0 +1,75 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class FakeIOLoop:
+    """Minimal pika ioloop: callbacks and timers executed in the thread which called start()"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._callbacks = deque()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._cancelled_timers = set()
+        self._stopping = False
+
+    def add_callback_threadsafe(self, callback):
+        with self._condition:
+            self._callbacks.append(callback)
+            self._condition.notify()
+
+    add_callback = add_callback_threadsafe
+
+    def call_later(self, delay, callback):
+        with self._condition:
+            timer = (time.monotonic() + delay, next(self._sequence), callback)
+            heapq.heappush(self._timers, timer)
+            self._condition.notify()
+            return timer[1]
+
+    def remove_timeout(self, timeout_id):
+        with self._condition:
+            self._cancelled_timers.add(timeout_id)
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+    def start(self):
+        with self._condition:
+            self._stopping = False
+        while True:
+            with self._condition:
+                ready = self._wait_ready()
+                if ready is None:
+                    return
+            for callback in ready:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Fake ioloop callback failed")
+
+    def _wait_ready(self):
+        while not self._stopping:
+            now = time.monotonic()
+            ready = []
+            while self._timers and self._timers[0][0] <= now:
+                _deadline, timeout_id, callback = heapq.heappop(self._timers)
+                if timeout_id in self._cancelled_timers:
+                    self._cancelled_timers.discard(timeout_id)
+                else:
+                    ready.append(callback)
+            while self._callbacks:
+                ready.append(self._callbacks.popleft())
+            if ready:
+                return ready
+            timeout = self._timers[0][0] - now if self._timers else None
+            self._condition.wait(timeout)
+        return None
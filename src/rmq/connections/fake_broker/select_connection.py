@@ -0,0 +1,376 @@
+import functools
+import itertools
+
+import pika
+from pika.exceptions import (AMQPConnectionError, ChannelClosedByBroker, ChannelClosedByClient,
+                             ChannelWrongStateError, ConnectionClosedByBroker,
+                             ConnectionClosedByClient, ConnectionWrongStateError)
+from pika.frame import Method
+
+from .broker import FakeBroker
+from .io_loop import FakeIOLoop
+
+
+class FakeChannel:
+    """pika.channel.Channel subset used by rmq connections. Replies are scheduled with schedule
+    callable (connection ioloop), like frames received from broker
+    """
+
+    def __init__(self, broker: FakeBroker, channel_number: int, schedule):
+        self.broker = broker
+        self.channel_number = channel_number
+        self._schedule = schedule
+
+        self.is_open = True
+        self.prefetch_count = 0
+        self._consumer_tags = itertools.count(1)
+        # consumer tag -> queue name
+        self._consumers = {}
+        # delivery tag -> (queue name, message), insertion (delivery) ordered
+        self._unacked = {}
+        self._delivery_tags = itertools.count(1)
+
+        self._confirm_callback = None
+        self._publish_sequence = 0
+
+        self._on_close_callbacks = []
+        self._on_cancel_callbacks = []
+        self._get_empty_callbacks = []
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def _reply(self, callback, *args):
+        if callback is not None:
+            self._schedule(functools.partial(callback, *args))
+
+    def _method_frame(self, method):
+        return Method(self.channel_number, method)
+
+    def _ensure_open(self):
+        if not self.is_open:
+            raise ChannelWrongStateError("Channel is closed.")
+
+    def add_on_close_callback(self, callback):
+        self._on_close_callbacks.append(callback)
+
+    def add_on_cancel_callback(self, callback):
+        self._on_cancel_callbacks.append(callback)
+
+    def add_callback(self, callback, replies, one_shot=True):
+        if pika.spec.Basic.GetEmpty in replies:
+            self._get_empty_callbacks.append(callback)
+
+    def queue_declare(
+        self,
+        queue,
+        passive=False,
+        durable=False,
+        exclusive=False,
+        auto_delete=False,
+        arguments=None,
+        callback=None,
+    ):
+        self._ensure_open()
+        with self.broker.lock:
+            fake_queue = self.broker.get_queue(queue)
+            if fake_queue is None:
+                if passive:
+                    self.close_by_broker(404, f"NOT_FOUND - no queue '{queue}'")
+                    return
+                fake_queue = self.broker.declare_queue(queue)
+            frame = self._method_frame(
+                pika.spec.Queue.DeclareOk(queue, len(fake_queue), len(fake_queue.consumers))
+            )
+        self._reply(callback, frame)
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False, callback=None):
+        self._ensure_open()
+        message_count = self.broker.delete_queue(queue)
+        self._reply(callback, self._method_frame(pika.spec.Queue.DeleteOk(message_count)))
+
+    def queue_purge(self, queue, callback=None):
+        self._ensure_open()
+        message_count = self.broker.purge_queue(queue)
+        self._reply(callback, self._method_frame(pika.spec.Queue.PurgeOk(message_count)))
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False, callback=None):
+        self._ensure_open()
+        with self.broker.lock:
+            self.prefetch_count = prefetch_count
+            for queue_name in set(self._consumers.values()):
+                queue = self.broker.get_queue(queue_name)
+                if queue is not None:
+                    self.broker.dispatch(queue)
+        self._reply(callback, self._method_frame(pika.spec.Basic.QosOk()))
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self._ensure_open()
+        self._confirm_callback = ack_nack_callback
+        self._publish_sequence = 0
+        self._reply(callback, self._method_frame(pika.spec.Confirm.SelectOk()))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._ensure_open()
+        if exchange:
+            raise NotImplementedError("Fake broker supports default exchange only")
+        if properties is None:
+            properties = pika.BasicProperties()
+        is_routed = self.broker.publish(routing_key, body, properties)
+        if self._confirm_callback is not None:
+            self._publish_sequence += 1
+            if is_routed:
+                method = pika.spec.Basic.Ack(delivery_tag=self._publish_sequence)
+            else:
+                method = pika.spec.Basic.Nack(delivery_tag=self._publish_sequence)
+            self._reply(self._confirm_callback, self._method_frame(method))
+
+    def basic_consume(
+        self,
+        queue,
+        on_message_callback,
+        auto_ack=False,
+        exclusive=False,
+        consumer_tag=None,
+        arguments=None,
+        callback=None,
+    ):
+        self._ensure_open()
+        if auto_ack:
+            raise NotImplementedError("Fake broker supports manual acknowledgements only")
+        if consumer_tag is None:
+            consumer_tag = f"ctag{self.channel_number}.{next(self._consumer_tags)}"
+        self._consumers[consumer_tag] = queue
+        self._reply(callback, self._method_frame(pika.spec.Basic.ConsumeOk(consumer_tag)))
+        self.broker.add_consumer(queue, consumer_tag, self, on_message_callback)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag="", callback=None):
+        self._ensure_open()
+        queue_name = self._consumers.pop(consumer_tag, None)
+        if queue_name is not None:
+            self.broker.remove_consumer(queue_name, consumer_tag)
+        self._reply(callback, self._method_frame(pika.spec.Basic.CancelOk(consumer_tag)))
+
+    def cancel_by_broker(self, queue_name):
+        """Queue of consumer was deleted"""
+        for consumer_tag, consumer_queue_name in list(self._consumers.items()):
+            if consumer_queue_name == queue_name:
+                del self._consumers[consumer_tag]
+                frame = self._method_frame(pika.spec.Basic.Cancel(consumer_tag))
+                for callback in self._on_cancel_callbacks:
+                    self._reply(callback, frame)
+
+    def has_capacity(self):
+        return self.is_open and (
+            self.prefetch_count == 0 or len(self._unacked) < self.prefetch_count
+        )
+
+    def deliver(self, consumer_tag, queue_name, message, on_message_callback):
+        """Called by broker (under broker lock) for consumed message"""
+        delivery_tag = next(self._delivery_tags)
+        self._unacked[delivery_tag] = (queue_name, message)
+        method = pika.spec.Basic.Deliver(
+            consumer_tag, delivery_tag, message.redelivered, "", queue_name
+        )
+        self._schedule(
+            functools.partial(
+                self._invoke_if_open,
+                on_message_callback,
+                self,
+                method,
+                message.properties,
+                message.body,
+            )
+        )
+
+    def _invoke_if_open(self, callback, *args):
+        if self.is_open:
+            callback(*args)
+
+    def basic_get(self, queue, callback, auto_ack=False):
+        self._ensure_open()
+        with self.broker.lock:
+            message = self.broker.get(queue)
+            if message is None:
+                frame = self._method_frame(pika.spec.Basic.GetEmpty())
+                for get_empty_callback in self._get_empty_callbacks:
+                    self._reply(get_empty_callback, frame)
+                return
+            delivery_tag = next(self._delivery_tags)
+            if not auto_ack:
+                self._unacked[delivery_tag] = (queue, message)
+            fake_queue = self.broker.get_queue(queue)
+            method = pika.spec.Basic.GetOk(
+                delivery_tag,
+                message.redelivered,
+                "",
+                queue,
+                len(fake_queue) if fake_queue is not None else 0,
+            )
+        self._reply(callback, self, method, message.properties, message.body)
+
+    def _pop_unacked(self, delivery_tag, multiple):
+        if multiple:
+            tags = [tag for tag in self._unacked if delivery_tag == 0 or tag <= delivery_tag]
+        else:
+            tags = [delivery_tag]
+        if not tags or any(tag not in self._unacked for tag in tags):
+            self.close_by_broker(406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+            return None
+        return [self._unacked.pop(tag) for tag in tags]
+
+    def _dispatch_queues(self, queue_names):
+        for queue_name in queue_names:
+            queue = self.broker.get_queue(queue_name)
+            if queue is not None:
+                self.broker.dispatch(queue)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._ensure_open()
+        with self.broker.lock:
+            released = self._pop_unacked(delivery_tag, multiple)
+            if released is None:
+                return
+            self.broker.acked_count += len(released)
+            self._dispatch_queues({queue_name for queue_name, _message in released})
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._ensure_open()
+        with self.broker.lock:
+            released = self._pop_unacked(delivery_tag, multiple)
+            if released is None:
+                return
+            if requeue:
+                self._requeue(released)
+            self._dispatch_queues({queue_name for queue_name, _message in released})
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self.basic_nack(delivery_tag, multiple=False, requeue=requeue)
+
+    def _requeue(self, released):
+        by_queue = {}
+        for queue_name, message in released:
+            by_queue.setdefault(queue_name, []).append(message)
+        for queue_name, messages in by_queue.items():
+            self.broker.requeue(queue_name, messages)
+
+    def close(self, reply_code=200, reply_text="Normal shutdown"):
+        if not self.is_open:
+            raise ChannelWrongStateError("Channel is closed.")
+        self._close(ChannelClosedByClient(reply_code, reply_text))
+
+    def close_by_broker(self, reply_code, reply_text):
+        if self.is_open:
+            self._close(ChannelClosedByBroker(reply_code, reply_text))
+
+    def _close(self, reason):
+        with self.broker.lock:
+            self.is_open = False
+            for consumer_tag, queue_name in self._consumers.items():
+                self.broker.remove_consumer(queue_name, consumer_tag)
+            self._consumers.clear()
+            # unacked messages of closed channel are redelivered
+            released = list(self._unacked.values())
+            self._unacked.clear()
+            self._requeue(released)
+        for callback in self._on_close_callbacks:
+            self._reply(callback, self, reason)
+
+
+class FakeSelectConnection:
+    """pika.SelectConnection stand-in connected to in-process FakeBroker"""
+
+    def __init__(
+        self,
+        parameters=None,
+        on_open_callback=None,
+        on_open_error_callback=None,
+        on_close_callback=None,
+        broker: FakeBroker = None,
+    ):
+        self.parameters = parameters
+        self.broker = broker
+        self.ioloop = FakeIOLoop()
+
+        self.is_open = False
+        self.is_closing = False
+        self.is_closed = False
+
+        self._on_close_callback = on_close_callback
+        self._blocked_callbacks = []
+        self._unblocked_callbacks = []
+        self._channels = {}
+        self._channel_numbers = itertools.count(1)
+
+        if broker.is_available:
+            self.ioloop.add_callback_threadsafe(functools.partial(self._open, on_open_callback))
+        elif on_open_error_callback is not None:
+            self.is_closed = True
+            self.ioloop.add_callback_threadsafe(
+                functools.partial(
+                    on_open_error_callback, self, AMQPConnectionError("Fake broker is unavailable")
+                )
+            )
+
+    def _open(self, on_open_callback):
+        self.is_open = True
+        self.broker.register_connection(self)
+        if on_open_callback is not None:
+            on_open_callback(self)
+
+    def add_on_connection_blocked_callback(self, callback):
+        self._blocked_callbacks.append(callback)
+
+    def add_on_connection_unblocked_callback(self, callback):
+        self._unblocked_callbacks.append(callback)
+
+    def notify_blocked(self, reason):
+        frame = Method(0, pika.spec.Connection.Blocked(reason))
+        for callback in self._blocked_callbacks:
+            self.ioloop.add_callback_threadsafe(functools.partial(callback, self, frame))
+
+    def notify_unblocked(self):
+        frame = Method(0, pika.spec.Connection.Unblocked())
+        for callback in self._unblocked_callbacks:
+            self.ioloop.add_callback_threadsafe(functools.partial(callback, self, frame))
+
+    def channel(self, channel_number=None, on_open_callback=None):
+        if not self.is_open:
+            raise ConnectionWrongStateError("Channel allocation requires an open connection")
+        if channel_number is None:
+            channel_number = next(self._channel_numbers)
+        channel = FakeChannel(self.broker, channel_number, self.ioloop.add_callback_threadsafe)
+        self._channels[channel_number] = channel
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(functools.partial(on_open_callback, channel))
+        return channel
+
+    def close(self, reply_code=200, reply_text="Normal shutdown"):
+        if not self.is_open:
+            raise ConnectionWrongStateError("Connection is closed or closing.")
+        self._close(ConnectionClosedByClient(reply_code, reply_text))
+
+    def close_by_broker(self, reply_code, reply_text):
+        """Called from any thread, connection is closed in its ioloop"""
+        self.ioloop.add_callback_threadsafe(
+            functools.partial(self._close, ConnectionClosedByBroker(reply_code, reply_text))
+        )
+
+    def _close(self, reason):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self.is_closing = True
+        for channel in self._channels.values():
+            if channel.is_open:
+                channel._close(reason)
+        self._channels.clear()
+        self.ioloop.add_callback_threadsafe(functools.partial(self._on_closed, reason))
+
+    def _on_closed(self, reason):
+        self.is_closing = False
+        self.is_closed = True
+        if self._on_close_callback is not None:
+            self._on_close_callback(self, reason)
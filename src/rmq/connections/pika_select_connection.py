@@ -1,7 +1,7 @@
 import functools
 import logging
+from collections import OrderedDict
 from datetime import datetime
-from typing import List
 
 import pika
 from pika.exceptions import ChannelWrongStateError, ConnectionWrongStateError
@@ -9,6 +9,8 @@ from twisted.internet import reactor, threads
 
 from rmq.utils.decorators import log_current_thread
 
+from .connection_factory import PikaConnectionFactory
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,6 +23,9 @@ class PikaSelectConnection:
 
     _DEFAULT_OPTIONS = {"enable_delivery_confirmations": True, "prefetch_count": 1}
 
+    # opens pika.SelectConnection compatible connections (see RABBITMQ_CONNECTION_FACTORY setting)
+    connection_factory = PikaConnectionFactory
+
     def __init__(
         self,
         parameters: pika.ConnectionParameters,
@@ -48,6 +53,8 @@ class PikaSelectConnection:
 
         # state of ability to interact with connection/channel/queue
         self.can_interact = False
+        # state of broker flow control (connection.blocked received on memory/disk alarm)
+        self.is_blocked = False
 
         # store connection and channel internally
         self.connection = None
@@ -59,7 +66,9 @@ class PikaSelectConnection:
         self._current_graceful_stop_attempts_count = 0
 
         self._message_number = 0
-        self._deliveries: List[int] = []
+        # publish sequence number -> (message, queue_name, properties) waiting for broker confirmation
+        self._unconfirmed = OrderedDict()
+        self._confirmations_enabled = False
         self._acked = 0
         self._nacked = 0
 
@@ -70,15 +79,30 @@ class PikaSelectConnection:
 
         self.shutdown_event_handler = None
 
+    @staticmethod
+    def dispatch(connect_callable, *args):
+        """Runs owner connect callable (blocking ioloop) in separate twisted thread"""
+        reactor.callInThread(connect_callable, *args)
+
+    def add_callback_threadsafe(self, callback):
+        """Schedules callback execution in the connection ioloop thread"""
+        if self.connection is None:
+            logger.warning("Connection is not established. Callback skipped")
+            return
+        self.connection.ioloop.add_callback_threadsafe(callback)
+
     @log_current_thread
     def connect(self):
         logger.info("Connecting to rabbitmq")
-        return pika.SelectConnection(
+        connection = self.connection_factory.select_connection(
             self.parameters,
             on_open_callback=self.on_connection_open,
             on_open_error_callback=self.on_connection_open_error,
             on_close_callback=self.on_connection_closed,
         )
+        connection.add_on_connection_blocked_callback(self.on_connection_blocked)
+        connection.add_on_connection_unblocked_callback(self.on_connection_unblocked)
+        return connection
 
     def on_connection_open(self, _unused_connection):
         logger.info("Connection opened")
@@ -97,6 +121,31 @@ class PikaSelectConnection:
         if callable(owner_set_can_interact):
             reactor.callFromThread(self.owner.set_can_interact, self.can_interact)
 
+    def __owner_update_is_blocked_value(self):
+        owner_set_is_blocked = getattr(self.owner, "set_is_blocked", None)
+        if callable(owner_set_is_blocked):
+            reactor.callFromThread(self.owner.set_is_blocked, self.is_blocked)
+
+    def __owner_call_on_publish_confirmed(self, payloads):
+        owner_on_publish_confirmed = getattr(self.owner, "on_publish_confirmed", None)
+        if callable(owner_on_publish_confirmed):
+            reactor.callFromThread(self.owner.on_publish_confirmed, payloads)
+
+    def __owner_call_on_publish_returned(self, payloads):
+        """Returns (message, queue_name, properties) of publishes which were nacked by broker,
+        left unconfirmed on channel close or skipped because channel is closed
+        """
+        owner_on_publish_returned = getattr(self.owner, "on_publish_returned", None)
+        if callable(owner_on_publish_returned):
+            reactor.callFromThread(self.owner.on_publish_returned, payloads)
+
+    def __return_unconfirmed(self):
+        if self._unconfirmed:
+            payloads = list(self._unconfirmed.values())
+            self._unconfirmed.clear()
+            logger.warning(f"{len(payloads)} published messages were not confirmed before close")
+            self.__owner_call_on_publish_returned(payloads)
+
     def __owner_schedule_graceful_shutdown(self):
         raise_close_spider = getattr(self.owner, "raise_close_spider", None)
         if callable(raise_close_spider):
@@ -145,13 +194,33 @@ class PikaSelectConnection:
         )
         self.connection.ioloop.call_later(self._RECONNECT_TIMEOUT, self.connection.ioloop.stop)
 
+    def on_connection_blocked(self, _unused_connection, method_frame):
+        logger.warning(f"Connection blocked by broker: {method_frame.method.reason}")
+        self.is_blocked = True
+        self.__owner_update_is_blocked_value()
+
+    def on_connection_unblocked(self, _unused_connection, _unused_method_frame):
+        logger.info("Connection unblocked by broker")
+        self.is_blocked = False
+        self.__owner_update_is_blocked_value()
+
     def on_connection_closed(self, _unused_connection, reason):
         self._channel = None
         self.can_interact = False
         self.__owner_update_can_interact_value()
+        self.__return_unconfirmed()
+        if self.is_blocked:
+            self.is_blocked = False
+            self.__owner_update_is_blocked_value()
 
         if self._stopping:
             self.connection.ioloop.stop()
+        elif self.options.get("reconnect_on_close", False):
+            # ioloop stop makes run() open new connection
+            logger.warning(
+                f"Connection was closed, reconnecting in {self._RECONNECT_TIMEOUT} seconds: {reason}"
+            )
+            self.connection.ioloop.call_later(self._RECONNECT_TIMEOUT, self.connection.ioloop.stop)
         else:
             self.can_interact = False
             self.__owner_update_can_interact_value()
@@ -165,6 +234,9 @@ class PikaSelectConnection:
     def on_channel_open(self, channel):
         logger.info("Channel opened")
         self._channel = channel
+        # publish sequence numbers restart on new channel
+        self._message_number = 0
+        self._confirmations_enabled = False
         self._channel.add_on_close_callback(self.on_channel_closed)
         self._channel.add_callback(
             self.on_basic_get_empty, [pika.spec.Basic.GetEmpty], one_shot=False
@@ -175,12 +247,22 @@ class PikaSelectConnection:
     def on_channel_closed(self, channel, reason):
         logger.warning("Channel {} was closed: {}".format(channel, reason))
         self._channel = None
+        self.__return_unconfirmed()
         if self._stopping:
             self.close_connection()
         else:
             self.can_interact = False
             self.__owner_update_can_interact_value()
-            self._init_graceful_shutdown()
+            if not self.options.get("reconnect_on_close", False):
+                self._init_graceful_shutdown()
+            elif self.connection is not None and self.connection.is_open:
+                logger.warning(f"Reopening channel in {self._RECONNECT_TIMEOUT} seconds")
+                self.connection.ioloop.call_later(self._RECONNECT_TIMEOUT, self._reopen_channel)
+            # otherwise connection is closing and is reopened in on_connection_closed
+
+    def _reopen_channel(self):
+        if not self._stopping and self.connection is not None and self.connection.is_open:
+            self.open_channel()
 
     def setup_queue(self, queue_name):
         """If queue require some specific properties at declaration subclass of this class should be created and
@@ -201,12 +283,19 @@ class PikaSelectConnection:
             callback=self.start_interacting,
         )
 
+    def update_qos(self, prefetch_count):
+        """Changes prefetch count of current channel at runtime. New value is kept for reopened channels"""
+        self.options = {**self.options, "prefetch_count": prefetch_count}
+        if self._channel is not None and self._channel.is_open:
+            self._channel.basic_qos(prefetch_count=prefetch_count)
+
     def start_interacting(self, _unused_frame):
         logger.info("Issuing consumer related RPC commands")
         if self.options.get(
             "enable_delivery_confirmations", self._DEFAULT_OPTIONS["enable_delivery_confirmations"]
         ):
             self.enable_delivery_confirmations()
+            self._confirmations_enabled = True
         self.can_interact = True
         self.__owner_update_can_interact_value()
 
@@ -258,19 +347,24 @@ class PikaSelectConnection:
 
     def on_delivery_confirmation(self, method_frame):
         confirmation_type = method_frame.method.NAME.split(".")[1].lower()
-        logger.debug(
-            "Received {} for delivery tag: {}".format(
-                confirmation_type, method_frame.method.delivery_tag
-            )
-        )
+        delivery_tag = method_frame.method.delivery_tag
+        logger.debug("Received {} for delivery tag: {}".format(confirmation_type, delivery_tag))
+        payloads = []
+        if method_frame.method.multiple:
+            # sequence numbers are kept in publish order
+            while self._unconfirmed and next(iter(self._unconfirmed)) <= delivery_tag:
+                payloads.append(self._unconfirmed.popitem(last=False)[1])
+        elif delivery_tag in self._unconfirmed:
+            payloads.append(self._unconfirmed.pop(delivery_tag))
         if confirmation_type == "ack":
-            self._acked += 1
+            self._acked += len(payloads)
+            self.__owner_call_on_publish_confirmed(payloads)
         elif confirmation_type == "nack":
-            self._nacked += 1
-        self._deliveries.remove(method_frame.method.delivery_tag)
+            self._nacked += len(payloads)
+            self.__owner_call_on_publish_returned(payloads)
         logger.debug(
             "Published {} messages, {} have yet to be confirmed, {} were acked and {} were nacked".format(
-                self._message_number, len(self._deliveries), self._acked, self._nacked
+                self._message_number, len(self._unconfirmed), self._acked, self._nacked
             )
         )
 
@@ -290,18 +384,16 @@ class PikaSelectConnection:
     def publish_message(
         self, message, queue_name: str = None, properties: pika.BasicProperties = None
     ):
-        if self._channel is None or not self._channel.is_open:
-            return
         if queue_name is None:
             queue_name = self.queue_name
         if properties is None:
             properties = pika.BasicProperties(content_type="application/json", delivery_mode=2)
+        if self._channel is None or not self._channel.is_open:
+            self.__owner_call_on_publish_returned([(message, queue_name, properties)])
+            return
 
         if queue_name == self.queue_name:
-            self._channel.basic_publish("", queue_name, message, properties)
-            self._message_number += 1
-            self._deliveries.append(self._message_number)
-            logger.debug("Published message # {}".format(self._message_number))
+            self.publish_to_ensured_queue(None, message, queue_name, properties)
         else:
             cb = functools.partial(
                 self.publish_to_ensured_queue,
@@ -314,7 +406,8 @@ class PikaSelectConnection:
     def publish_to_ensured_queue(self, _unused_frame, message, queue_name, properties):
         self._channel.basic_publish("", queue_name, message, properties)
         self._message_number += 1
-        self._deliveries.append(self._message_number)
+        if self._confirmations_enabled:
+            self._unconfirmed[self._message_number] = (message, queue_name, properties)
         logger.debug("Published message # {}".format(self._message_number))
 
     def get_message(self):
@@ -341,7 +434,7 @@ class PikaSelectConnection:
         self.__owner_call_on_msg_consumed_handler(msg_object)
 
     @log_current_thread
-    def acknowledge_message(self, delivery_tag):
+    def acknowledge_message(self, delivery_tag, multiple=False):
         if self.__ignore_ack_after:
             logger.info(
                 f"Skip acknowledgement. Reason: ignore ack after is set. "
@@ -350,9 +443,9 @@ class PikaSelectConnection:
             return
 
         if self._channel is not None and self._channel.is_open:
-            self._channel.basic_ack(delivery_tag)
+            self._channel.basic_ack(delivery_tag, multiple=multiple)
 
-    def negative_acknowledge_message(self, delivery_tag):
+    def negative_acknowledge_message(self, delivery_tag, requeue=True):
         if self.__ignore_ack_after:
             logger.info(
                 f"Skip acknowledgement. Reason: ignore nack after is set. "
@@ -360,7 +453,7 @@ class PikaSelectConnection:
             )
             return
         if self._channel is not None and self._channel.is_open:
-            self._channel.basic_nack(delivery_tag)
+            self._channel.basic_nack(delivery_tag, requeue=requeue)
 
     @log_current_thread
     def run(self):
@@ -369,7 +462,7 @@ class PikaSelectConnection:
             and not self._stopping
         ):
             self.connection = None
-            self._deliveries = []
+            self._unconfirmed.clear()
             self._acked = 0
             self._nacked = 0
             self._message_number = 0
@@ -397,7 +490,7 @@ class PikaSelectConnection:
         logger.debug("stop called from reactor event")
         if self.options.get(
             "enable_delivery_confirmations", self._DEFAULT_OPTIONS["enable_delivery_confirmations"]
-        ) and len(self._deliveries):
+        ) and len(self._unconfirmed):
             self._current_graceful_stop_attempts_count += 1
             if self._current_graceful_stop_attempts_count < self._MAX_GRACEFUL_STOP_ATTEMPTS:
                 self.connection.ioloop.call_later(
@@ -0,0 +1,484 @@
+import logging
+from datetime import datetime
+
+import pika
+from pika.adapters.twisted_connection import TwistedProtocolConnection
+from pika.exceptions import ChannelWrongStateError, ConnectionWrongStateError
+from twisted.internet import defer, protocol, reactor
+
+from rmq.utils.decorators import log_current_thread
+
+logger = logging.getLogger(__name__)
+
+
+class PikaTwistedConnection:
+    """Pika connection which runs AMQP directly on the twisted reactor.
+
+    Exposes the same owner callbacks and public methods as PikaSelectConnection, but
+    there is no separate ioloop thread: owner handlers are called directly, so deliveries,
+    acks and publishes do not hop between threads.
+    """
+
+    _MAX_CONNECT_ATTEMPTS = 3
+    _MAX_GRACEFUL_STOP_ATTEMPTS = 60
+    _RECONNECT_TIMEOUT = 5
+    _EMPTY_QUEUE_DELAY = 5
+    _CHECK_DELIVERY_CONFIRMATION_DELAY = 1
+
+    _DEFAULT_OPTIONS = {"enable_delivery_confirmations": True, "prefetch_count": 1}
+
+    def __init__(
+        self,
+        parameters: pika.ConnectionParameters,
+        queue_name,
+        owner,
+        options=None,
+        is_consumer=False,
+    ):
+        super(PikaTwistedConnection, self).__init__()
+        # owner of current instance
+        self.owner = owner
+
+        # connection parameters for pika
+        self.parameters = parameters
+        # default queue name to interact with
+        self.queue_name = queue_name
+
+        # additional options
+        self.options = (
+            options if options is not None and isinstance(options, dict) else self._DEFAULT_OPTIONS
+        )
+
+        # is current connection should start consuming on connection ready state
+        self.is_consumer = is_consumer
+
+        # state of ability to interact with connection/channel/queue
+        self.can_interact = False
+        # state of broker flow control (connection.blocked received on memory/disk alarm)
+        self.is_blocked = False
+
+        # store connection (TwistedProtocolConnection) and channel (TwistedChannel) internally
+        self.connection = None
+        self._channel = None
+
+        # status of stopping connection
+        self._stopping = False
+        self._current_connect_attempts_count = 0
+        self._current_graceful_stop_attempts_count = 0
+
+        self._message_number = 0
+        self._pending_confirmations = 0
+        self._acked = 0
+        self._nacked = 0
+        self._confirmations_enabled = False
+
+        self._consumer_tag = None
+        self._consuming = False
+
+        self.__ignore_ack_after = None
+
+        self.shutdown_event_handler = None
+
+    @staticmethod
+    def dispatch(connect_callable, *args):
+        """Runs owner connect callable. Connection lives on the reactor so no thread is required"""
+        connect_callable(*args)
+
+    def add_callback_threadsafe(self, callback):
+        """Callbacks are already invoked from the reactor thread, so they are called in place"""
+        callback()
+
+    @log_current_thread
+    def connect(self):
+        logger.info("Connecting to rabbitmq")
+        creator = protocol.ClientCreator(reactor, TwistedProtocolConnection, self.parameters)
+        d = creator.connectTCP(self.parameters.host, self.parameters.port)
+        d.addCallback(lambda connection: connection.ready)
+        d.addCallbacks(self.on_connection_open, self.on_connection_open_error)
+        return d
+
+    def on_connection_open(self, connection):
+        logger.info("Connection opened")
+        self.connection = connection
+        self.connection.closed.addCallback(self.on_connection_closed)
+        # Note: TwistedProtocolConnection does not proxy blocked/unblocked subscriptions
+        self.connection._impl.add_on_connection_blocked_callback(self.on_connection_blocked)
+        self.connection._impl.add_on_connection_unblocked_callback(self.on_connection_unblocked)
+        self._current_connect_attempts_count = 0
+        self._owner_call("set_connection_handle", self)
+        self.open_channel()
+
+    # section for describing owner flow controlling
+    def _owner_call(self, name, *args):
+        owner_method = getattr(self.owner, name, None)
+        if callable(owner_method):
+            owner_method(*args)
+
+    def _init_graceful_shutdown(self, with_stop=False):
+        # Note: skipping ack/nack for all events after channel closed event received. Schedule graceful
+        # shutdown of spider. Restart spider must be handled externally (pm2/docker swarm)
+        self.__ignore_ack_after = datetime.now().microsecond
+        self._owner_call("raise_close_spider")
+        if with_stop:
+            self.stop()
+
+    def on_connection_open_error(self, failure):
+        self.can_interact = False
+        self._owner_call("set_can_interact", self.can_interact)
+
+        self._current_connect_attempts_count += 1
+        if self._current_connect_attempts_count < self._MAX_CONNECT_ATTEMPTS and not self._stopping:
+            self.reconnect(failure.getErrorMessage())
+        else:
+            logger.error("Connection open max attempts count exceeded. Shutting down")
+            self._init_graceful_shutdown(True)
+
+    def reconnect(self, reason):
+        logger.warning(
+            f"Connection open failed, reopening in {self._RECONNECT_TIMEOUT} seconds: {reason}"
+        )
+        reactor.callLater(self._RECONNECT_TIMEOUT, self.run)
+
+    def on_connection_blocked(self, _unused_connection, method_frame):
+        logger.warning(f"Connection blocked by broker: {method_frame.method.reason}")
+        self.is_blocked = True
+        self._owner_call("set_is_blocked", self.is_blocked)
+
+    def on_connection_unblocked(self, _unused_connection, _unused_method_frame):
+        logger.info("Connection unblocked by broker")
+        self.is_blocked = False
+        self._owner_call("set_is_blocked", self.is_blocked)
+
+    def on_connection_closed(self, reason):
+        self._channel = None
+        self._consuming = False
+        self.can_interact = False
+        self._owner_call("set_can_interact", self.can_interact)
+        if self.is_blocked:
+            self.is_blocked = False
+            self._owner_call("set_is_blocked", self.is_blocked)
+
+        if self._stopping:
+            return
+        if self.options.get("reconnect_on_close", False):
+            logger.warning(
+                f"Connection was closed, reconnecting in {self._RECONNECT_TIMEOUT} seconds: {reason}"
+            )
+            reactor.callLater(self._RECONNECT_TIMEOUT, self._reconnect_after_close)
+        else:
+            logger.warning(f"Connection was closed: {reason}")
+            self._init_graceful_shutdown()
+
+    def _reconnect_after_close(self):
+        if not self._stopping:
+            self.run()
+
+    def open_channel(self):
+        logger.info("Creating a new channel")
+        d = self.connection.channel()
+        d.addCallbacks(self.on_channel_open, self.on_channel_error)
+
+    def on_channel_error(self, failure):
+        logger.error(f"Channel operation failed: {failure.getErrorMessage()}")
+
+    @log_current_thread
+    def on_channel_open(self, channel):
+        logger.info("Channel opened")
+        self._channel = channel
+        self._confirmations_enabled = False
+        self._channel.on_closed.addCallback(self.on_channel_closed, channel)
+        self.__ignore_ack_after = None
+        self.setup_queue(self.queue_name)
+
+    def on_channel_closed(self, reason, channel):
+        logger.warning("Channel {} was closed: {}".format(channel, reason))
+        if self._channel is channel:
+            self._channel = None
+        self._consuming = False
+        if self._stopping:
+            return
+        self.can_interact = False
+        self._owner_call("set_can_interact", self.can_interact)
+        if not self.options.get("reconnect_on_close", False):
+            self._init_graceful_shutdown()
+        elif self.connection is not None and not self.connection.is_closed:
+            logger.warning(f"Reopening channel in {self._RECONNECT_TIMEOUT} seconds")
+            reactor.callLater(self._RECONNECT_TIMEOUT, self._reopen_channel)
+        # otherwise connection is closing and is reopened in on_connection_closed
+
+    def _reopen_channel(self):
+        if not self._stopping and self.connection is not None and self.connection.is_open:
+            self.open_channel()
+
+    def setup_queue(self, queue_name):
+        """If queue require some specific properties at declaration subclass of this class should be created and
+        this method should be overridden"""
+        logger.info("Declaring queue {}".format(queue_name))
+        d = self._channel.queue_declare(queue=queue_name, durable=True)
+        d.addCallbacks(self.on_queue_declare_ok, self.on_channel_error)
+
+    def on_queue_declare_ok(self, _unused_frame):
+        logger.info("Queue declared")
+        self.set_qos()
+
+    def set_qos(self):
+        d = self._channel.basic_qos(
+            prefetch_count=self.options["prefetch_count"]
+            or self._DEFAULT_OPTIONS["prefetch_count"]
+        )
+        d.addCallbacks(self.start_interacting, self.on_channel_error)
+
+    def update_qos(self, prefetch_count):
+        """Changes prefetch count of current channel at runtime. New value is kept for reopened channels"""
+        self.options = {**self.options, "prefetch_count": prefetch_count}
+        if self._channel is not None and self._channel.is_open:
+            d = self._channel.basic_qos(prefetch_count=prefetch_count)
+            d.addErrback(self.on_channel_error)
+
+    @defer.inlineCallbacks
+    def start_interacting(self, _unused_frame):
+        logger.info("Issuing consumer related RPC commands")
+        if self.options.get(
+            "enable_delivery_confirmations", self._DEFAULT_OPTIONS["enable_delivery_confirmations"]
+        ):
+            yield self.enable_delivery_confirmations()
+            self._confirmations_enabled = True
+        self.can_interact = True
+        self._owner_call("set_can_interact", self.can_interact)
+
+        if self.is_consumer is True:
+            queue_object, self._consumer_tag = yield self._channel.basic_consume(
+                queue=self.queue_name, auto_ack=False
+            )
+            self._consuming = True
+            self._read_queue(queue_object)
+
+    def _read_queue(self, queue_object):
+        # Note: already fired deferreds are drained in a loop to avoid recursion on large prefetch backlog
+        while self._consuming:
+            d = queue_object.get()
+            if not d.called:
+                d.addCallbacks(
+                    self._on_queue_message,
+                    self._on_queue_closed,
+                    callbackArgs=(queue_object,),
+                )
+                return
+            d.addCallbacks(self._dispatch_queue_message, self._on_queue_closed)
+
+    def _dispatch_queue_message(self, message):
+        # Note: owner errors are logged here, so queue reading is re-armed on both delivery paths
+        try:
+            self.on_message(message.channel, message.method, message.properties, message.body)
+        except Exception:
+            logger.exception(f"Failed to handle delivery {message.method.delivery_tag}")
+
+    def _on_queue_message(self, message, queue_object):
+        self._dispatch_queue_message(message)
+        self._read_queue(queue_object)
+
+    def _on_queue_closed(self, failure):
+        self._consuming = False
+        if failure.check(pika.exceptions.ConsumerCancelled) and not self._stopping:
+            logger.info("Consumer was cancelled remotely, reopen consumer")
+            reactor.callLater(self._EMPTY_QUEUE_DELAY, self.setup_queue, self.queue_name)
+
+    def stop_consuming(self):
+        if self._channel and self._consuming:
+            logger.info("Sending a Basic.Cancel RPC command to RabbitMQ")
+            self._consuming = False
+            return self._channel.basic_cancel(self._consumer_tag)
+        return defer.succeed(None)
+
+    def enable_delivery_confirmations(self):
+        logger.info("Issuing Confirm.Select RPC command")
+        return self._channel.confirm_delivery()
+
+    def on_delivery_confirmation(self, result, is_acked, payload):
+        """Publish deferred is errbacked when broker nacks message or channel is closed before confirm"""
+        self._pending_confirmations -= 1
+        if is_acked:
+            self._acked += 1
+            self._owner_call("on_publish_confirmed", [payload])
+        else:
+            self._nacked += 1
+            logger.warning(f"Message was not confirmed by broker: {result.getErrorMessage()}")
+            self._owner_call("on_publish_returned", [payload])
+        logger.debug(
+            "Published {} messages, {} have yet to be confirmed, {} were acked and {} were nacked".format(
+                self._message_number, self._pending_confirmations, self._acked, self._nacked
+            )
+        )
+
+    def get_ready_messages_count(self, queue_name=None, callback=None):
+        if queue_name is None:
+            queue_name = self.queue_name
+        d = self._channel.queue_declare(queue=queue_name, durable=True, passive=True)
+        d.addCallback(self._exec_get_ready_messages_count_issuer_callback, callback=callback)
+        d.addErrback(self.on_channel_error)
+
+    def _exec_get_ready_messages_count_issuer_callback(self, frame, callback):
+        message_count = frame.method.message_count
+        if callback is not None:
+            callback(message_count=message_count)
+
+    def publish_message(
+        self, message, queue_name: str = None, properties: pika.BasicProperties = None
+    ):
+        if queue_name is None:
+            queue_name = self.queue_name
+        if properties is None:
+            properties = pika.BasicProperties(content_type="application/json", delivery_mode=2)
+        if self._channel is None or not self._channel.is_open:
+            self._owner_call("on_publish_returned", [(message, queue_name, properties)])
+            return
+
+        if queue_name == self.queue_name:
+            self.publish_to_ensured_queue(None, message, queue_name, properties)
+        else:
+            d = self._channel.queue_declare(queue=queue_name, durable=True)
+            d.addCallback(
+                self.publish_to_ensured_queue,
+                message=message,
+                queue_name=queue_name,
+                properties=properties,
+            )
+            d.addErrback(self.on_channel_error)
+
+    def publish_to_ensured_queue(self, _unused_frame, message, queue_name, properties):
+        d = self._channel.basic_publish("", queue_name, message, properties)
+        self._message_number += 1
+        if self._confirmations_enabled:
+            self._pending_confirmations += 1
+            payload = (message, queue_name, properties)
+            d.addCallbacks(
+                self.on_delivery_confirmation,
+                self.on_delivery_confirmation,
+                callbackArgs=(True, payload),
+                errbackArgs=(False, payload),
+            )
+        logger.debug("Published message # {}".format(self._message_number))
+
+    def get_message(self):
+        if self._channel is None or not self._channel.is_open:
+            return None
+        d = self._channel.basic_get(queue=self.queue_name, auto_ack=False)
+        d.addCallbacks(self._on_basic_get_result, self.on_channel_error)
+
+    def _on_basic_get_result(self, message):
+        if message is None:
+            self.on_basic_get_empty(None)
+        else:
+            self.on_basic_get_message(
+                message.channel, message.method, message.properties, message.body
+            )
+
+    def on_basic_get_message(self, channel, method, properties, body):
+        msg_object = {"channel": channel, "method": method, "properties": properties, "body": body}
+        self._owner_call("on_basic_get_message", msg_object)
+
+    def on_basic_get_empty(self, _method):
+        logger.debug(
+            "empty queue allow try again consuming in {} seconds".format(self._EMPTY_QUEUE_DELAY)
+        )
+        reactor.callLater(self._EMPTY_QUEUE_DELAY, self._owner_call, "on_basic_get_empty")
+
+    def on_message(self, channel, method, properties, body):
+        msg_object = {"channel": channel, "method": method, "properties": properties, "body": body}
+        self._owner_call("on_message_consumed", msg_object)
+
+    def acknowledge_message(self, delivery_tag, multiple=False):
+        if self.__ignore_ack_after:
+            logger.info(
+                f"Skip acknowledgement. Reason: ignore ack after is set. "
+                f"Ignore ts:{self.__ignore_ack_after} ms"
+            )
+            return
+
+        if self._channel is not None and self._channel.is_open:
+            self._channel.basic_ack(delivery_tag, multiple=multiple)
+
+    def negative_acknowledge_message(self, delivery_tag, requeue=True):
+        if self.__ignore_ack_after:
+            logger.info(
+                f"Skip acknowledgement. Reason: ignore nack after is set. "
+                f"Ignore ts:{self.__ignore_ack_after} ms"
+            )
+            return
+        if self._channel is not None and self._channel.is_open:
+            self._channel.basic_nack(delivery_tag, requeue=requeue)
+
+    def run(self):
+        self.connection = None
+        self._pending_confirmations = 0
+        self._acked = 0
+        self._nacked = 0
+        self._message_number = 0
+
+        if self.shutdown_event_handler is None:
+            self.shutdown_event_handler = reactor.addSystemEventTrigger(
+                "before", "shutdown", self.stop_from_reactor_event
+            )
+        return self.connect()
+
+    def stop_from_reactor_event(self):
+        """Returned deferred postpones reactor shutdown until pending confirmations are received"""
+        logger.debug("stop called from reactor event")
+        self.shutdown_event_handler = None
+        d = defer.Deferred()
+        self._wait_for_confirmations(d)
+        d.addCallback(lambda _: self.stop())
+        return d
+
+    def _wait_for_confirmations(self, d):
+        if self._pending_confirmations > 0 and self._channel is not None:
+            self._current_graceful_stop_attempts_count += 1
+            if self._current_graceful_stop_attempts_count < self._MAX_GRACEFUL_STOP_ATTEMPTS:
+                reactor.callLater(
+                    self._CHECK_DELIVERY_CONFIRMATION_DELAY, self._wait_for_confirmations, d
+                )
+                return
+        d.callback(None)
+
+    def stop(self):
+        if self.shutdown_event_handler is not None:
+            try:
+                reactor.removeSystemEventTrigger(self.shutdown_event_handler)
+            except (KeyError, ValueError, TypeError):
+                pass
+            self.shutdown_event_handler = None
+        self._current_connect_attempts_count = 0
+        self._current_graceful_stop_attempts_count = 0
+        self.can_interact = False
+        self._owner_call("set_can_interact", self.can_interact)
+        if self._stopping:
+            return defer.succeed(None)
+        logger.info("Stopping In Progress")
+        self._stopping = True
+        d = self.stop_consuming() if self.is_consumer else defer.succeed(None)
+        d.addBoth(lambda _: self.close_channel())
+        d.addBoth(lambda _: self.close_connection())
+        d.addBoth(lambda _: logger.info("Stopped"))
+        return d
+
+    def close_channel(self):
+        if self._channel is not None and self._channel.is_open:
+            logger.info("Closing the channel")
+            closed = self._channel.on_closed
+            try:
+                self._channel.close()
+            except ChannelWrongStateError as cwse:
+                logger.error(repr(cwse))
+                return None
+            return closed
+        return None
+
+    def close_connection(self):
+        self._consuming = False
+        if self.connection is not None and not self.connection.is_closed:
+            logger.info("Closing connection")
+            try:
+                return self.connection.close()
+            except ConnectionWrongStateError as cwse:
+                logger.error(repr(cwse))
+        return None
@@ -1 +1,2 @@
 from .consumed_data_corrupted import ConsumedDataCorrupted
+from .message_not_processed import MessageNotProcessed
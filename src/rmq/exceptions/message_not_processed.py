@@ -0,0 +1,2 @@
+class MessageNotProcessed(Exception):
+    """Raised within message transaction to roll it back when document is not processed"""
@@ -1,7 +1,8 @@
 import functools
 import json
 import logging
-from copy import deepcopy
+import time
+from collections import deque
 from enum import IntEnum
 from typing import Union
 
@@ -12,21 +13,23 @@ from scrapy.core.downloader.handlers.http11 import TunnelError
 from scrapy.exceptions import CloseSpider, DontCloseSpider
 from scrapy.http import Response
 from scrapy.spidermiddlewares.httperror import HttpError
-from twisted.internet import reactor, task
+from twisted.internet import task
 from twisted.internet.error import DNSLookupError, TCPTimedOutError, TimeoutError
 from twisted.python.failure import Failure
 
 # import rmq module specific
-from rmq.connections import PikaSelectConnection
+from rmq.connections import get_connection_class
 from rmq.signals import callback_completed, errback_completed, item_scheduled
-from rmq.utils import (RMQConstants, RMQDefaultOptions, Task, TaskObserver, TaskStatusCodes,
-                       extract_delivery_tag_from_failure)
+from rmq.utils import (AckCoalescer, MessageEnvelope, PrefetchController, RMQConstants,
+                       RMQDefaultOptions, Task, TaskAccountant, TaskObserver, TaskStatusCodes,
+                       extract_delivery_tag_from_failure, pause_crawl, set_task_accountant,
+                       unpause_crawl)
 from rmq.utils.decorators import call_once, rmq_callback, rmq_errback
 
 logger = logging.getLogger(__name__)
 
 
-class RPCTaskConsumer(object):
+class RPCTaskConsumer(TaskAccountant):
     class CompletionStrategies(IntEnum):
         REQUESTS_BASED = 0
         WEAK_ITEMS_BASED = 1
@@ -34,6 +37,8 @@ class RPCTaskConsumer(object):
         DEFAULT = REQUESTS_BASED
 
     _RELIEVE_DELAY = 3
+    _DEFAULT_ACK_FLUSH_INTERVAL = 0.5  # seconds
+    _DEFAULT_WATCHDOG_INTERVAL = 10  # seconds
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -46,12 +51,14 @@ class RPCTaskConsumer(object):
         """Subscribe to signals which controls requests scheduling and responses or error retrieving"""
         crawler.signals.connect(o.on_request_scheduled, signal=signals.request_scheduled)
         crawler.signals.connect(o.on_request_dropped, signal=signals.request_dropped)
-        crawler.signals.connect(o.on_callback_completed, signal=callback_completed)
-        crawler.signals.connect(o.on_errback_completed, signal=errback_completed)
         crawler.signals.connect(o.on_spider_error, signal=signals.spider_error)
+        if not o.direct_accounting:
+            crawler.signals.connect(o.on_callback_completed, signal=callback_completed)
+            crawler.signals.connect(o.on_errback_completed, signal=errback_completed)
 
         """Subscribe to signals which controls item processing"""
-        crawler.signals.connect(o.on_item_scheduled, signal=item_scheduled)
+        if not o.direct_accounting:
+            crawler.signals.connect(o.on_item_scheduled, signal=item_scheduled)
         crawler.signals.connect(o.on_item_scraped, signal=signals.item_scraped)
         crawler.signals.connect(o.on_item_dropped, signal=signals.item_dropped)
         crawler.signals.connect(o.on_item_error, signal=signals.item_error)
@@ -67,11 +74,27 @@ class RPCTaskConsumer(object):
         self.delivery_tag_meta_key = RMQConstants.DELIVERY_TAG_META_KEY.value
         self.msg_body_meta_key = RMQConstants.MSG_BODY_META_KEY.value
 
+        # rmq_callback/rmq_errback results are accounted by direct calls instead of signals
+        self.direct_accounting = crawler.settings.getbool("RABBITMQ_DIRECT_ACCOUNTING_ENABLED", False)
+
+        self.connection_class = get_connection_class(crawler.settings)
         self.rmq_connection = None
         self._can_interact = False
         self._can_get_next_message = False
         self._relieve_task = None
-        self.pending_relieve = {"ack": [], "nack": []}
+        self.pending_relieve = {"ack": deque(), "nack": deque()}
+        self._pending_relieve_tags = set()
+
+        self.ack_coalescer = None
+        self._ack_flush_task = None
+        self._ack_flush_threshold = 1
+        self.prefetch_controller = None
+
+        # default task deadline in seconds (0 - no deadline unless task message provides it in header)
+        self.task_timeout = 0
+        # expired task without reply_to is nacked with this requeue flag
+        self.task_timeout_requeue = False
+        self._watchdog_task = None
 
     def spider_opened(self, spider):
         """execute on spider_opened signal and initialize connection, callbacks, start consuming"""
@@ -90,6 +113,8 @@ class RPCTaskConsumer(object):
         )
         if not isinstance(self.completion_strategy, RPCTaskConsumer.CompletionStrategies):
             self.completion_strategy = RPCTaskConsumer.CompletionStrategies.DEFAULT
+        if self.direct_accounting:
+            set_task_accountant(self.__spider, self)
 
         """Configure loggers"""
         logger.setLevel(self.__spider.settings.get("LOG_LEVEL", "INFO"))
@@ -98,7 +123,7 @@ class RPCTaskConsumer(object):
         """Declare/retrieve queue name from spider instance"""
         task_queue_name = spider.task_queue_name
 
-        """Build pika connection parameters and start connection in separate twisted thread"""
+        """Build pika connection parameters and start connection (in separate twisted thread for select backend)"""
         parameters = pika.ConnectionParameters(
             host=self.__spider.settings.get("RABBITMQ_HOST"),
             port=int(self.__spider.settings.get("RABBITMQ_PORT")),
@@ -109,21 +134,64 @@ class RPCTaskConsumer(object):
             ),
             heartbeat=RMQDefaultOptions.CONNECTION_HEARTBEAT.value,
         )
-        reactor.callInThread(self.connect, parameters, task_queue_name)
+        self.connection_class.dispatch(self.connect, parameters, task_queue_name)
 
         """Declare fallback LoopingCall to ack/nack probably unacked messages (or before scheduled shutdown)"""
         self._relieve_task = task.LoopingCall(self._relieve)
         self._relieve_task.start(self._RELIEVE_DELAY)
 
+        """Coalesce acknowledgements of completed tasks into basic_ack(multiple=True) frames"""
+        if self.__spider.settings.getbool("RABBITMQ_ACK_COALESCING_ENABLED", False):
+            # completed tags hold prefetch slots until flushed, so threshold must stay below prefetch count
+            prefetch_count = self.__spider.settings.getint("CONCURRENT_REQUESTS", 1)
+            flush_threshold = self.__spider.settings.getint("RABBITMQ_ACK_FLUSH_THRESHOLD", 0)
+            if flush_threshold <= 0:
+                flush_threshold = max(1, prefetch_count // 4)
+            self._ack_flush_threshold = flush_threshold
+            self.ack_coalescer = AckCoalescer(
+                self._send_acks, threshold=min(flush_threshold, prefetch_count)
+            )
+            self._ack_flush_task = task.LoopingCall(self.ack_coalescer.flush)
+            self._ack_flush_task.start(
+                self.__spider.settings.getfloat(
+                    "RABBITMQ_ACK_FLUSH_INTERVAL", self._DEFAULT_ACK_FLUSH_INTERVAL
+                ),
+                now=False,
+            )
+
+        """Declare watchdog LoopingCall which releases tasks stuck beyond their deadlines"""
+        self.task_timeout = self.__spider.settings.getfloat("RABBITMQ_TASK_TIMEOUT", 0)
+        self.task_timeout_requeue = self.__spider.settings.getbool("RABBITMQ_TASK_TIMEOUT_REQUEUE", False)
+        self._watchdog_task = task.LoopingCall(self._expire_tasks)
+        self._watchdog_task.start(
+            self.__spider.settings.getfloat(
+                "RABBITMQ_TASK_WATCHDOG_INTERVAL", self._DEFAULT_WATCHDOG_INTERVAL
+            ),
+            now=False,
+        )
+
+        """Adjust prefetch count at runtime according to engine load"""
+        if self.__spider.settings.getbool("RABBITMQ_ADAPTIVE_PREFETCH_ENABLED", False):
+            self.prefetch_controller = PrefetchController.from_crawler(
+                self.crawler,
+                get_connection=lambda: self.rmq_connection,
+                get_in_flight=self.__spider.processing_tasks.current_processing_count,
+                on_change=self._on_prefetch_count_changed,
+            )
+            self.prefetch_controller.start()
+
     def spider_closed(self, spider):
+        if self.prefetch_controller is not None:
+            self.prefetch_controller.stop()
+        if self._watchdog_task is not None and self._watchdog_task.running:
+            self._watchdog_task.stop()
         self._relieve()
-        if self.rmq_connection is not None and isinstance(
-            self.rmq_connection, PikaSelectConnection
-        ):
-            if isinstance(self.rmq_connection.connection, pika.SelectConnection):
-                self.rmq_connection.connection.ioloop.add_callback_threadsafe(
-                    self.rmq_connection.stop
-                )
+        if self._ack_flush_task is not None and self._ack_flush_task.running:
+            self._ack_flush_task.stop()
+        if self.ack_coalescer is not None:
+            self.ack_coalescer.flush()
+        if self.rmq_connection is not None:
+            self.rmq_connection.add_callback_threadsafe(self.rmq_connection.stop)
 
     def spider_idle(self, spider):
         raise DontCloseSpider
@@ -135,11 +203,16 @@ class RPCTaskConsumer(object):
             and request.meta.get("redirect_times") is None
         ):
             delivery_tag = request.meta.get(self.delivery_tag_meta_key)
+            if spider.processing_tasks.get_task(delivery_tag) is None:
+                # task is already completed or expired by watchdog
+                return
             spider.processing_tasks.handle_request(delivery_tag)
 
     def on_request_dropped(self, request, spider):
         if self.delivery_tag_meta_key in request.meta.keys():
             delivery_tag = request.meta.get(self.delivery_tag_meta_key)
+            if spider.processing_tasks.get_task(delivery_tag) is None:
+                return
             spider.processing_tasks.handle_response(delivery_tag, 600)
             self._check_is_completed(spider, delivery_tag)
 
@@ -150,6 +223,8 @@ class RPCTaskConsumer(object):
                 if delivery_tag is None
                 else delivery_tag
             )
+            if spider.processing_tasks.get_task(delivery_tag) is None:
+                return
             spider.processing_tasks.handle_response(delivery_tag, response.status)
         self._check_is_completed(spider, delivery_tag)
 
@@ -160,13 +235,14 @@ class RPCTaskConsumer(object):
                 if delivery_tag is None
                 else delivery_tag
             )
-            if spider.processing_tasks.get_task(delivery_tag).failed_responses == 0:
+            current_task = spider.processing_tasks.get_task(delivery_tag)
+            if current_task is not None and current_task.failed_responses == 0:
                 spider.processing_tasks.handle_response(delivery_tag, 600)
         self._check_is_completed(spider, delivery_tag)
 
     def on_spider_error(self, failure, response, spider):
         delivery_tag = response.meta.get(self.delivery_tag_meta_key)
-        if delivery_tag is not None:
+        if delivery_tag is not None and spider.processing_tasks.get_task(delivery_tag) is not None:
             hardware_errors = [
                 HttpError,
                 TunnelError,
@@ -189,12 +265,8 @@ class RPCTaskConsumer(object):
                     delivery_tag = response.meta.get(self.delivery_tag_meta_key, None)
 
             if delivery_tag is not None:
-                current_task = spider.processing_tasks.get_task(delivery_tag)
-                if (
-                    not current_task
-                    and self.completion_strategy
-                    == RPCTaskConsumer.CompletionStrategies.WEAK_ITEMS_BASED
-                ):
+                if not spider.processing_tasks.get_task(delivery_tag):
+                    # task is already completed or expired by watchdog
                     return
                 spider.processing_tasks.handle_item_scheduled(delivery_tag)
             else:
@@ -212,12 +284,8 @@ class RPCTaskConsumer(object):
                 delivery_tag = getattr(item, self.delivery_tag_meta_key, None)
 
             if delivery_tag is not None:
-                current_task = spider.processing_tasks.get_task(delivery_tag)
-                if (
-                    not current_task
-                    and self.completion_strategy
-                    == RPCTaskConsumer.CompletionStrategies.WEAK_ITEMS_BASED
-                ):
+                if not spider.processing_tasks.get_task(delivery_tag):
+                    # task is already completed or expired by watchdog
                     return
                 spider.processing_tasks.handle_item_scraped(delivery_tag)
             else:
@@ -229,12 +297,8 @@ class RPCTaskConsumer(object):
             if delivery_tag is None and hasattr(item, self.delivery_tag_meta_key):
                 delivery_tag = getattr(item, self.delivery_tag_meta_key, None)
             if delivery_tag is not None:
-                current_task = spider.processing_tasks.get_task(delivery_tag)
-                if (
-                    not current_task
-                    and self.completion_strategy
-                    == RPCTaskConsumer.CompletionStrategies.WEAK_ITEMS_BASED
-                ):
+                if not spider.processing_tasks.get_task(delivery_tag):
+                    # task is already completed or expired by watchdog
                     return
                 spider.processing_tasks.handle_item_dropped(delivery_tag)
 
@@ -244,12 +308,8 @@ class RPCTaskConsumer(object):
             if delivery_tag is None and hasattr(item, self.delivery_tag_meta_key):
                 delivery_tag = getattr(item, self.delivery_tag_meta_key, None)
             if delivery_tag is not None:
-                current_task = spider.processing_tasks.get_task(delivery_tag)
-                if (
-                    not current_task
-                    and self.completion_strategy
-                    == RPCTaskConsumer.CompletionStrategies.WEAK_ITEMS_BASED
-                ):
+                if not spider.processing_tasks.get_task(delivery_tag):
+                    # task is already completed or expired by watchdog
                     return
                 spider.processing_tasks.handle_item_error(delivery_tag)
 
@@ -258,11 +318,8 @@ class RPCTaskConsumer(object):
             spider = self.__spider
         if delivery_tag is not None and spider is not None:
             current_task = spider.processing_tasks.get_task(delivery_tag)
-            if (
-                not current_task
-                and self.completion_strategy
-                is RPCTaskConsumer.CompletionStrategies.WEAK_ITEMS_BASED
-            ):
+            if not current_task:
+                # task is already completed or expired by watchdog
                 return
             is_completed = False
             if self.completion_strategy == RPCTaskConsumer.CompletionStrategies.REQUESTS_BASED:
@@ -315,36 +372,64 @@ class RPCTaskConsumer(object):
                             current_task.status = TaskStatusCodes.PARTIAL_SUCCESS
             if is_completed:
                 if current_task.reply_to is not None:
-                    payload = {
-                        **deepcopy(current_task.payload),
-                        **{
-                            "status": current_task.status,
-                            "exception": current_task.exception,
-                        }
-                    }
-                    if isinstance(self.rmq_connection.connection, pika.SelectConnection):
-                        cb = functools.partial(
-                            self.rmq_connection.publish_message,
-                            message=json.dumps(payload),
-                            queue_name=current_task.reply_to,
-                        )
-                    self.rmq_connection.connection.ioloop.add_callback_threadsafe(cb)
-
-                if self._can_interact and self.__spider is not None:
-                    if hasattr(self.__spider, 'rmq_test_mode') and self.__spider.rmq_test_mode is True:
-                        logger.critical('TASK MUST BE ACKED HERE ' * 4)
-                    else:
-                        current_task.ack()
-                else:
-                    # Note: possible deprecated to store delivery tags internally and LoopingCall: _relieve is redundant
-                    if delivery_tag not in self.pending_relieve["ack"]:
-                        self.pending_relieve["ack"].append(delivery_tag)
+                    self._reply(current_task)
+                self._release_task(current_task, ack=True)
 
                 if hasattr(spider, "processing_tasks") and isinstance(
                     spider.processing_tasks, TaskObserver
                 ):
                     spider.processing_tasks.remove_task(delivery_tag)
 
+    def _reply(self, current_task):
+        # shallow merge is enough: task payload isn't shared with request meta
+        payload = {
+            **current_task.payload,
+            "status": current_task.status,
+            "exception": current_task.exception,
+        }
+        cb = functools.partial(
+            self.rmq_connection.publish_message,
+            message=json.dumps(payload),
+            queue_name=current_task.reply_to,
+        )
+        self.rmq_connection.add_callback_threadsafe(cb)
+
+    def _release_task(self, current_task, ack=True, requeue=True):
+        """Acks/nacks task message or postpones it to _relieve if connection is not ready"""
+        if self._can_interact and self.__spider is not None:
+            if hasattr(self.__spider, 'rmq_test_mode') and self.__spider.rmq_test_mode is True:
+                logger.critical('TASK MUST BE ACKED HERE ' * 4)
+            elif ack:
+                current_task.ack()
+            else:
+                current_task.nack(requeue=requeue)
+        else:
+            # Note: possible deprecated to store delivery tags internally and LoopingCall: _relieve is redundant
+            if current_task.delivery_tag not in self._pending_relieve_tags:
+                self._pending_relieve_tags.add(current_task.delivery_tag)
+                # task is removed from observer right after, so keep task itself instead of tag
+                self.pending_relieve["ack" if ack else "nack"].append((current_task, requeue))
+
+    def _expire_tasks(self):
+        """Releases tasks which exceeded their deadlines, so their prefetch slots are recovered.
+        Task is replied with TIMEOUT status and acked if it has reply_to, otherwise it is nacked
+        """
+        if self.__spider is None:
+            return
+        for expired_task in self.__spider.processing_tasks.pop_expired():
+            logger.warning(
+                f"Task {expired_task.delivery_tag} exceeded its deadline "
+                f"({time.monotonic() - expired_task.created_at:.1f}s), releasing it: {expired_task!r}"
+            )
+            self.crawler.stats.inc_value("rmq/task_timeout_count")
+            expired_task.status = TaskStatusCodes.TIMEOUT
+            if expired_task.reply_to is not None and self.rmq_connection is not None:
+                self._reply(expired_task)
+                self._release_task(expired_task, ack=True)
+            else:
+                # task which always times out must not be redelivered forever (dead-lettered by default)
+                self._release_task(expired_task, ack=False, requeue=self.task_timeout_requeue)
+
     def _validate_spider_has_attributes(self):
         spider_attributes = [
             attr for attr in dir(self.__spider) if not callable(getattr(self.__spider, attr))
@@ -388,12 +473,25 @@ class RPCTaskConsumer(object):
     def set_connection_handle(self, connection):
         self.rmq_connection = connection
         self._can_interact = True
+        if self.ack_coalescer is not None:
+            # delivery tags of previous channel are not valid anymore
+            self.ack_coalescer.reset()
         self._can_get_next_message = True
 
     def set_can_interact(self, can_interact):
         self._can_interact = can_interact
         self._can_get_next_message = can_interact
 
+    def set_is_blocked(self, is_blocked):
+        """Pause crawl while broker blocks connection, so replies and new tasks are not piled up in memory"""
+        if is_blocked:
+            logger.warning("RabbitMQ connection is blocked. Pausing crawl")
+            self.crawler.stats.inc_value("rmq/connection_blocked_count")
+            pause_crawl(self.crawler, self)
+        else:
+            logger.info("RabbitMQ connection is unblocked. Resuming crawl")
+            unpause_crawl(self.crawler, self)
+
     def raise_close_spider(self):
         if self.crawler.engine.slot is None or self.crawler.engine.slot.closing:
             logger.critical("SPIDER ALREADY CLOSED")
@@ -401,7 +499,7 @@ class RPCTaskConsumer(object):
         self.crawler.engine.close_spider(self.__spider)
 
     def connect(self, parameters, queue_name):
-        c = PikaSelectConnection(
+        c = self.connection_class(
             parameters,
             queue_name,
             owner=self,
@@ -422,33 +520,70 @@ class RPCTaskConsumer(object):
             if len(pending_ack) == 0 and len(pending_nack) == 0:
                 return
             while len(pending_ack):
-                delivery_tag = pending_ack.pop(0)
-                self.__spider.processing_tasks.get_task(delivery_tag).ack()
+                pending_task, _ = pending_ack.popleft()
+                self._pending_relieve_tags.discard(pending_task.delivery_tag)
+                pending_task.ack()
             while len(pending_nack):
-                delivery_tag = pending_nack.pop(0)
-                self.__spider.processing_tasks.get_task(delivery_tag).nack()
+                pending_task, requeue = pending_nack.popleft()
+                self._pending_relieve_tags.discard(pending_task.delivery_tag)
+                pending_task.nack(requeue=requeue)
+
+    def _send_acks(self, frames):
+        """Sends coalesced ack frames with single pika ioloop wakeup"""
+        if self.rmq_connection is None:
+            return
+        self.crawler.stats.inc_value("rmq/ack_frames_count", len(frames))
+        self.rmq_connection.add_callback_threadsafe(
+            functools.partial(self._acknowledge_frames, self.rmq_connection, frames)
+        )
+
+    @staticmethod
+    def _acknowledge_frames(connection, frames):
+        for delivery_tag, multiple in frames:
+            connection.acknowledge_message(delivery_tag=delivery_tag, multiple=multiple)
+
+    def _on_prefetch_count_changed(self, prefetch_count):
+        # completed tags hold prefetch slots until flushed
+        if self.ack_coalescer is not None:
+            self.ack_coalescer.threshold = max(1, min(self._ack_flush_threshold, prefetch_count))
+
+    def _nack_coalesced(self, delivery_tag, generation, requeue=True):
+        if self.ack_coalescer.discard(delivery_tag, generation):
+            self._nack(self.rmq_connection, delivery_tag, requeue=requeue)
+
+    @staticmethod
+    def _nack(rmq_connection, delivery_tag, requeue=True):
+        rmq_connection.add_callback_threadsafe(
+            functools.partial(
+                rmq_connection.negative_acknowledge_message,
+                delivery_tag=delivery_tag,
+                requeue=requeue,
+            )
+        )
 
     def on_basic_get_message(self, message):
         delivery_tag = message.get("method").delivery_tag
-        ack_cb = nack_cb = None
-        if isinstance(self.rmq_connection.connection, pika.SelectConnection):
+        if self.ack_coalescer is not None:
+            generation = self.ack_coalescer.register(delivery_tag)
             ack_cb = call_once(
-                functools.partial(
-                    self.rmq_connection.connection.ioloop.add_callback_threadsafe,
-                    functools.partial(
-                        self.rmq_connection.acknowledge_message, delivery_tag=delivery_tag
-                    ),
-                )
+                functools.partial(self.ack_coalescer.complete, delivery_tag, generation)
             )
-            nack_cb = call_once(
+            nack_cb = call_once(functools.partial(self._nack_coalesced, delivery_tag, generation))
+        else:
+            ack_cb = call_once(
                 functools.partial(
-                    self.rmq_connection.connection.ioloop.add_callback_threadsafe,
+                    self.rmq_connection.add_callback_threadsafe,
                     functools.partial(
-                        self.rmq_connection.negative_acknowledge_message, delivery_tag=delivery_tag
+                        self.rmq_connection.acknowledge_message, delivery_tag=delivery_tag
                     ),
                 )
             )
-        rmq_task = Task(message, ack_cb, nack_cb)
+            # connection is bound: delivery tag is valid only on the channel it was delivered on
+            nack_cb = call_once(functools.partial(self._nack, self.rmq_connection, delivery_tag))
+        # body is decoded once, raw message is not retained by task
+        rmq_task = Task(
+            MessageEnvelope.from_consumed_data(message), ack_cb, nack_cb, timeout=self.task_timeout
+        )
         self.__spider.processing_tasks.add_task(rmq_task)
         # logger.debug(message["body"])
         # logger.critical(message)
@@ -457,18 +592,13 @@ class RPCTaskConsumer(object):
         if callable(spider_next_request):
             prepared_request = self.__spider.next_request(delivery_tag, message.get("body"))
             if isinstance(prepared_request, scrapy.Request):
-                prepared_request_meta = deepcopy(prepared_request.meta)
-                should_replace_meta = False
-                if self.delivery_tag_meta_key not in prepared_request_meta.keys():
-                    prepared_request_meta[self.delivery_tag_meta_key] = delivery_tag
-                    should_replace_meta = True
-                if self.msg_body_meta_key not in prepared_request_meta.keys():
-                    prepared_request_meta[self.msg_body_meta_key] = json.loads(message.get("body"))
-                    should_replace_meta = True
-                if should_replace_meta:
-                    prepared_request = prepared_request.replace(meta=prepared_request_meta)
+                # request is built for this message only, so its meta is updated in place
+                prepared_request.meta.setdefault(self.delivery_tag_meta_key, delivery_tag)
+                # meta gets own copy: spider may mutate it, task payload is sent back in reply
+                if self.msg_body_meta_key not in prepared_request.meta:
+                    prepared_request.meta[self.msg_body_meta_key] = json.loads(message.get("body"))
                 if prepared_request.dont_filter is False:
-                    prepared_request = prepared_request.replace(dont_filter=True)
+                    prepared_request.dont_filter = True
             self.crawler.engine.crawl(prepared_request)
 
     def on_message_consumed(self, message):
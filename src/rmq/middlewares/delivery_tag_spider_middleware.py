@@ -4,14 +4,22 @@ from rmq.utils import RMQConstants
 
 class DeliveryTagSpiderMiddleware:
     def process_spider_output(self, response, result, spider):
-        delivery_tag_key = RMQConstants.DELIVERY_TAG_META_KEY.value
         for result_item in result:
-            if isinstance(result_item, RMQItem):
-                response_delivery_tag = response.meta.get(delivery_tag_key, None)
-                if response_delivery_tag is not None and (
-                    delivery_tag_key not in result_item.keys()
-                    or result_item[delivery_tag_key] is None
-                    or result_item[delivery_tag_key] == ""
-                ):
-                    result_item[delivery_tag_key] = response_delivery_tag
-            yield result_item
+            yield self._process_result_item(response, result_item)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for result_item in result:
+            yield self._process_result_item(response, result_item)
+
+    @staticmethod
+    def _process_result_item(response, result_item):
+        delivery_tag_key = RMQConstants.DELIVERY_TAG_META_KEY.value
+        if isinstance(result_item, RMQItem):
+            response_delivery_tag = response.meta.get(delivery_tag_key, None)
+            if response_delivery_tag is not None and (
+                delivery_tag_key not in result_item.keys()
+                or result_item[delivery_tag_key] is None
+                or result_item[delivery_tag_key] == ""
+            ):
+                result_item[delivery_tag_key] = response_delivery_tag
+        return result_item
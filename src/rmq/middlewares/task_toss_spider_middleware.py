@@ -5,11 +5,19 @@ from rmq.utils import RMQConstants
 
 class TaskTossSpiderMiddleware:
     def process_spider_output(self, response, result, spider):
-        delivery_tag_key = RMQConstants.DELIVERY_TAG_META_KEY.value
         for result_item in result:
-            if isinstance(result_item, Request):
-                response_delivery_tag = response.meta.get(delivery_tag_key, None)
-                request_delivery_tag = result_item.meta.get(delivery_tag_key, None)
-                if response_delivery_tag is not None and request_delivery_tag is None:
-                    result_item.meta[delivery_tag_key] = response_delivery_tag
-            yield result_item
+            yield self._process_result_item(response, result_item)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for result_item in result:
+            yield self._process_result_item(response, result_item)
+
+    @staticmethod
+    def _process_result_item(response, result_item):
+        delivery_tag_key = RMQConstants.DELIVERY_TAG_META_KEY.value
+        if isinstance(result_item, Request):
+            response_delivery_tag = response.meta.get(delivery_tag_key, None)
+            request_delivery_tag = result_item.meta.get(delivery_tag_key, None)
+            if response_delivery_tag is not None and request_delivery_tag is None:
+                result_item.meta[delivery_tag_key] = response_delivery_tag
+        return result_item
@@ -1,16 +1,20 @@
 import functools
 import json
 import logging
+import time
+from collections import deque
 
 import pika
 from scrapy import signals
 from scrapy.crawler import Crawler
 from scrapy.exceptions import CloseSpider, DontCloseSpider
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
 
-from rmq.connections import PikaSelectConnection
+from rmq.connections import get_connection_class
 from rmq.items import RMQItem
-from rmq.utils import RMQConstants, RMQDefaultOptions
+from rmq.utils import (ItemBatcher, RMQConstants, RMQDefaultOptions, SpillingBuffer,
+                       pause_crawl, unpause_crawl)
+from rmq.utils.item_batch import batch_item_count, split_batch
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +26,16 @@ class ItemProducerPipeline:
     """
 
     _DEFAULT_HEARTBEAT = 300
+    _DEFAULT_BUFFER_MEMORY_LIMIT = 10000  # messages
+    _DEFAULT_BUFFER_SPILL_LIMIT = 1024 ** 3  # bytes
+    _DRAIN_BATCH_SIZE = 500
+    _BUFFER_WAITERS_CHECK_DELAY = 1  # seconds
+    _DEFAULT_BATCH_BYTES = 1024 ** 2
+    _DEFAULT_BATCH_LINGER = 0.2  # seconds
+    _DEFAULT_PUBLISH_WINDOW = 1000  # unconfirmed messages
+    _DEFAULT_PUBLISH_CONFIRM_TIMEOUT = 30  # seconds
+    _PUBLISH_RETRY_DELAY = 1  # seconds
+    _CLOSE_CHECK_DELAY = 0.1  # seconds
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -39,10 +53,54 @@ class ItemProducerPipeline:
         self.delivery_tag_meta_key = RMQConstants.DELIVERY_TAG_META_KEY.value
         self.msg_body_meta_key = RMQConstants.MSG_BODY_META_KEY.value
 
+        self.connection_class = get_connection_class(crawler.settings)
         self.rmq_connection = None
         self._can_interact = False
+        self._is_blocked = False
 
-        self.pending_items_buffer = []
+        """Serialized messages waiting for interactable connection (memory bounded, spilled to disk)"""
+        self.pending_items_buffer = SpillingBuffer(
+            memory_limit=crawler.settings.getint(
+                "RABBITMQ_ITEM_BUFFER_MEMORY_LIMIT", self._DEFAULT_BUFFER_MEMORY_LIMIT
+            ),
+            spill_limit_bytes=crawler.settings.getint(
+                "RABBITMQ_ITEM_BUFFER_SPILL_LIMIT", self._DEFAULT_BUFFER_SPILL_LIMIT
+            ),
+            spill_dir=crawler.settings.get("RABBITMQ_ITEM_BUFFER_SPILL_DIR") or None,
+        )
+        # (deferred, item, message) of items waiting for buffer space (backpressure)
+        self._buffer_waiters = deque()
+        self._buffer_waiters_check = None
+        self._draining = False
+
+        """Opt-in packing of several items into one message (see rmq.utils.item_batch)"""
+        self.item_batcher = None
+        batch_size = crawler.settings.getint("RABBITMQ_ITEM_BATCH_SIZE", 0)
+        if batch_size > 1:
+            self.item_batcher = ItemBatcher(
+                self._publish_batch,
+                max_count=batch_size,
+                max_bytes=crawler.settings.getint(
+                    "RABBITMQ_ITEM_BATCH_BYTES", self._DEFAULT_BATCH_BYTES
+                ),
+                linger=crawler.settings.getfloat(
+                    "RABBITMQ_ITEM_BATCH_LINGER", self._DEFAULT_BATCH_LINGER
+                ),
+                can_publish=self._can_publish,
+            )
+
+        """Broker confirms: nacked and unconfirmed (on connection loss) messages are requeued to buffer"""
+        self._confirms_enabled = crawler.settings.getbool("RABBITMQ_PUBLISH_CONFIRMS_ENABLED", True)
+        self._publish_window = crawler.settings.getint(
+            "RABBITMQ_PUBLISH_WINDOW", self._DEFAULT_PUBLISH_WINDOW
+        )
+        self._publish_confirm_timeout = crawler.settings.getfloat(
+            "RABBITMQ_PUBLISH_CONFIRM_TIMEOUT", self._DEFAULT_PUBLISH_CONFIRM_TIMEOUT
+        )
+        self._reconnect_on_close = crawler.settings.getbool("RABBITMQ_PUBLISHER_RECONNECT", True)
+        self._in_flight = 0  # published and not yet confirmed messages
+        self._in_flight_items = 0  # items packed into these messages
+        self._publish_retry = None
 
     def spider_opened(self, spider):
         """Check spider for correct declared callbacks/errbacks/methods/variables"""
@@ -58,7 +116,7 @@ class ItemProducerPipeline:
         """Declare/retrieve queue name from spider instance"""
         result_queue_name = spider.result_queue_name
 
-        """Build pika connection parameters and start connection in separate twisted thread"""
+        """Build pika connection parameters and start connection (in separate twisted thread for select backend)"""
         parameters = pika.ConnectionParameters(
             host=self.spider.settings.get("RABBITMQ_HOST"),
             port=int(self.spider.settings.get("RABBITMQ_PORT")),
@@ -69,20 +127,53 @@ class ItemProducerPipeline:
             ),
             heartbeat=RMQDefaultOptions.CONNECTION_HEARTBEAT.value,
         )
-        reactor.callInThread(self.connect, parameters, result_queue_name)
+        self.connection_class.dispatch(self.connect, parameters, result_queue_name)
 
     def spider_idle(self, spider):
-        if len(self.pending_items_buffer):
+        if self._has_unpublished_items():
             raise DontCloseSpider
 
     def spider_closed(self, spider):
+        """Waits (up to RABBITMQ_PUBLISH_CONFIRM_TIMEOUT) for buffered items to be published
+        and confirmed before closing connection
+        """
+        d = defer.Deferred()
+        self._wait_for_publishing(d, time.monotonic() + self._publish_confirm_timeout)
+        return d
+
+    def _has_unpublished_items(self):
+        if len(self.pending_items_buffer) or len(self._buffer_waiters) or self._in_flight:
+            return True
+        return self.item_batcher is not None and len(self.item_batcher) > 0
+
+    def _wait_for_publishing(self, d, deadline):
+        if self._can_publish():
+            self._flush_pending_items(batch_size=None)
+            if self.item_batcher is not None:
+                self.item_batcher.flush()
+        if (
+            self.rmq_connection is None
+            or not self._has_unpublished_items()
+            or time.monotonic() >= deadline
+        ):
+            self._stop_connection()
+            d.callback(None)
+            return
+        reactor.callLater(self._CLOSE_CHECK_DELAY, self._wait_for_publishing, d, deadline)
+
+    def _stop_connection(self):
+        if self._publish_retry is not None and self._publish_retry.active():
+            self._publish_retry.cancel()
+        lost_count = len(self.pending_items_buffer) + len(self._buffer_waiters)
+        lost_count += self._in_flight_items
+        if self.item_batcher is not None:
+            lost_count += len(self.item_batcher)
+        if lost_count:
+            logger.error(f"{lost_count} items were not published/confirmed before spider close")
+            self.crawler.stats.set_value("rmq/items_lost", lost_count)
         if self.rmq_connection is not None:
-            while len(self.pending_items_buffer) and self._can_interact:
-                self.send_message(self.pending_items_buffer.pop(0))
-            if isinstance(self.rmq_connection.connection, pika.SelectConnection):
-                self.rmq_connection.connection.ioloop.add_callback_threadsafe(
-                    self.rmq_connection.stop
-                )
+            self.rmq_connection.add_callback_threadsafe(self.rmq_connection.stop)
+        self.pending_items_buffer.close()
 
     def _validate_spider_has_attributes(self):
         spider_attributes = [
@@ -103,6 +194,139 @@ class ItemProducerPipeline:
 
     def set_can_interact(self, can_interact):
         self._can_interact = can_interact
+        if self._can_publish():
+            self._flush_pending_items()
+
+    def set_is_blocked(self, is_blocked):
+        """Buffer items and pause crawl while broker blocks connection (memory/disk alarm)"""
+        self._is_blocked = is_blocked
+        if is_blocked:
+            logger.warning("RabbitMQ connection is blocked. Buffering items and pausing crawl")
+            self.crawler.stats.inc_value("rmq/connection_blocked_count")
+            pause_crawl(self.crawler, self)
+        else:
+            logger.info("RabbitMQ connection is unblocked. Resuming crawl")
+            unpause_crawl(self.crawler, self)
+            if self._can_publish():
+                self._flush_pending_items()
+
+    def _can_publish(self):
+        if not self._can_interact or self._is_blocked or self.rmq_connection is None:
+            return False
+        if self._confirms_enabled and self._publish_window > 0:
+            return self._in_flight < self._publish_window
+        return True
+
+    def on_publish_confirmed(self, payloads):
+        """Invoked by connection with (message, queue_name, properties) of acked messages"""
+        confirmed_items = 0
+        for _message, _queue_name, properties in payloads:
+            confirmed_items += batch_item_count(properties)
+        self._release_in_flight(len(payloads), confirmed_items)
+        self.crawler.stats.inc_value("rmq/items_confirmed", confirmed_items)
+        if self._can_publish():
+            self._flush_pending_items()
+
+    def on_publish_returned(self, payloads):
+        """Invoked by connection with (message, queue_name, properties) of nacked messages
+        and of messages which were not confirmed before channel/connection close.
+        Messages are put back to buffer head and republished after delay
+        """
+        messages = []
+        for message, _queue_name, properties in payloads:
+            messages.extend(split_batch(message, properties))
+        if self._confirms_enabled:
+            self._release_in_flight(len(payloads), len(messages))
+        self.pending_items_buffer.requeue(messages)
+        self.crawler.stats.inc_value("rmq/items_requeued", len(messages))
+        self._update_buffer_stats()
+        if self._publish_retry is None or not self._publish_retry.active():
+            self._publish_retry = reactor.callLater(
+                self._PUBLISH_RETRY_DELAY, self._retry_publishing
+            )
+
+    def _retry_publishing(self):
+        if self._can_publish():
+            self._flush_pending_items()
+
+    def _release_in_flight(self, messages_count, items_count):
+        self._in_flight = max(0, self._in_flight - messages_count)
+        self._in_flight_items = max(0, self._in_flight_items - items_count)
+
+    def _update_buffer_stats(self):
+        self.crawler.stats.set_value("rmq/item_buffer/depth", len(self.pending_items_buffer))
+        self.crawler.stats.set_value(
+            "rmq/item_buffer/spilled_bytes", self.pending_items_buffer.spilled_bytes
+        )
+
+    def _buffer_message(self, item, message):
+        """Buffers message. Returns deferred (fired with item when buffer has space) if buffer is full"""
+        if self._buffer_waiters or not self.pending_items_buffer.append(message):
+            d = defer.Deferred()
+            self._buffer_waiters.append((d, item, message))
+            self.crawler.stats.inc_value("rmq/item_buffer/backpressure_count")
+            self._update_buffer_stats()
+            if self._buffer_waiters_check is None or not self._buffer_waiters_check.active():
+                self._buffer_waiters_check = reactor.callLater(
+                    self._BUFFER_WAITERS_CHECK_DELAY, self._check_buffer_waiters
+                )
+            return d
+        self._update_buffer_stats()
+        return item
+
+    def _release_buffer_waiters(self):
+        while self._buffer_waiters:
+            d, item, message = self._buffer_waiters[0]
+            if not self.pending_items_buffer.append(message):
+                break
+            self._buffer_waiters.popleft()
+            d.callback(item)
+
+    def _check_buffer_waiters(self):
+        """Scraper waits for pipeline deferreds before spider_closed is sent, so waiters are dropped
+        when engine is closing and buffer is still full (e.g. broker is unavailable)
+        """
+        self._release_buffer_waiters()
+        if not self._buffer_waiters:
+            return
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None or engine.slot.closing:
+            dropped_count = len(self._buffer_waiters)
+            logger.error(f"Buffer is full on spider close, {dropped_count} items are dropped")
+            self.crawler.stats.inc_value("rmq/item_buffer/dropped_count", dropped_count)
+            while self._buffer_waiters:
+                d, item, _message = self._buffer_waiters.popleft()
+                d.callback(item)
+            return
+        self._buffer_waiters_check = reactor.callLater(
+            self._BUFFER_WAITERS_CHECK_DELAY, self._check_buffer_waiters
+        )
+
+    def _flush_pending_items(self, batch_size=_DRAIN_BATCH_SIZE):
+        """Publishes buffered messages in order. Drains in batches (reactor is not blocked on long
+        outage backlog) unless batch_size is None
+        """
+        if self._draining and batch_size is not None:
+            return
+        self._draining = True
+        published = 0
+        while len(self.pending_items_buffer) and self._can_publish():
+            if batch_size is not None and published >= batch_size:
+                break
+            self._publish(self.pending_items_buffer.popleft())
+            published += 1
+            if not len(self.pending_items_buffer):
+                self._release_buffer_waiters()
+        self._release_buffer_waiters()
+        self._update_buffer_stats()
+        if len(self.pending_items_buffer) and self._can_publish() and batch_size is not None:
+            reactor.callLater(0, self._continue_flush)
+        else:
+            self._draining = False
+
+    def _continue_flush(self):
+        self._draining = False
+        self._flush_pending_items()
 
     def raise_close_spider(self):
         if self.crawler.engine.slot is None or self.crawler.engine.slot.closing:
@@ -111,37 +335,59 @@ class ItemProducerPipeline:
         self.crawler.engine.close_spider(self.spider)
 
     def connect(self, parameters, queue_name):
-        """Creates and runs pika select connection"""
-        c = PikaSelectConnection(
+        """Creates and runs pika connection of configured backend"""
+        c = self.connection_class(
             parameters,
             queue_name,
             owner=self,
             options={
-                "enable_delivery_confirmations": False,
+                "enable_delivery_confirmations": self._confirms_enabled,
+                "reconnect_on_close": self._reconnect_on_close,
                 "prefetch_count": self.spider.settings.get("CONCURRENT_REQUESTS", 1),
             },
             is_consumer=False,
         )
         c.run()
 
+    def serialize_item(self, item):
+        item_as_dictionary = dict(item)
+        if self.delivery_tag_meta_key in item_as_dictionary:
+            del item_as_dictionary[self.delivery_tag_meta_key]
+        return json.dumps(item_as_dictionary)
+
+    def _publish(self, message):
+        if self.item_batcher is not None:
+            self.item_batcher.add(message)
+            return
+        if self._confirms_enabled:
+            self._in_flight += 1
+            self._in_flight_items += 1
+        cb = functools.partial(self.rmq_connection.publish_message, message=message)
+        self.rmq_connection.add_callback_threadsafe(cb)
+
+    def _publish_batch(self, body, properties):
+        self.crawler.stats.inc_value("rmq/item_batches_count")
+        if self._confirms_enabled:
+            self._in_flight += 1
+            self._in_flight_items += batch_item_count(properties)
+        cb = functools.partial(
+            self.rmq_connection.publish_message, message=body, properties=properties
+        )
+        self.rmq_connection.add_callback_threadsafe(cb)
+
     def send_message(self, item):
         """Sends message to rabbitmq"""
-        if isinstance(self.rmq_connection.connection, pika.SelectConnection):
-            item_as_dictionary = dict(item)
-            if self.delivery_tag_meta_key in item_as_dictionary:
-                del item_as_dictionary[self.delivery_tag_meta_key]
-            cb = functools.partial(
-                self.rmq_connection.publish_message, message=json.dumps(item_as_dictionary)
-            )
-            self.rmq_connection.connection.ioloop.add_callback_threadsafe(cb)
+        self._publish(self.serialize_item(item))
 
     def process_item(self, item, spider):
         """Invoked when item is processed"""
         if isinstance(item, RMQItem):
-            if self._can_interact:
-                while len(self.pending_items_buffer):
-                    self.send_message(self.pending_items_buffer.pop(0))
-                self.send_message(item)
+            message = self.serialize_item(item)
+            if self._can_publish() and not len(self.pending_items_buffer):
+                self._publish(message)
             else:
-                self.pending_items_buffer.append(item)
+                result = self._buffer_message(item, message)
+                if self._can_publish():
+                    self._flush_pending_items()
+                return result
         return item
@@ -1,7 +1,14 @@
+from .ack_coalescer import AckCoalescer
 from .constants import RMQConstants
 from .extract_delivery_tag_from_failure import extract_delivery_tag_from_failure
+from .flow_control import pause_crawl, unpause_crawl
 from .import_full_name import get_import_full_name
+from .item_batch import ItemBatcher, unpack_message
+from .message_envelope import MessageEnvelope
+from .prefetch_controller import PrefetchController
 from .rmq_default_options import RMQDefaultOptions
+from .spilling_buffer import SpillingBuffer
 from .task import Task
+from .task_accounting import TaskAccountant, set_task_accountant
 from .task_observer import TaskObserver
 from .task_status_codes import TaskStatusCodes
@@ -0,0 +1,92 @@
+from collections import deque
+from typing import Callable, List, Tuple
+
+AckFrame = Tuple[int, bool]
+
+
+class AckCoalescer:
+    """Coalesces acknowledgements of consumed messages into basic_ack(multiple=True) frames.
+
+    Broker assigns delivery tags in increasing order per channel. Coalescer keeps outstanding
+    tags in delivery order and acknowledges the largest contiguous prefix of completed tags with
+    a single frame. Completed tags behind a still processing message are acknowledged
+    individually on the periodic (full) flush, so they do not hold prefetch slots for long.
+
+    Delivery tags restart when channel is reopened, so every tag is bound to the generation
+    it was registered in and stale completions from previous channel are ignored.
+
+    All methods must be called from the reactor thread.
+    """
+
+    def __init__(self, send_acks: Callable[[List[AckFrame]], None], threshold: int = 1):
+        # callable which receives list of (delivery_tag, multiple) frames to send
+        self._send_acks = send_acks
+        # completed tags count which triggers prefix flush without waiting for periodic one
+        self.threshold = max(1, threshold)
+        self.generation = 0
+
+        # registered tags in delivery order, may contain already resolved tags
+        self._outstanding = deque()
+        # registered tags which are not acked or nacked yet
+        self._tracked = set()
+        self._completed = set()
+
+    def register(self, delivery_tag: int) -> int:
+        """Starts tracking of delivered tag and returns generation it belongs to"""
+        self._outstanding.append(delivery_tag)
+        self._tracked.add(delivery_tag)
+        return self.generation
+
+    def complete(self, delivery_tag: int, generation: int) -> None:
+        if generation != self.generation or delivery_tag not in self._tracked:
+            return
+        self._completed.add(delivery_tag)
+        if len(self._completed) >= self.threshold:
+            self.flush(include_out_of_order=False)
+
+    def discard(self, delivery_tag: int, generation: int) -> bool:
+        """Stops tracking of tag which is resolved without ack (nacked).
+        Completed tags delivered before it are acked first, so caller's nack follows their acks.
+        Returns False if tag is unknown or belongs to previous channel
+        """
+        if generation != self.generation or delivery_tag not in self._tracked:
+            return False
+        # prefix ends before discarded tag: it is still tracked and not completed
+        self.flush(include_out_of_order=False)
+        self._tracked.remove(delivery_tag)
+        self._completed.discard(delivery_tag)
+        return True
+
+    def flush(self, include_out_of_order: bool = True) -> None:
+        frames: List[AckFrame] = []
+        last_completed = None
+        while self._outstanding:
+            delivery_tag = self._outstanding[0]
+            if delivery_tag in self._completed:
+                self._completed.remove(delivery_tag)
+                self._tracked.remove(delivery_tag)
+                last_completed = delivery_tag
+            elif delivery_tag in self._tracked:
+                break
+            self._outstanding.popleft()
+        if last_completed is not None:
+            frames.append((last_completed, True))
+
+        if include_out_of_order and self._completed:
+            for delivery_tag in sorted(self._completed):
+                frames.append((delivery_tag, False))
+                self._tracked.remove(delivery_tag)
+            self._completed.clear()
+
+        if frames:
+            self._send_acks(frames)
+
+    def reset(self) -> None:
+        """Drops all tracked tags. Must be called when channel is reopened"""
+        self.generation += 1
+        self._outstanding.clear()
+        self._tracked.clear()
+        self._completed.clear()
+
+    def pending_count(self) -> int:
+        return len(self._completed)
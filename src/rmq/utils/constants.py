@@ -4,3 +4,4 @@ from enum import Enum
 class RMQConstants(Enum):
     DELIVERY_TAG_META_KEY = "delivery_tag"
     MSG_BODY_META_KEY = "msg_body"
+    TASK_TIMEOUT_HEADER = "x-task-timeout"
@@ -0,0 +1,91 @@
+import inspect
+from typing import Any, Callable, Dict, Optional
+
+import scrapy
+
+from rmq.utils.task_accounting import send_accounting_event
+
+# item -> item_scheduled event kwargs (None - item is not accounted)
+ItemEventKwargs = Callable[[Any], Optional[Dict]]
+
+
+def _account_item(spider, item, item_event_kwargs: ItemEventKwargs, item_signal):
+    if isinstance(item, scrapy.Item):
+        event_kwargs = item_event_kwargs(item)
+        if event_kwargs is not None:
+            send_accounting_event(spider, item_signal, **event_kwargs)
+
+
+async def account_async_generator(
+    spider,
+    result,
+    item_event_kwargs: ItemEventKwargs,
+    item_signal,
+    completion_signal,
+    completion_kwargs: Optional[Dict],
+):
+    """Re-yields async generator results, accounting items and completion like sync decorators do"""
+    async for result_item in result:
+        _account_item(spider, result_item, item_event_kwargs, item_signal)
+        yield result_item
+    if completion_kwargs is not None:
+        send_accounting_event(spider, completion_signal, **completion_kwargs)
+
+
+def account_iterable(
+    spider,
+    result,
+    item_event_kwargs: ItemEventKwargs,
+    item_signal,
+    completion_signal,
+    completion_kwargs: Optional[Dict],
+):
+    """Accounts awaited coroutine result (iterable or None) and returns it as list"""
+    output = []
+    if result is not None and not isinstance(result, (dict, scrapy.Item, scrapy.Request)):
+        for result_item in result:
+            _account_item(spider, result_item, item_event_kwargs, item_signal)
+            output.append(result_item)
+    elif result is not None:
+        _account_item(spider, result, item_event_kwargs, item_signal)
+        output.append(result)
+    if completion_kwargs is not None:
+        send_accounting_event(spider, completion_signal, **completion_kwargs)
+    return output
+
+
+def wrap_async(method, build_context, item_signal, completion_signal):
+    """Builds wrapper for `async def` callback/errback (coroutine or async generator).
+
+    build_context(self, args) returns (item_event_kwargs, completion_kwargs) or None if
+    result must be passed through without accounting. completion_kwargs None - completion
+    event is not sent
+    """
+    if inspect.isasyncgenfunction(method):
+
+        async def async_generator_wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            context = build_context(self, args)
+            if context is None:
+                async for result_item in result:
+                    yield result_item
+                return
+            item_event_kwargs, completion_kwargs = context
+            async for result_item in account_async_generator(
+                self, result, item_event_kwargs, item_signal, completion_signal, completion_kwargs
+            ):
+                yield result_item
+
+        return async_generator_wrapper
+
+    async def coroutine_wrapper(self, *args, **kwargs):
+        result = await method(self, *args, **kwargs)
+        context = build_context(self, args)
+        if context is None:
+            return result
+        item_event_kwargs, completion_kwargs = context
+        return account_iterable(
+            self, result, item_event_kwargs, item_signal, completion_signal, completion_kwargs
+        )
+
+    return coroutine_wrapper
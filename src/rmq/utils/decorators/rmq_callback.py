@@ -5,9 +5,36 @@ import scrapy
 
 from rmq.signals import callback_completed, item_scheduled
 from rmq.utils import RMQConstants
+from rmq.utils.decorators.async_accounting import wrap_async
+from rmq.utils.task_accounting import send_accounting_event
+
+
+def _build_accounting_context(self, args):
+    """Accounting of async callback results, same as for sync generator callbacks"""
+    if not isinstance(self, scrapy.Spider):
+        return None
+    if len(args) > 0:
+        response = args[0]
+        if not isinstance(response, scrapy.http.Response):
+            return None
+        delivery_tag = response.meta.get(RMQConstants.DELIVERY_TAG_META_KEY.value, None)
+        event_kwargs = {"response": response, "spider": self, "delivery_tag": delivery_tag}
+        return lambda _item: event_kwargs, event_kwargs
+    return lambda _item: {"spider": self}, {"spider": self}
 
 
 def rmq_callback(callback_method):
+    if inspect.iscoroutinefunction(callback_method) or inspect.isasyncgenfunction(
+        callback_method
+    ):
+        wrapper = functools.wraps(callback_method)(
+            wrap_async(
+                callback_method, _build_accounting_context, item_scheduled, callback_completed
+            )
+        )
+        wrapper.__decorator_name__ = inspect.currentframe().f_code.co_name
+        return wrapper
+
     @functools.wraps(callback_method)
     def wrapper(self, *args, **kwargs):
         delivery_tag_meta_key = RMQConstants.DELIVERY_TAG_META_KEY.value
@@ -21,8 +48,9 @@ def rmq_callback(callback_method):
                         iter(callback_result)
                         for callback_result_item in callback_result:
                             if isinstance(callback_result_item, scrapy.Item):
-                                self.crawler.signals.send_catch_log(
-                                    signal=item_scheduled,
+                                send_accounting_event(
+                                    self,
+                                    item_scheduled,
                                     response=response,
                                     spider=self,
                                     delivery_tag=delivery_tag,
@@ -30,8 +58,9 @@ def rmq_callback(callback_method):
                             yield callback_result_item
                     except TypeError:
                         pass
-                    self.crawler.signals.send_catch_log(
-                        signal=callback_completed,
+                    send_accounting_event(
+                        self,
+                        callback_completed,
                         response=response,
                         spider=self,
                         delivery_tag=delivery_tag,
@@ -41,11 +70,11 @@ def rmq_callback(callback_method):
                     iter(callback_result)
                     for callback_result_item in callback_result:
                         if isinstance(callback_result_item, scrapy.Item):
-                            self.crawler.signals.send_catch_log(signal=item_scheduled, spider=self)
+                            send_accounting_event(self, item_scheduled, spider=self)
                         yield callback_result_item
                 except TypeError:
                     pass
-                self.crawler.signals.send_catch_log(signal=callback_completed, spider=self)
+                send_accounting_event(self, callback_completed, spider=self)
         else:
             try:
                 iter(callback_result)
@@ -6,9 +6,62 @@ from twisted.python.failure import Failure
 
 from rmq.signals import errback_completed, item_scheduled
 from rmq.utils import RMQConstants
+from rmq.utils.decorators.async_accounting import wrap_async
+from rmq.utils.task_accounting import send_accounting_event
+
+
+def _build_accounting_context(self, args):
+    """Accounting of async errback results, same as for sync generator errbacks"""
+    delivery_tag_meta_key = RMQConstants.DELIVERY_TAG_META_KEY.value
+
+    def item_delivery_tag_kwargs(item):
+        if delivery_tag_meta_key in item.keys():
+            return {
+                "response": None,
+                "spider": self,
+                "delivery_tag": item[delivery_tag_meta_key],
+            }
+        return None
+
+    if not isinstance(self, scrapy.Spider):
+        return item_delivery_tag_kwargs, None
+    if len(args) == 0:
+        return item_delivery_tag_kwargs, {}
+    response_or_failure = args[0]
+    if isinstance(response_or_failure, scrapy.http.Response):
+        delivery_tag = response_or_failure.meta.get(delivery_tag_meta_key, None)
+        event_kwargs = {
+            "response": response_or_failure,
+            "spider": self,
+            "delivery_tag": delivery_tag,
+        }
+        return lambda _item: event_kwargs, event_kwargs
+    if isinstance(response_or_failure, Failure) and hasattr(response_or_failure, "request"):
+        delivery_tag = response_or_failure.request.meta.get(delivery_tag_meta_key, None)
+        item_kwargs = {
+            "response": response_or_failure,
+            "spider": self,
+            "delivery_tag": delivery_tag,
+        }
+        completion_kwargs = {
+            "failure": response_or_failure,
+            "spider": self,
+            "delivery_tag": delivery_tag,
+        }
+        return lambda _item: item_kwargs, completion_kwargs
+    return None
 
 
 def rmq_errback(errback_method):
+    if inspect.iscoroutinefunction(errback_method) or inspect.isasyncgenfunction(errback_method):
+        wrapper = functools.wraps(errback_method)(
+            wrap_async(
+                errback_method, _build_accounting_context, item_scheduled, errback_completed
+            )
+        )
+        wrapper.__decorator_name__ = inspect.currentframe().f_code.co_name
+        return wrapper
+
     @functools.wraps(errback_method)
     def wrapper(self, *args, **kwargs):
         delivery_tag_meta_key = RMQConstants.DELIVERY_TAG_META_KEY.value
@@ -22,8 +75,9 @@ def rmq_errback(errback_method):
                         iter(errback_result)
                         for errback_result_item in errback_result:
                             if isinstance(errback_result_item, scrapy.Item):
-                                self.crawler.signals.send_catch_log(
-                                    signal=item_scheduled,
+                                send_accounting_event(
+                                    self,
+                                    item_scheduled,
                                     response=response_or_failure,
                                     spider=self,
                                     delivery_tag=delivery_tag,
@@ -31,8 +85,9 @@ def rmq_errback(errback_method):
                             yield errback_result_item
                     except TypeError:
                         pass
-                    self.crawler.signals.send_catch_log(
-                        signal=errback_completed,
+                    send_accounting_event(
+                        self,
+                        errback_completed,
                         response=response_or_failure,
                         spider=self,
                         delivery_tag=delivery_tag,
@@ -46,8 +101,9 @@ def rmq_errback(errback_method):
                             iter(errback_result)
                             for errback_result_item in errback_result:
                                 if isinstance(errback_result_item, scrapy.Item):
-                                    self.crawler.signals.send_catch_log(
-                                        signal=item_scheduled,
+                                    send_accounting_event(
+                                        self,
+                                        item_scheduled,
                                         response=response_or_failure,
                                         spider=self,
                                         delivery_tag=delivery_tag,
@@ -55,8 +111,9 @@ def rmq_errback(errback_method):
                                 yield errback_result_item
                         except TypeError:
                             pass
-                        self.crawler.signals.send_catch_log(
-                            signal=errback_completed,
+                        send_accounting_event(
+                            self,
+                            errback_completed,
                             failure=response_or_failure,
                             spider=self,
                             delivery_tag=delivery_tag,
@@ -69,15 +126,16 @@ def rmq_errback(errback_method):
                             isinstance(errback_result_item, scrapy.Item)
                             and delivery_tag_meta_key in errback_result_item.keys()
                         ):
-                            self.crawler.signals.send_catch_log(
-                                signal=item_scheduled,
+                            send_accounting_event(
+                                self,
+                                item_scheduled,
                                 response=None,
                                 spider=self,
                                 delivery_tag=errback_result_item[delivery_tag_meta_key],
                             )
                 except TypeError:
                     pass
-                self.crawler.signals.send_catch_log(signal=errback_completed)
+                send_accounting_event(self, errback_completed)
         else:
             try:
                 iter(errback_result)
@@ -86,8 +144,9 @@ def rmq_errback(errback_method):
                         isinstance(errback_result_item, scrapy.Item)
                         and delivery_tag_meta_key in errback_result_item.keys()
                     ):
-                        self.crawler.signals.send_catch_log(
-                            signal=item_scheduled,
+                        send_accounting_event(
+                            self,
+                            item_scheduled,
                             response=None,
                             spider=self,
                             delivery_tag=errback_result_item[delivery_tag_meta_key],
@@ -0,0 +1,28 @@
+from weakref import WeakKeyDictionary
+
+from scrapy.crawler import Crawler
+
+# crawler -> ids of owners which requested crawl pause
+_pause_requests: "WeakKeyDictionary[Crawler, set]" = WeakKeyDictionary()
+
+
+def pause_crawl(crawler: Crawler, owner) -> None:
+    """Pauses crawler engine on behalf of owner (e.g. when broker blocks its connection).
+
+    Several owners (consumer extension, item pipeline) could be blocked at the same time,
+    engine is unpaused only when all of them released their pause requests.
+    """
+    owners = _pause_requests.setdefault(crawler, set())
+    if not owners and crawler.engine is not None:
+        crawler.engine.pause()
+    owners.add(id(owner))
+
+
+def unpause_crawl(crawler: Crawler, owner) -> None:
+    """Releases owner pause request and unpauses crawler engine if there are no other requests"""
+    owners = _pause_requests.get(crawler)
+    if not owners or id(owner) not in owners:
+        return
+    owners.discard(id(owner))
+    if not owners and crawler.engine is not None:
+        crawler.engine.unpause()
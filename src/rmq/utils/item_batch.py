@@ -0,0 +1,117 @@
+import json
+from typing import Callable, List
+
+import pika
+from twisted.internet import reactor
+
+BATCH_COUNT_HEADER = "x-batch-count"
+BATCH_CODEC_HEADER = "x-batch-codec"
+# one json document per line. json.dumps output never contains raw newlines
+JSON_LINES_CODEC = "jsonl"
+
+
+def pack_messages(messages: List[str]) -> str:
+    return "\n".join(messages)
+
+
+def build_batch_properties(count: int) -> pika.BasicProperties:
+    return pika.BasicProperties(
+        content_type="application/x-ndjson",
+        delivery_mode=2,
+        headers={BATCH_COUNT_HEADER: count, BATCH_CODEC_HEADER: JSON_LINES_CODEC},
+    )
+
+
+def batch_item_count(properties) -> int:
+    """Returns number of items packed into published message"""
+    headers = getattr(properties, "headers", None) or {}
+    return int(headers.get(BATCH_COUNT_HEADER, 1))
+
+
+def split_batch(body, properties) -> List[str]:
+    """Returns serialized items of published message (batched or single)"""
+    headers = getattr(properties, "headers", None) or {}
+    if headers.get(BATCH_CODEC_HEADER) != JSON_LINES_CODEC:
+        return [body]
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    return [line for line in body.split("\n") if line]
+
+
+def unpack_message(body, properties=None) -> List:
+    """Returns list of decoded documents of consumed message (batched or single)"""
+    headers = getattr(properties, "headers", None) or {}
+    codec = headers.get(BATCH_CODEC_HEADER)
+    if codec is None:
+        return [json.loads(body)]
+    if codec != JSON_LINES_CODEC:
+        raise ValueError(f"Unsupported batch codec: {codec}")
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    documents = [json.loads(line) for line in body.split("\n") if line]
+    expected_count = headers.get(BATCH_COUNT_HEADER)
+    if expected_count is not None and int(expected_count) != len(documents):
+        raise ValueError(
+            f"Batch is corrupted: {len(documents)} documents, {expected_count} expected"
+        )
+    return documents
+
+
+class ItemBatcher:
+    """Packs serialized items into batch messages of up to max_count items or max_bytes bytes.
+
+    Batch is published when it is full or when linger time is passed since its first item.
+    publish(body, properties) is called from the reactor thread. If can_publish() is False on
+    linger timeout, batch is kept and linger is restarted.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str, pika.BasicProperties], None],
+        max_count: int,
+        max_bytes: int,
+        linger: float,
+        can_publish: Callable[[], bool] = lambda: True,
+    ):
+        self._publish = publish
+        self._can_publish = can_publish
+        self.max_count = max(1, max_count)
+        self.max_bytes = max(1, max_bytes)
+        self.linger = linger
+
+        self._messages = []
+        self._bytes = 0
+        self._linger_call = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, message: str):
+        # json.dumps escapes non-ascii by default, so string length is its size in bytes
+        size = len(message) + 1
+        if self._messages and self._bytes + size > self.max_bytes:
+            self.flush()
+        self._messages.append(message)
+        self._bytes += size
+        if len(self._messages) >= self.max_count or self._bytes >= self.max_bytes:
+            self.flush()
+        elif self._linger_call is None:
+            self._linger_call = reactor.callLater(self.linger, self._on_linger)
+
+    def _on_linger(self):
+        self._linger_call = None
+        if not self._messages:
+            return
+        if self._can_publish():
+            self.flush()
+        else:
+            self._linger_call = reactor.callLater(self.linger, self._on_linger)
+
+    def flush(self):
+        if self._linger_call is not None and self._linger_call.active():
+            self._linger_call.cancel()
+        self._linger_call = None
+        if not self._messages:
+            return
+        messages, self._messages, self._bytes = self._messages, [], 0
+        self._publish(pack_messages(messages), build_batch_properties(len(messages)))
@@ -0,0 +1,37 @@
+import json
+
+from rmq.exceptions import ConsumedDataCorrupted
+
+
+class MessageEnvelope:
+    """Lightweight view of consumed message.
+
+    Body is decoded once for task and reply builder (request meta gets its own copy).
+    Raw body bytes, channel and properties objects are not retained.
+    """
+
+    __slots__ = ("delivery_tag", "reply_to", "headers", "payload")
+
+    def __init__(self, delivery_tag, payload, reply_to=None, headers=None):
+        self.delivery_tag = delivery_tag
+        self.payload = payload
+        self.reply_to = reply_to
+        self.headers = headers or {}
+
+    @classmethod
+    def from_consumed_data(cls, consumed_data):
+        if not isinstance(consumed_data, dict):
+            raise ConsumedDataCorrupted("Consumed data is not a dict")
+        if consumed_data.get("method", None) is None:
+            raise ConsumedDataCorrupted('Consumed data has no "method" key')
+        if consumed_data.get("properties", None) is None:
+            raise ConsumedDataCorrupted('Consumed data has no "properties" key')
+        if consumed_data.get("body", None) is None:
+            raise ConsumedDataCorrupted('Consumed data has no "body" key')
+        properties = consumed_data.get("properties")
+        return cls(
+            delivery_tag=consumed_data.get("method").delivery_tag,
+            payload=json.loads(consumed_data.get("body")),
+            reply_to=properties.reply_to,
+            headers=getattr(properties, "headers", None),
+        )
@@ -0,0 +1,123 @@
+import functools
+import logging
+from typing import Callable, Optional
+
+from scrapy.crawler import Crawler
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchController:
+    """Adjusts consumer prefetch count (basic_qos) at runtime according to crawler engine load.
+
+    Prefetch count fixed to CONCURRENT_REQUESTS either floods scheduler (task fans out to many
+    requests) or leaves downloader idle (task produces single request). Controller periodically
+    compares pending requests (scheduler + downloader slot queues) and active downloads with
+    CONCURRENT_REQUESTS:
+    - pending backlog exceeds backlog factor * CONCURRENT_REQUESTS -> prefetch is halved;
+    - downloader is not saturated, backlog is low and all prefetched tasks are in flight
+      -> prefetch is increased by step;
+    prefetch count always stays within [min_prefetch, max_prefetch].
+    """
+
+    _DEFAULT_INTERVAL = 5  # seconds
+    _DEFAULT_BACKLOG_FACTOR = 2
+
+    def __init__(
+        self,
+        crawler: Crawler,
+        get_connection: Callable,
+        get_in_flight: Callable[[], int],
+        initial_prefetch: int,
+        min_prefetch: int = 1,
+        max_prefetch: Optional[int] = None,
+        interval: float = _DEFAULT_INTERVAL,
+        on_change: Optional[Callable[[int], None]] = None,
+    ):
+        self.crawler = crawler
+        # callables are used as connection could be recreated and in-flight counter lives in owner
+        self._get_connection = get_connection
+        self._get_in_flight = get_in_flight
+        self._on_change = on_change
+
+        self.concurrency = max(1, crawler.settings.getint("CONCURRENT_REQUESTS", 1))
+        self.min_prefetch = max(1, min_prefetch)
+        self.max_prefetch = max(self.min_prefetch, max_prefetch or 4 * self.concurrency)
+        self.step = max(1, self.concurrency // 4)
+        self.backlog_limit = self._DEFAULT_BACKLOG_FACTOR * self.concurrency
+        self.prefetch_count = min(max(initial_prefetch, self.min_prefetch), self.max_prefetch)
+
+        self.interval = interval
+        self._loop = None
+
+    @classmethod
+    def from_crawler(
+        cls,
+        crawler: Crawler,
+        get_connection: Callable,
+        get_in_flight: Callable[[], int],
+        on_change: Optional[Callable[[int], None]] = None,
+    ):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            get_connection,
+            get_in_flight,
+            initial_prefetch=settings.getint("CONCURRENT_REQUESTS", 1),
+            min_prefetch=settings.getint("RABBITMQ_PREFETCH_MIN", 1),
+            max_prefetch=settings.getint("RABBITMQ_PREFETCH_MAX", 0) or None,
+            interval=settings.getfloat("RABBITMQ_PREFETCH_ADJUST_INTERVAL", cls._DEFAULT_INTERVAL),
+            on_change=on_change,
+        )
+
+    def start(self):
+        if self._loop is None or not self._loop.running:
+            self._loop = task.LoopingCall(self.adjust)
+            self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+
+    def _pending_requests_count(self):
+        engine = self.crawler.engine
+        scheduled = len(engine.slot.scheduler) if hasattr(engine.slot.scheduler, "__len__") else 0
+        queued = sum(len(slot.queue) for slot in engine.downloader.slots.values())
+        return scheduled + queued
+
+    def compute_prefetch_count(self, pending, active, in_flight):
+        if pending > self.backlog_limit:
+            return max(self.min_prefetch, self.prefetch_count // 2)
+        if (
+            active < self.concurrency
+            and pending < self.concurrency
+            and in_flight >= self.prefetch_count
+        ):
+            return min(self.max_prefetch, self.prefetch_count + self.step)
+        return self.prefetch_count
+
+    def adjust(self):
+        engine = self.crawler.engine
+        connection = self._get_connection()
+        if engine is None or engine.slot is None or connection is None:
+            return
+        pending = self._pending_requests_count()
+        active = len(engine.downloader.active)
+        in_flight = self._get_in_flight()
+
+        prefetch_count = self.compute_prefetch_count(pending, active, in_flight)
+        if prefetch_count == self.prefetch_count:
+            return
+        logger.debug(
+            f"prefetch count {self.prefetch_count} -> {prefetch_count} "
+            f"(pending: {pending}, active: {active}, in flight: {in_flight})"
+        )
+        self.prefetch_count = prefetch_count
+        self.crawler.stats.set_value("rmq/prefetch_count", prefetch_count)
+        self.crawler.stats.inc_value("rmq/prefetch_updates_count")
+        connection.add_callback_threadsafe(
+            functools.partial(connection.update_qos, prefetch_count)
+        )
+        if callable(self._on_change):
+            self._on_change(prefetch_count)
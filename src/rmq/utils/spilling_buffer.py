@@ -0,0 +1,117 @@
+import logging
+import os
+import struct
+import tempfile
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SpillingBuffer:
+    """FIFO buffer of serialized messages with bounded memory usage.
+
+    Up to memory_limit messages are kept in a deque. Overflow is appended to a local segment
+    file (length-prefixed records) and read back in order when in-memory part is drained.
+    Once spilling started, new messages go to the segment until it is fully replayed, so
+    order is preserved. Segment is truncated when fully replayed and removed on close.
+    """
+
+    _RECORD_HEADER = struct.Struct(">I")
+
+    def __init__(
+        self,
+        memory_limit: int = 10000,
+        spill_limit_bytes: int = 0,
+        spill_dir: Optional[str] = None,
+    ):
+        self.memory_limit = max(1, memory_limit)
+        # 0 disables spilling to disk
+        self.spill_limit_bytes = max(0, spill_limit_bytes)
+        self.spill_dir = spill_dir
+
+        self._memory = deque()
+        self._segment = None
+        self._segment_path = None
+        self._read_offset = 0
+        self._write_offset = 0
+        self._spilled_count = 0
+
+    def __len__(self):
+        return len(self._memory) + self._spilled_count
+
+    @property
+    def spilled_bytes(self):
+        """Size of spilled and not yet replayed records"""
+        return self._write_offset - self._read_offset
+
+    def is_full(self):
+        if len(self._memory) < self.memory_limit and self._spilled_count == 0:
+            return False
+        return self.spilled_bytes >= self.spill_limit_bytes
+
+    def append(self, message: str) -> bool:
+        """Appends message to the tail. Returns False if both memory and spill limits are reached"""
+        if len(self._memory) < self.memory_limit and self._spilled_count == 0:
+            self._memory.append(message)
+            return True
+        if self.spilled_bytes >= self.spill_limit_bytes:
+            return False
+        self._spill(message.encode("utf-8"))
+        return True
+
+    def requeue(self, messages: List[str]):
+        """Puts messages back to buffer head (e.g. returned by broker). Memory limit is not
+        applied, as these messages were already accounted before publishing
+        """
+        self._memory.extendleft(reversed(messages))
+
+    def popleft(self) -> str:
+        if not self._memory and self._spilled_count:
+            self._replay()
+        return self._memory.popleft()
+
+    def _open_segment(self):
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        fd, self._segment_path = tempfile.mkstemp(
+            prefix="rmq_buffer_", suffix=".seg", dir=self.spill_dir
+        )
+        self._segment = os.fdopen(fd, "w+b")
+        logger.warning(f"Buffer memory limit is reached, spilling messages to {self._segment_path}")
+
+    def _spill(self, data: bytes):
+        if self._segment is None:
+            self._open_segment()
+        self._segment.seek(self._write_offset)
+        self._segment.write(self._RECORD_HEADER.pack(len(data)))
+        self._segment.write(data)
+        self._write_offset += self._RECORD_HEADER.size + len(data)
+        self._spilled_count += 1
+
+    def _replay(self):
+        """Moves up to memory_limit records from segment to memory"""
+        self._segment.flush()
+        self._segment.seek(self._read_offset)
+        while self._spilled_count and len(self._memory) < self.memory_limit:
+            (size,) = self._RECORD_HEADER.unpack(self._segment.read(self._RECORD_HEADER.size))
+            self._memory.append(self._segment.read(size).decode("utf-8"))
+            self._read_offset += self._RECORD_HEADER.size + size
+            self._spilled_count -= 1
+        if self._spilled_count == 0:
+            # segment is fully replayed, reclaim disk space
+            self._segment.seek(0)
+            self._segment.truncate()
+            self._read_offset = self._write_offset = 0
+
+    def close(self):
+        """Drops spill segment. In-memory messages are kept"""
+        if self._segment is not None:
+            self._segment.close()
+            try:
+                os.remove(self._segment_path)
+            except OSError:
+                pass
+            self._segment = None
+            self._segment_path = None
+        self._read_offset = self._write_offset = self._spilled_count = 0
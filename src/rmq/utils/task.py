@@ -1,26 +1,29 @@
 import json
+import time
 
-from rmq.exceptions import ConsumedDataCorrupted
+from .constants import RMQConstants
+from .message_envelope import MessageEnvelope
 
 
 class Task:
-    def __init__(self, consumed_data, ack_callback=None, nack_callback=None):
-        if not isinstance(consumed_data, dict):
-            raise ConsumedDataCorrupted("Consumed data is not a dict")
-        if consumed_data.get("method", None) is None:
-            raise ConsumedDataCorrupted('Consumed data has no "method" key')
-        if consumed_data.get("properties", None) is None:
-            raise ConsumedDataCorrupted('Consumed data has no "properties" key')
-        if consumed_data.get("body", None) is None:
-            raise ConsumedDataCorrupted('Consumed data has no "body" key')
-        self.__consumed_data = consumed_data
-
-        self.payload = json.loads(self.__consumed_data.get("body"))
-        self.delivery_tag = self.__consumed_data.get("method").delivery_tag
-        self.reply_to = self.__consumed_data.get("properties").reply_to
+    def __init__(self, consumed_data, ack_callback=None, nack_callback=None, timeout=None):
+        """consumed_data is either MessageEnvelope or raw consumed message dict"""
+        if not isinstance(consumed_data, MessageEnvelope):
+            consumed_data = MessageEnvelope.from_consumed_data(consumed_data)
+        self.envelope = consumed_data
+
+        # payload is sent back in reply, request meta has its own copy
+        self.payload = self.envelope.payload
+        self.delivery_tag = self.envelope.delivery_tag
+        self.reply_to = self.envelope.reply_to
         self.status = 1
         self.exception = None
 
+        # monotonic timestamps. Deadline from message header takes precedence over default timeout
+        self.created_at = time.monotonic()
+        self.deadline = None
+        self.set_timeout(self.__header_timeout(default=timeout))
+
         self.__ack_callback = (
             ack_callback
             if ack_callback is not None and callable(ack_callback)
@@ -43,9 +46,24 @@ class Task:
 
         self.should_stop = False
 
-    def __empty_callback(self):
+    def __empty_callback(self, **kwargs):
         pass
 
+    def __header_timeout(self, default=None):
+        try:
+            return float(self.envelope.headers[RMQConstants.TASK_TIMEOUT_HEADER.value])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def set_timeout(self, timeout):
+        """Sets task deadline relative to task creation time. Empty or non-positive timeout disables it"""
+        self.deadline = self.created_at + timeout if timeout is not None and timeout > 0 else None
+
+    def is_expired(self, now=None):
+        if self.deadline is None:
+            return False
+        return (time.monotonic() if now is None else now) >= self.deadline
+
     def __disable_callbacks(self):
         self.__ack_callback = self.__empty_callback
         self.__nack_callback = self.__empty_callback
@@ -54,8 +72,8 @@ class Task:
         self.__ack_callback()
         self.__disable_callbacks()
 
-    def nack(self):
-        self.__nack_callback()
+    def nack(self, requeue=True):
+        self.__nack_callback(requeue=requeue)
         self.__disable_callbacks()
 
     def request_scheduled(self):
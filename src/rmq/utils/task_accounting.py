@@ -0,0 +1,81 @@
+import logging
+import time
+
+from pydispatch.dispatcher import getAllReceivers, liveReceivers
+
+from rmq.signals import callback_completed, errback_completed, item_scheduled
+
+logger = logging.getLogger(__name__)
+
+TASK_ACCOUNTANT_ATTRIBUTE = "_rmq_task_accountant"
+
+
+class TaskAccountant:
+    """Receiver of rmq_callback/rmq_errback accounting events.
+
+    When accountant is registered on spider (see set_task_accountant), decorators call it
+    directly instead of dispatching item_scheduled/callback_completed/errback_completed
+    signals. Signals are still sent if there are other receivers connected to them.
+    Handlers have the same signatures as corresponding signal handlers.
+    """
+
+    # receivers are rarely (dis)connected at runtime, so lookup result is cached for this interval
+    _RECEIVERS_CHECK_INTERVAL = 1  # seconds
+
+    def on_item_scheduled(self, response, spider, delivery_tag):
+        raise NotImplementedError
+
+    def on_callback_completed(self, response=None, spider=None, delivery_tag=None):
+        raise NotImplementedError
+
+    def on_errback_completed(self, failure=None, spider=None, delivery_tag=None):
+        raise NotImplementedError
+
+    def account(self, signal, response=None, failure=None, spider=None, delivery_tag=None):
+        # arguments are filtered the same way pydispatch robustApply does for signal handlers
+        if signal is item_scheduled:
+            if response is not None or delivery_tag is not None:
+                self.on_item_scheduled(response, spider, delivery_tag)
+        elif signal is callback_completed:
+            self.on_callback_completed(response=response, spider=spider, delivery_tag=delivery_tag)
+        elif signal is errback_completed:
+            self.on_errback_completed(failure=failure, spider=spider, delivery_tag=delivery_tag)
+
+    def has_external_receivers(self, crawler, signal) -> bool:
+        """Checks if there are receivers of signal other than bound methods of accountant"""
+        cache = self.__dict__.setdefault("_external_receivers_cache", {})
+        now = time.monotonic()
+        cached = cache.get(signal)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        result = False
+        for receiver in liveReceivers(getAllReceivers(crawler.signals.sender, signal)):
+            if getattr(receiver, "__self__", None) is not self:
+                result = True
+                break
+        cache[signal] = (now + self._RECEIVERS_CHECK_INTERVAL, result)
+        return result
+
+
+def set_task_accountant(spider, accountant: TaskAccountant):
+    setattr(spider, TASK_ACCOUNTANT_ATTRIBUTE, accountant)
+
+
+def get_task_accountant(spider):
+    return getattr(spider, TASK_ACCOUNTANT_ATTRIBUTE, None)
+
+
+def send_accounting_event(source_spider, signal, **kwargs):
+    """Delivers accounting event to spider accountant directly (if registered) and
+    sends signal only for external receivers. Falls back to send_catch_log otherwise
+    """
+    accountant = get_task_accountant(source_spider)
+    if accountant is None:
+        source_spider.crawler.signals.send_catch_log(signal=signal, **kwargs)
+        return
+    try:
+        accountant.account(signal, **kwargs)
+    except Exception:
+        logger.exception(f"Error caught on direct accounting by {accountant!r}")
+    if accountant.has_external_receivers(source_spider.crawler, signal):
+        source_spider.crawler.signals.send_catch_log(signal=signal, **kwargs)
@@ -1,15 +1,53 @@
+import heapq
+import itertools
+import time
+from typing import List
+
 from .task import Task
 
 
 class TaskObserver:
+    # rebuild deadlines heap when stale entries (of removed tasks) outnumber alive ones
+    _DEADLINES_COMPACT_MIN_SIZE = 64
+
     def __init__(self):
         self.__tasks = {}
+        # (deadline, sequence, task) min-heap ordered by deadline. Removed tasks are skipped lazily
+        self.__deadlines = []
+        self.__sequence = itertools.count()
 
     def add_task(self, task: Task):
         delivery_tag = task.delivery_tag
         if delivery_tag in self.__tasks.keys():
             raise ValueError(f"Delivery tag {delivery_tag} is already exists")
         self.__tasks[delivery_tag] = task
+        if task.deadline is not None:
+            heapq.heappush(self.__deadlines, (task.deadline, next(self.__sequence), task))
+            self.__compact_deadlines()
+
+    def __compact_deadlines(self):
+        if len(self.__deadlines) > max(self._DEADLINES_COMPACT_MIN_SIZE, 2 * len(self.__tasks)):
+            self.__deadlines = [
+                entry for entry in self.__deadlines if self.__is_observed(entry[2])
+            ]
+            heapq.heapify(self.__deadlines)
+
+    def __is_observed(self, task: Task):
+        return self.__tasks.get(task.delivery_tag) is task
+
+    def pop_expired(self, now=None) -> List[Task]:
+        """Removes tasks which deadline is reached from observer and returns them (oldest first).
+        Only expired heap head is inspected, so scan cost does not depend on processing tasks count
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        while self.__deadlines and self.__deadlines[0][0] <= now:
+            _deadline, _sequence, task = heapq.heappop(self.__deadlines)
+            if self.__is_observed(task):
+                del self.__tasks[task.delivery_tag]
+                expired.append(task)
+        return expired
 
     def get_task(self, delivery_tag):
         return self.__tasks.get(delivery_tag, None)
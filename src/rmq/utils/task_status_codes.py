@@ -8,3 +8,4 @@ class TaskStatusCodes(IntEnum):
     PARTIAL_SUCCESS = 21
     ERROR = 4
     HARDWARE_ERROR = 41
+    TIMEOUT = 42
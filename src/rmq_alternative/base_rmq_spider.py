@@ -1,12 +1,19 @@
 from abc import ABC, abstractmethod
-from typing import Type
+from typing import Type, Union
 
 from scrapy import Spider, Request
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.python.failure import Failure
 
 from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
+from rmq_alternative.schemas.messages.rmq_message import RmqMessage
 
 
 class BaseRmqSpider(Spider, ABC):
+    # RmqMessage based message types are validated on consume only if enabled (BaseRmqMessage always is)
+    validate_messages: bool = False
+    http_error_meta_key: str = '__is_http_error_received'
+
     @property
     @abstractmethod
     def task_queue_name(self) -> str:
@@ -14,9 +21,18 @@ class BaseRmqSpider(Spider, ABC):
 
     @property
     @abstractmethod
-    def message_type(self) -> Type[BaseRmqMessage]:
+    def message_type(self) -> Type[Union[BaseRmqMessage, RmqMessage]]:
         pass
 
     @abstractmethod
-    def next_request(self, message: BaseRmqMessage) -> Request:
+    def next_request(self, message: Union[BaseRmqMessage, RmqMessage]) -> Request:
         pass
+
+    def rmq_default_errback(self, failure: Failure, *args, **kwargs):
+        """Errback of requests without own errback. It's a spider method, so requests stay
+        serializable for JOBDIR disk queues
+        """
+        exception = failure.value
+        if isinstance(exception, HttpError):
+            failure.value.response.meta[self.http_error_meta_key] = True
+        raise failure
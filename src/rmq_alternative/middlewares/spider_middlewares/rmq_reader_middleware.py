@@ -1,6 +1,5 @@
 import logging
-from collections import deque
-from typing import Type, Dict, Iterator, Union
+from typing import Type, Dict, Iterator, Optional, Union
 
 import pika
 import scrapy
@@ -8,22 +7,20 @@ from scrapy import signals, Request
 from scrapy.crawler import Crawler
 from scrapy.exceptions import CloseSpider, DontCloseSpider
 from scrapy.http import Response
-from scrapy.spidermiddlewares.httperror import HttpError
-from twisted.internet import reactor
-from twisted.python.failure import Failure
 
-from rmq.connections import PikaSelectConnection
-from rmq.utils import RMQDefaultOptions
+from rmq.connections import get_connection_class
+from rmq.utils import PrefetchController, RMQDefaultOptions, pause_crawl, unpause_crawl
 from rmq_alternative.base_rmq_spider import BaseRmqSpider
 from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
+from rmq_alternative.schemas.messages.rmq_message import RmqMessage
+from rmq_alternative.utils.message_registry import MessageRegistry
 
 DeliveryTagInteger = int
 CountRequestInteger = int
+RequestFingerprint = bytes
 
 
 class RmqReaderMiddleware(object):
-    request_counter: Dict[DeliveryTagInteger, CountRequestInteger] = {}
-
     @classmethod
     def from_crawler(cls, crawler):
         if not isinstance(crawler.spider, BaseRmqSpider):
@@ -48,19 +45,35 @@ class RmqReaderMiddleware(object):
         self.crawler = crawler
         self.__spider: BaseRmqSpider = crawler.spider
 
-        self.failed_response_deque = deque([], maxlen=crawler.settings.get('CONCURRENT_REQUESTS'))
+        """Active messages state. Entries are removed when message is acked or nacked"""
+        self.request_counter: Dict[DeliveryTagInteger, CountRequestInteger] = {}
+        """Fingerprints of recently failed responses (insertion ordered, oldest are evicted)"""
+        self.failed_responses: Dict[RequestFingerprint, None] = {}
+        self.failed_responses_limit: int = max(1, crawler.settings.getint('CONCURRENT_REQUESTS', 1))
 
         self.message_meta_name: str = '__rmq_message'
         self.init_request_meta_name: str = '__rmq_init_request'
-        self.is_http_error_received: str = '__is_http_error_received'
+        self.is_http_error_received: str = BaseRmqSpider.http_error_meta_key
+
+        """Request meta carries only serializable message handle (JOBDIR disk queues compatible)"""
+        self.message_registry = MessageRegistry()
 
         self.logger = logging.getLogger(name=self.__class__.__name__)
         self.logger.setLevel(self.__spider.settings.get("LOG_LEVEL", "INFO"))
         logging.getLogger("pika").setLevel(self.__spider.settings.get("PIKA_LOG_LEVEL", "WARNING"))
 
+        self.connection_class = get_connection_class(crawler.settings)
         self.rmq_connection = None
 
-        """Build pika connection parameters and start connection in separate twisted thread"""
+        self.prefetch_controller = None
+        if self.__spider.settings.getbool("RABBITMQ_ADAPTIVE_PREFETCH_ENABLED", False):
+            self.prefetch_controller = PrefetchController.from_crawler(
+                crawler,
+                get_connection=lambda: self.rmq_connection,
+                get_in_flight=lambda: len(self.request_counter),
+            )
+
+        """Build pika connection parameters. Connection is started on first spider_idle"""
         self.parameters = pika.ConnectionParameters(
             host=self.__spider.settings.get("RABBITMQ_HOST"),
             port=int(self.__spider.settings.get("RABBITMQ_PORT")),
@@ -73,7 +86,7 @@ class RmqReaderMiddleware(object):
         )
 
     def connect(self, parameters, queue_name):
-        c = PikaSelectConnection(
+        c = self.connection_class(
             parameters,
             queue_name,
             owner=self,
@@ -89,19 +102,30 @@ class RmqReaderMiddleware(object):
 
     def set_connection_handle(self, connection):
         self.rmq_connection = connection
+        if self.prefetch_controller is not None:
+            self.prefetch_controller.start()
+
+    def set_is_blocked(self, is_blocked):
+        """Pause crawl while broker blocks connection (memory/disk alarm)"""
+        if is_blocked:
+            self.logger.warning("RabbitMQ connection is blocked. Pausing crawl")
+            self.crawler.stats.inc_value("rmq/connection_blocked_count")
+            pause_crawl(self.crawler, self)
+        else:
+            self.logger.info("RabbitMQ connection is unblocked. Resuming crawl")
+            unpause_crawl(self.crawler, self)
 
     def spider_idle(self, spider: BaseRmqSpider):
         if not self.rmq_connection:
             task_queue_name = self.__spider.task_queue_name
-            reactor.callInThread(self.connect, self.parameters, task_queue_name)
+            self.connection_class.dispatch(self.connect, self.parameters, task_queue_name)
         raise DontCloseSpider
 
     def spider_closed(self, spider: BaseRmqSpider):
-        if self.rmq_connection is not None and isinstance(self.rmq_connection, PikaSelectConnection):
-            if isinstance(self.rmq_connection.connection, pika.SelectConnection):
-                self.rmq_connection.connection.ioloop.add_callback_threadsafe(
-                    self.rmq_connection.stop
-                )
+        if self.prefetch_controller is not None:
+            self.prefetch_controller.stop()
+        if self.rmq_connection is not None:
+            self.rmq_connection.add_callback_threadsafe(self.rmq_connection.stop)
 
     def raise_close_spider(self):
         # TODO: does it work?
@@ -123,19 +147,20 @@ class RmqReaderMiddleware(object):
     # SPIDER MIDDLEWARE METHOD
     def process_spider_output(self, response, result, spider: BaseRmqSpider) -> Iterator[Union[Request, dict]]:
         if self.message_meta_name in response.request.meta:
-            rmq_message: BaseRmqMessage = response.request.meta[self.message_meta_name]
-            delivery_tag = rmq_message.deliver.delivery_tag
+            message_handle: str = response.request.meta[self.message_meta_name]
+            rmq_message = self.get_message(response.request.meta)
+            delivery_tag = rmq_message.deliver.delivery_tag if rmq_message is not None else None
 
-            if self.is_active_message(delivery_tag):
+            if delivery_tag is not None and self.is_active_message(delivery_tag):
                 for item_or_request in result:
                     if isinstance(item_or_request, scrapy.Request):
                         self.request_counter_increment(delivery_tag)
-                        item_or_request.meta[self.message_meta_name] = rmq_message
+                        item_or_request.meta[self.message_meta_name] = message_handle
                         if item_or_request.errback is None:
-                            item_or_request.errback = self.default_errback
+                            item_or_request.errback = spider.rmq_default_errback
                     yield item_or_request
 
-                if response in self.failed_response_deque:
+                if self.pop_failed_response(response) or not self.is_active_message(delivery_tag):
                     return
 
                 if response.request.meta.get(self.is_http_error_received):
@@ -165,7 +190,7 @@ class RmqReaderMiddleware(object):
         return []
 
     def on_message_consumed(self, dict_message: dict) -> None:
-        SpiderRmqMessage: Type[BaseRmqMessage] = self.__spider.message_type
+        SpiderRmqMessage: Type[Union[BaseRmqMessage, RmqMessage]] = self.__spider.message_type
         message = SpiderRmqMessage(
             channel=dict_message['channel'],
             deliver=dict_message['method'],
@@ -174,14 +199,23 @@ class RmqReaderMiddleware(object):
             _rmq_connection=self.rmq_connection,
             _crawler=self.crawler,
         )
+        if isinstance(message, RmqMessage) and self.__spider.validate_messages:
+            try:
+                message.validate()
+            except ValueError as e:
+                self.logger.error(f'invalid message with delivery tag {message.deliver.delivery_tag}: {e}')
+                self.crawler.stats.inc_value('rmq/invalid_messages_count')
+                message.nack()
+                return
         request = self.__spider.next_request(message)
-        request.meta[self.message_meta_name] = message
+        request.meta[self.message_meta_name] = self.message_registry.register(message)
         self.request_counter[message.deliver.delivery_tag] = 1
+        self.update_active_messages_stats()
         if request.errback is None:
-            request.errback = self.default_errback
+            request.errback = self.__spider.rmq_default_errback
 
         if self.crawler.crawling:
-            self.crawler.engine.crawl(request, spider=self.__spider)
+            self.crawler.engine.crawl(request)
 
     def on_spider_error(self, failure, response: Response, spider: BaseRmqSpider, *args, **kwargs):
         self.logger.error(str(failure))
@@ -190,32 +224,34 @@ class RmqReaderMiddleware(object):
         else:
             meta = failure.request.meta
 
-        if self.message_meta_name in meta:
-            # TODO: What was I trying to do?
-            self.failed_response_deque.append(response)
-            rmq_message: BaseRmqMessage = meta[self.message_meta_name]
+        rmq_message = self.get_message(meta)
+        if rmq_message is not None:
+            # process_spider_output of failed response must not acknowledge its message
+            if isinstance(response, Response):
+                self.add_failed_response(response)
             self.nack(rmq_message)
 
     def on_item_dropped(self, item, response, exception, spider: BaseRmqSpider):
-        if self.message_meta_name in response.meta:
-            rmq_message: BaseRmqMessage = response.meta[self.message_meta_name]
+        rmq_message = self.get_message(response.meta)
+        if rmq_message is not None:
             self.nack(rmq_message)
 
     def on_item_error(self, item, response, spider: BaseRmqSpider, failure):
-        if self.message_meta_name in response.meta:
-            rmq_message: BaseRmqMessage = response.meta[self.message_meta_name]
+        rmq_message = self.get_message(response.meta)
+        if rmq_message is not None:
             self.nack(rmq_message)
 
     def on_request_dropped(self, request, spider: BaseRmqSpider):
         """
         called when the request is filtered
         """
-        if self.message_meta_name in request.meta:
-            rmq_message: BaseRmqMessage = request.meta[self.message_meta_name]
+        rmq_message = self.get_message(request.meta)
+        if rmq_message is not None:
             delivery_tag = rmq_message.deliver.delivery_tag
             self.logger.warning(f'request_dropped, delivery tag {delivery_tag}')
-            self.request_counter_decrement(delivery_tag)
-            self.try_to_acknowledge_message(rmq_message)
+            if self.is_active_message(delivery_tag):
+                self.request_counter_decrement(delivery_tag)
+                self.try_to_acknowledge_message(rmq_message)
 
     def request_counter_increment(self, delivery_tag: int):
         self.request_counter[delivery_tag] += 1
@@ -224,19 +260,47 @@ class RmqReaderMiddleware(object):
         self.request_counter[delivery_tag] -= 1
 
     def try_to_acknowledge_message(self, rmq_message: BaseRmqMessage):
-        self.logger.warning('try for acknowledge - {}'.format(self.request_counter[rmq_message.deliver.delivery_tag]))
-        if self.request_counter[rmq_message.deliver.delivery_tag] == 0:
+        delivery_tag = rmq_message.deliver.delivery_tag
+        self.logger.debug('try for acknowledge - {}'.format(self.request_counter[delivery_tag]))
+        if self.request_counter[delivery_tag] == 0:
             rmq_message.ack()
+            self.release_message(delivery_tag)
+            self.crawler.stats.inc_value('rmq/messages_acked_count')
 
     def nack(self, rmq_message: BaseRmqMessage) -> None:
         rmq_message.nack()
-        self.request_counter.pop(rmq_message.deliver.delivery_tag, None)
+        if self.release_message(rmq_message.deliver.delivery_tag):
+            self.crawler.stats.inc_value('rmq/messages_nacked_count')
+
+    def release_message(self, delivery_tag: int) -> bool:
+        """Removes message state. Returns False if message was already released"""
+        is_released = self.request_counter.pop(delivery_tag, None) is not None
+        self.message_registry.release(delivery_tag)
+        self.update_active_messages_stats()
+        return is_released
+
+    def add_failed_response(self, response: Response):
+        self.failed_responses[self.crawler.request_fingerprinter.fingerprint(response.request)] = None
+        if len(self.failed_responses) > self.failed_responses_limit:
+            del self.failed_responses[next(iter(self.failed_responses))]
+
+    def pop_failed_response(self, response: Response) -> bool:
+        if not self.failed_responses:
+            return False
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(response.request)
+        return self.failed_responses.pop(fingerprint, False) is None
+
+    def update_active_messages_stats(self):
+        self.crawler.stats.set_value('rmq/active_messages', len(self.request_counter))
 
     def is_active_message(self, delivery_tag: int) -> bool:
         return delivery_tag in self.request_counter
 
-    def default_errback(self, failure: Failure, *args, **kwargs):
-        exception = failure.value
-        if isinstance(exception, HttpError):
-            failure.value.response.meta[self.is_http_error_received] = True
-        raise failure
+    def get_message(self, meta: dict) -> Optional[Union[BaseRmqMessage, RmqMessage]]:
+        """Resolves message by handle from request meta. Returns None for released messages and
+        for handles of another process (requests restored from JOBDIR, message was redelivered)
+        """
+        message_handle = meta.get(self.message_meta_name)
+        if message_handle is None:
+            return None
+        return self.message_registry.resolve(message_handle)
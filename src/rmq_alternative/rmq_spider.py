@@ -8,7 +8,8 @@ from rmq_alternative.base_rmq_spider import BaseRmqSpider
 class RmqSpider(BaseRmqSpider, ABC):
     @classmethod
     def update_settings(cls, settings):
+        super().update_settings(settings)
+        # added after custom_settings are applied, so spider's own SPIDER_MIDDLEWARES keep reader middleware
         spider_middlewares = settings.getdict("SPIDER_MIDDLEWARES")
         spider_middlewares[get_import_full_name(rmq_reader_middleware.RmqReaderMiddleware)] = 1
-        settings.set("SPIDER_MIDDLEWARES", spider_middlewares)
-        super().update_settings(settings)
+        settings.set("SPIDER_MIDDLEWARES", spider_middlewares, priority="spider")
@@ -1,25 +1,25 @@
 import functools
 import logging
-from typing import Callable
+from typing import Any, Callable, Union
 
-from pika.channel import Channel
 from pika.spec import Basic, BasicProperties
 from pydantic import BaseModel, Json, PrivateAttr, Extra
 from scrapy.crawler import Crawler
 
-from rmq.connections import PikaSelectConnection
+from rmq.connections import PikaSelectConnection, PikaTwistedConnection
 from rmq_alternative.utils import signals as CustomSignals
 
 logger = logging.getLogger(name='BaseRmqMessage')
 
 
 class BaseRmqMessage(BaseModel):
-    channel: Channel
+    # pika.channel.Channel or channel of connection made by RABBITMQ_CONNECTION_FACTORY
+    channel: Any
     deliver: Basic.Deliver
     basic_properties: BasicProperties
     body: Json
 
-    _rmq_connection: PikaSelectConnection = PrivateAttr()
+    _rmq_connection: Union[PikaSelectConnection, PikaTwistedConnection] = PrivateAttr()
     _crawler: Crawler = PrivateAttr()
     _is_acknowledged_message: bool = PrivateAttr(False)
 
@@ -35,7 +35,7 @@ class BaseRmqMessage(BaseModel):
             ack_function: Callable = functools.partial(
                 self._rmq_connection.acknowledge_message, delivery_tag=self.deliver.delivery_tag
             )
-            self._rmq_connection.connection.ioloop.add_callback_threadsafe(ack_function)
+            self._rmq_connection.add_callback_threadsafe(ack_function)
             logger.info(f'ACK message with delivery tag {self.deliver.delivery_tag}')
             self._crawler.signals.send_catch_log(CustomSignals.message_ack, rmq_message=self)
 
@@ -46,7 +46,7 @@ class BaseRmqMessage(BaseModel):
             nack_function: Callable = functools.partial(
                 self._rmq_connection.negative_acknowledge_message, delivery_tag=self.deliver.delivery_tag
             )
-            self._rmq_connection.connection.ioloop.add_callback_threadsafe(nack_function)
+            self._rmq_connection.add_callback_threadsafe(nack_function)
             logger.info(f'NACK message with delivery tag {self.deliver.delivery_tag}')
             self._crawler.signals.send_catch_log(CustomSignals.message_nack, rmq_message=self)
 
@@ -0,0 +1,105 @@
+import functools
+import json
+import logging
+from typing import Any, Callable, Union
+
+from pika.spec import Basic, BasicProperties
+from scrapy.crawler import Crawler
+
+from rmq.connections import PikaSelectConnection, PikaTwistedConnection
+from rmq_alternative.utils import signals as CustomSignals
+
+logger = logging.getLogger(name='RmqMessage')
+
+_NOT_DECODED = object()
+
+
+class RmqMessage:
+    """Lightweight alternative of BaseRmqMessage with the same ack/nack contract.
+
+    Message is built without model validation: body is decoded on first access and cached.
+    Validation could be enabled per spider with BaseRmqSpider.validate_messages
+    """
+
+    __slots__ = (
+        'channel',
+        'deliver',
+        'basic_properties',
+        '_raw_body',
+        '_body',
+        '_rmq_connection',
+        '_crawler',
+        '_is_acknowledged_message',
+    )
+
+    def __init__(
+        self,
+        channel,
+        deliver: Basic.Deliver,
+        basic_properties: BasicProperties,
+        body: Union[str, bytes],
+        _rmq_connection: Union[PikaSelectConnection, PikaTwistedConnection],
+        _crawler: Crawler,
+    ):
+        self.channel = channel
+        self.deliver = deliver
+        self.basic_properties = basic_properties
+        self._raw_body = body
+        self._body = _NOT_DECODED
+        self._rmq_connection = _rmq_connection
+        self._crawler = _crawler
+        self._is_acknowledged_message = False
+
+    @property
+    def body(self) -> Any:
+        if self._body is _NOT_DECODED:
+            self._body = self.decode_body(self._raw_body)
+        return self._body
+
+    @property
+    def raw_body(self) -> Union[str, bytes]:
+        return self._raw_body
+
+    def decode_body(self, raw_body: Union[str, bytes]) -> Any:
+        """Could be overridden for non json payloads"""
+        return json.loads(raw_body)
+
+    def validate(self) -> None:
+        """Checks pika objects types and decodes body. Raises ValueError on invalid message"""
+        if self.channel is None:
+            raise ValueError('message has no channel')
+        if not isinstance(self.deliver, Basic.Deliver):
+            raise ValueError(f'deliver must be {Basic.Deliver.__name__}, got {type(self.deliver)}')
+        if not isinstance(self.basic_properties, BasicProperties):
+            raise ValueError(
+                f'basic_properties must be {BasicProperties.__name__}, got {type(self.basic_properties)}'
+            )
+        try:
+            self.body
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'message body is not decodable: {e}') from e
+
+    def ack(self):
+        if self._is_acknowledged_message is False:
+            self._is_acknowledged_message = True
+
+            ack_function: Callable = functools.partial(
+                self._rmq_connection.acknowledge_message, delivery_tag=self.deliver.delivery_tag
+            )
+            self._rmq_connection.add_callback_threadsafe(ack_function)
+            logger.info(f'ACK message with delivery tag {self.deliver.delivery_tag}')
+            self._crawler.signals.send_catch_log(CustomSignals.message_ack, rmq_message=self)
+
+    def nack(self) -> None:
+        if self._is_acknowledged_message is False:
+            self._is_acknowledged_message = True
+
+            nack_function: Callable = functools.partial(
+                self._rmq_connection.negative_acknowledge_message, delivery_tag=self.deliver.delivery_tag
+            )
+            self._rmq_connection.add_callback_threadsafe(nack_function)
+            logger.info(f'NACK message with delivery tag {self.deliver.delivery_tag}')
+            self._crawler.signals.send_catch_log(CustomSignals.message_nack, rmq_message=self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(delivery_tag={self.deliver.delivery_tag})'
@@ -0,0 +1,37 @@
+import uuid
+from typing import Dict, Optional, Union
+
+from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
+from rmq_alternative.schemas.messages.rmq_message import RmqMessage
+
+# handles of messages consumed by another process (e.g. requests restored from JOBDIR) are not resolved
+PROCESS_TOKEN = uuid.uuid4().hex
+
+
+class MessageRegistry:
+    """Maps serializable message handles (stored in request meta) to consumed message objects.
+
+    Message objects hold pika channel and crawler references and can't be pickled by scrapy
+    disk queues, so requests carry only '<process token>:<delivery tag>' handle
+    """
+
+    def __init__(self, process_token: str = PROCESS_TOKEN):
+        self.process_token = process_token
+        self._messages: Dict[str, Union[BaseRmqMessage, RmqMessage]] = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def build_handle(self, delivery_tag: int) -> str:
+        return f'{self.process_token}:{delivery_tag}'
+
+    def register(self, message: Union[BaseRmqMessage, RmqMessage]) -> str:
+        handle = self.build_handle(message.deliver.delivery_tag)
+        self._messages[handle] = message
+        return handle
+
+    def resolve(self, handle: str) -> Optional[Union[BaseRmqMessage, RmqMessage]]:
+        return self._messages.get(handle)
+
+    def release(self, delivery_tag: int) -> None:
+        self._messages.pop(self.build_handle(delivery_tag), None)
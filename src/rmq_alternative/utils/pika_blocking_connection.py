@@ -1,6 +1,6 @@
-import pika
 from scrapy.utils.project import get_project_settings
 
+from rmq.connections import get_connection_factory
 from rmq_alternative.utils.pika_connection_parameters import pika_connection_parameters
 
 
@@ -11,7 +11,8 @@ class PikaBlockingConnection(object):
         if not isinstance(settings, dict):
             settings = get_project_settings()
 
-        self.rabbit_connection = pika.BlockingConnection(pika_connection_parameters(settings))
+        connection_factory = get_connection_factory(settings)
+        self.rabbit_connection = connection_factory.blocking_connection(pika_connection_parameters(settings))
 
         self.queue_name = queue_name
         self.rabbit_channel = self.rabbit_connection.channel()
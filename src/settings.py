@@ -19,6 +19,17 @@ COMMANDS_MODULE = "commands"
 PROXY = os.getenv("PROXY", "")
 PROXY_AUTH = os.getenv("PROXY_AUTH", "")
 PROXY_ENABLED = strtobool(os.getenv("PROXY_ENABLED", "False"))
+# middlewares.ProxyRotationMiddleware: proxies from PROXY_LIST_FILE are selected by health score,
+# ban responses and connection errors put proxy into cooldown (doubled on each failure up to max)
+PROXY_MODE = os.getenv("PROXY_MODE", "1")
+PROXY_LIST_FILE = os.getenv("PROXY_LIST_FILE", "")
+PROXY_BAN_HTTP_CODES = list(map(int, (s for s in os.getenv("PROXY_BAN_HTTP_CODES", "403,429").split(",") if s)))
+PROXY_BAN_MARKERS = [
+    s for s in os.getenv("PROXY_BAN_MARKERS", "g-recaptcha,h-captcha,cf-challenge").split(",") if s
+]
+PROXY_BAN_MAX_RETRIES = int(os.getenv("PROXY_BAN_MAX_RETRIES", "3"))
+PROXY_COOLDOWN_BASE = float(os.getenv("PROXY_COOLDOWN_BASE", "30"))
+PROXY_COOLDOWN_MAX = float(os.getenv("PROXY_COOLDOWN_MAX", "1800"))
 
 USER_AGENT_RELEASE_DATE = '2021-11-01'
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/95.0.4638.54 Safari/537.36"
@@ -38,6 +49,9 @@ DEFAULT_REQUEST_HEADERS = {
 }
 
 ROTATING_PROXIES_DOWNLOADER_HANDLER_AUTO_CLOSE_CACHED_CONNECTIONS_ENABLED: bool = True
+# utils.handlers.StreamingFileDownloadHandler temporary files folder, empty - system temporary folder.
+# Same filesystem as FileSaver folder: downloaded files are moved without copying
+DOWNLOAD_STREAMING_TEMP_FOLDER = os.getenv("DOWNLOAD_STREAMING_TEMP_FOLDER", "")
 
 DOWNLOADER_MIDDLEWARES = {
     "scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware": None,
@@ -48,7 +62,8 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE") if os.getenv("LOG_FILE", "") else None
 
 ITEM_PIPELINES: Dict[str, int] = {
-    "pipelines.FeedbooksSQLAlchemyPipeline":300
+    "pipelines.FeedbooksSQLAlchemyPipeline":300,
+    "pipelines.FeedbooksCoverPipeline": 310,
 }
 
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
@@ -56,6 +71,20 @@ DB_PORT = int(os.getenv("DB_PORT", "3306"))
 DB_USERNAME = os.getenv("DB_USERNAME", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_DATABASE = os.getenv("DB_DATABASE", "db_name")
+# BaseCSVExporter output format: csv, csv.gz, csv.zst, jsonl, jsonl.gz, jsonl.zst, parquet.
+# Empty - format of exporter (csv). csv.zst/jsonl.zst require "zstd" extra, parquet - "parquet" extra
+EXPORT_FILE_EXTENSION = os.getenv("EXPORT_FILE_EXTENSION", "")
+# utils.PackFileSaver storage, compacted by "scrapy pack_compact"
+PACK_STORAGE_FOLDER = os.getenv("PACK_STORAGE_FOLDER", "../storage/packs")
+PACK_STORAGE_MAX_PACK_SIZE = int(os.getenv("PACK_STORAGE_MAX_PACK_SIZE", str(1024 ** 3)))
+# pipelines.FeedbooksCoverPipeline: cover downloads share CONCURRENT_REQUESTS with pages, at most
+# COVERS_CONCURRENT_DOWNLOADS at once. Lookups of stored covers and books.image_filename updates are batched
+COVERS_FOLDER = os.getenv("COVERS_FOLDER", "../storage/covers")
+# covers are stored by content hash, files are written by COVERS_SAVE_THREADS threads
+COVERS_SAVE_THREADS = int(os.getenv("COVERS_SAVE_THREADS", "4"))
+COVERS_CONCURRENT_DOWNLOADS = int(os.getenv("COVERS_CONCURRENT_DOWNLOADS", "8"))
+COVERS_BATCH_SIZE = int(os.getenv("COVERS_BATCH_SIZE", "500"))
+COVERS_FLUSH_INTERVAL = float(os.getenv("COVERS_FLUSH_INTERVAL", "5"))
 
 PIKA_LOG_LEVEL = os.getenv("PIKA_LOG_LEVEL", "WARN")
 logging.getLogger("pika").setLevel(PIKA_LOG_LEVEL)
@@ -65,6 +94,66 @@ RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 RABBITMQ_USERNAME = os.getenv("RABBITMQ_USERNAME", "guest")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD", "guest")
 RABBITMQ_VIRTUAL_HOST = os.getenv("RABBITMQ_VIRTUAL_HOST", "/")
+# rmq.connections.PikaSelectConnection runs pika ioloop in separate thread,
+# rmq.connections.PikaTwistedConnection runs AMQP directly on the twisted reactor
+RABBITMQ_CONNECTION_CLASS = os.getenv("RABBITMQ_CONNECTION_CLASS", "rmq.connections.PikaSelectConnection")
+# opens pika connections, e.g. rmq.connections.fake_broker.FakeBrokerConnectionFactory (in-process broker
+# for tests and benchmarks). Empty - rmq.connections.PikaConnectionFactory
+RABBITMQ_CONNECTION_FACTORY = os.getenv("RABBITMQ_CONNECTION_FACTORY", "")
+# RPCTaskConsumer acknowledges completed tasks with basic_ack(multiple=True) frames (opt-in)
+try:
+    RABBITMQ_ACK_COALESCING_ENABLED = strtobool(os.getenv("RABBITMQ_ACK_COALESCING_ENABLED", "False"))
+except ValueError:
+    RABBITMQ_ACK_COALESCING_ENABLED = False
+RABBITMQ_ACK_FLUSH_INTERVAL = float(os.getenv("RABBITMQ_ACK_FLUSH_INTERVAL", "0.5"))
+# 0 means CONCURRENT_REQUESTS // 4
+RABBITMQ_ACK_FLUSH_THRESHOLD = int(os.getenv("RABBITMQ_ACK_FLUSH_THRESHOLD", "0"))
+# consumers adjust basic_qos prefetch count at runtime within [RABBITMQ_PREFETCH_MIN, RABBITMQ_PREFETCH_MAX]
+try:
+    RABBITMQ_ADAPTIVE_PREFETCH_ENABLED = strtobool(os.getenv("RABBITMQ_ADAPTIVE_PREFETCH_ENABLED", "False"))
+except ValueError:
+    RABBITMQ_ADAPTIVE_PREFETCH_ENABLED = False
+RABBITMQ_PREFETCH_MIN = int(os.getenv("RABBITMQ_PREFETCH_MIN", "1"))
+# 0 means 4 * CONCURRENT_REQUESTS
+RABBITMQ_PREFETCH_MAX = int(os.getenv("RABBITMQ_PREFETCH_MAX", "0"))
+RABBITMQ_PREFETCH_ADJUST_INTERVAL = float(os.getenv("RABBITMQ_PREFETCH_ADJUST_INTERVAL", "5"))
+# default RPC task deadline in seconds, 0 - no deadline (message could set it with x-task-timeout header)
+RABBITMQ_TASK_TIMEOUT = float(os.getenv("RABBITMQ_TASK_TIMEOUT", "0"))
+# expired task without reply_to is nacked with requeue flag: False - dead-lettered/dropped by broker
+try:
+    RABBITMQ_TASK_TIMEOUT_REQUEUE = strtobool(os.getenv("RABBITMQ_TASK_TIMEOUT_REQUEUE", "False"))
+except ValueError:
+    RABBITMQ_TASK_TIMEOUT_REQUEUE = False
+RABBITMQ_TASK_WATCHDOG_INTERVAL = float(os.getenv("RABBITMQ_TASK_WATCHDOG_INTERVAL", "10"))
+# rmq_callback/rmq_errback update task counters of RPCTaskConsumer directly instead of pydispatch signals
+try:
+    RABBITMQ_DIRECT_ACCOUNTING_ENABLED = strtobool(os.getenv("RABBITMQ_DIRECT_ACCOUNTING_ENABLED", "False"))
+except ValueError:
+    RABBITMQ_DIRECT_ACCOUNTING_ENABLED = False
+# ItemProducerPipeline buffer for items produced while connection is not interactable:
+# messages kept in memory, overflow spilled to disk (0 - no spilling), then backpressure
+RABBITMQ_ITEM_BUFFER_MEMORY_LIMIT = int(os.getenv("RABBITMQ_ITEM_BUFFER_MEMORY_LIMIT", "10000"))
+RABBITMQ_ITEM_BUFFER_SPILL_LIMIT = int(os.getenv("RABBITMQ_ITEM_BUFFER_SPILL_LIMIT", str(1024 ** 3)))
+RABBITMQ_ITEM_BUFFER_SPILL_DIR = os.getenv("RABBITMQ_ITEM_BUFFER_SPILL_DIR", "")
+# ItemProducerPipeline packs up to RABBITMQ_ITEM_BATCH_SIZE items (or RABBITMQ_ITEM_BATCH_BYTES) into one message,
+# partial batch is published after RABBITMQ_ITEM_BATCH_LINGER seconds. 0 or 1 - one item per message
+RABBITMQ_ITEM_BATCH_SIZE = int(os.getenv("RABBITMQ_ITEM_BATCH_SIZE", "0"))
+RABBITMQ_ITEM_BATCH_BYTES = int(os.getenv("RABBITMQ_ITEM_BATCH_BYTES", str(1024 ** 2)))
+RABBITMQ_ITEM_BATCH_LINGER = float(os.getenv("RABBITMQ_ITEM_BATCH_LINGER", "0.2"))
+# ItemProducerPipeline publishes with broker confirms, nacked or unconfirmed messages are requeued to buffer
+try:
+    RABBITMQ_PUBLISH_CONFIRMS_ENABLED = strtobool(os.getenv("RABBITMQ_PUBLISH_CONFIRMS_ENABLED", "True"))
+except ValueError:
+    RABBITMQ_PUBLISH_CONFIRMS_ENABLED = True
+# max unconfirmed messages in flight, 0 - unbounded
+RABBITMQ_PUBLISH_WINDOW = int(os.getenv("RABBITMQ_PUBLISH_WINDOW", "1000"))
+# seconds to wait for buffered and unconfirmed messages on spider close
+RABBITMQ_PUBLISH_CONFIRM_TIMEOUT = float(os.getenv("RABBITMQ_PUBLISH_CONFIRM_TIMEOUT", "30"))
+# publisher connection is reopened on broker disconnect instead of closing spider
+try:
+    RABBITMQ_PUBLISHER_RECONNECT = strtobool(os.getenv("RABBITMQ_PUBLISHER_RECONNECT", "True"))
+except ValueError:
+    RABBITMQ_PUBLISHER_RECONNECT = True
 
 try:
     HTTPCACHE_ENABLED = strtobool(os.getenv("HTTPCACHE_ENABLED", "False"))
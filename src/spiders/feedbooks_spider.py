@@ -119,7 +119,7 @@ class FeedbooksSpider(scrapy.Spider):
             lang=lang,
             isbn=epub_isbn,
             paper_isbn=paper_isbn,
-            image_urls=[image_url],
+            image_urls=[response.urljoin(image_url)] if image_url else [],
             ebook_size=ebook_size,
         )
 
@@ -1,15 +1,41 @@
 import json
 import logging
+import os
+import sys
+import traceback
 
 import pika
 import pytest
 from scrapy.crawler import CrawlerProcess
 from scrapy.http import HtmlResponse
-from scrapy.utils.project import get_project_settings
 
+from rmq.connections.fake_broker import reset_fake_brokers
 from rmq.utils import get_import_full_name
 from rmq_alternative.utils.pika_blocking_connection import PikaBlockingConnection
-from tests.rmq_new_tests.constant import QUEUE_NAME
+from tests.rmq_new_tests.constant import QUEUE_NAME, get_test_settings
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Twisted reactor can't be restarted, so tests which start CrawlerProcess run in forked process"""
+    if "crawler" not in pyfuncitem.fixturenames:
+        return None
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            pyfuncitem.obj(**{name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames})
+            exit_code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        pytest.fail("Crawler test failed in forked process, see captured stderr", pytrace=False)
+    return True
 
 
 class Response200DownloaderMiddleware:
@@ -19,7 +45,8 @@ class Response200DownloaderMiddleware:
 
 @pytest.fixture
 def rabbit_setup():
-    rmq_connection = PikaBlockingConnection(QUEUE_NAME)
+    reset_fake_brokers()
+    rmq_connection = PikaBlockingConnection(QUEUE_NAME, settings=get_test_settings().copy_to_dict())
     rmq_connection.rabbit_channel.queue_delete(QUEUE_NAME)
     queue = rmq_connection.rabbit_channel.queue_declare(queue=QUEUE_NAME, durable=True)
     for index in range(1):
@@ -40,7 +67,7 @@ def rabbit_setup():
 
 @pytest.fixture
 def crawler():
-    settings = get_project_settings()
+    settings = get_test_settings()
     custom_settings = {
         "DOWNLOADER_MIDDLEWARES": {
             get_import_full_name(Response200DownloaderMiddleware): 1,
@@ -1 +1,20 @@
+import os
+import tempfile
+
+from scrapy.utils.project import get_project_settings
+
 QUEUE_NAME = 'test_queue'
+
+# tests run against in-process fake broker, RMQ_TESTS_LIVE_BROKER=True runs them against RABBITMQ_HOST
+LIVE_BROKER = os.getenv('RMQ_TESTS_LIVE_BROKER', 'False').lower() in ('1', 'true', 'yes')
+FAKE_CONNECTION_FACTORY = 'rmq.connections.fake_broker.FakeBrokerConnectionFactory'
+# FeedbooksCoverPipeline of project ITEM_PIPELINES mustn't write into project storage
+COVERS_FOLDER = os.path.join(tempfile.gettempdir(), 'rmq_new_tests_covers')
+
+
+def get_test_settings():
+    settings = get_project_settings()
+    settings.set('COVERS_FOLDER', COVERS_FOLDER, priority='cmdline')
+    if not LIVE_BROKER:
+        settings.set('RABBITMQ_CONNECTION_FACTORY', FAKE_CONNECTION_FACTORY, priority='cmdline')
+    return settings
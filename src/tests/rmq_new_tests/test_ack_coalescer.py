@@ -0,0 +1,84 @@
+from rmq.utils import AckCoalescer
+
+
+def make_coalescer(threshold=1):
+    frames = []
+    coalescer = AckCoalescer(frames.append, threshold=threshold)
+    return coalescer, frames
+
+
+class TestAckCoalescer:
+    def test_multiple_ack_stops_before_processing_tag(self):
+        coalescer, frames = make_coalescer()
+        generation = [coalescer.register(tag) for tag in (1, 2, 3)][0]
+
+        coalescer.complete(2, generation)
+        assert frames == []
+
+        coalescer.complete(1, generation)
+        assert frames == [[(2, True)]]
+
+        coalescer.complete(3, generation)
+        assert frames == [[(2, True)], [(3, True)]]
+
+    def test_threshold_delays_prefix_flush(self):
+        coalescer, frames = make_coalescer(threshold=3)
+        generation = [coalescer.register(tag) for tag in (1, 2, 3, 4)][0]
+
+        coalescer.complete(1, generation)
+        coalescer.complete(2, generation)
+        assert frames == []
+
+        coalescer.complete(3, generation)
+        assert frames == [[(3, True)]]
+
+    def test_full_flush_acks_out_of_order_tags_individually(self):
+        coalescer, frames = make_coalescer(threshold=10)
+        generation = [coalescer.register(tag) for tag in (1, 2, 3, 4)][0]
+        coalescer.complete(2, generation)
+        coalescer.complete(4, generation)
+
+        coalescer.flush()
+        assert frames == [[(2, False), (4, False)]]
+
+        # individually acked tags are not acked again by later multiple ack
+        coalescer.complete(1, generation)
+        coalescer.flush()
+        assert frames[-1] == [(1, True)]
+        assert coalescer.pending_count() == 0
+
+    def test_completed_prefix_is_acked_before_nack(self):
+        coalescer, frames = make_coalescer(threshold=10)
+        generation = [coalescer.register(tag) for tag in (1, 2, 3)][0]
+        coalescer.complete(1, generation)
+
+        assert coalescer.discard(2, generation) is True
+        # ack of tag delivered before nacked one is sent before caller sends nack
+        assert frames == [[(1, True)]]
+
+        coalescer.complete(3, generation)
+        coalescer.flush()
+        assert frames[-1] == [(3, True)]
+
+    def test_discarded_tag_is_not_acked(self):
+        coalescer, frames = make_coalescer(threshold=10)
+        generation = [coalescer.register(tag) for tag in (1, 2)][0]
+        coalescer.complete(2, generation)
+        coalescer.discard(2, generation)
+
+        coalescer.flush()
+        assert frames == []
+        assert coalescer.discard(2, generation) is False
+
+    def test_stale_generation_is_ignored_after_reset(self):
+        coalescer, frames = make_coalescer()
+        old_generation = coalescer.register(1)
+        coalescer.reset()
+        new_generation = coalescer.register(1)
+
+        coalescer.complete(1, old_generation)
+        assert coalescer.discard(1, old_generation) is False
+        assert frames == []
+
+        coalescer.complete(1, new_generation)
+        assert frames == [[(1, True)]]
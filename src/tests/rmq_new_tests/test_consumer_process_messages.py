@@ -0,0 +1,46 @@
+import pytest
+from twisted.python.failure import Failure
+
+pytest.importorskip("MySQLdb")
+
+from rmq.commands.consumer import Consumer  # noqa: E402
+from rmq.exceptions import MessageNotProcessed  # noqa: E402
+
+
+class StoringConsumer(Consumer):
+    def __init__(self, results):
+        super().__init__()
+        self.results = results
+        self.processed = []
+
+    def process_message(self, transaction, message_body):
+        self.processed.append(message_body["id"])
+        return self.results[message_body["id"]]
+
+
+def test_batch_is_processed_when_all_documents_are_stored():
+    consumer = StoringConsumer({1: True, 2: True})
+
+    assert consumer.process_messages(None, [{"id": 1}, {"id": 2}]) is True
+    assert consumer.processed == [1, 2]
+
+
+def test_failed_document_rolls_back_batch_transaction():
+    # exception raised within runInteraction makes adbapi roll transaction back
+    consumer = StoringConsumer({1: True, 2: False, 3: True})
+
+    with pytest.raises(MessageNotProcessed):
+        consumer.process_messages(None, [{"id": 1}, {"id": 2}, {"id": 3}])
+    assert consumer.processed == [1, 2]
+
+
+def test_not_processed_message_is_nacked():
+    consumer = StoringConsumer({})
+    nacks = []
+
+    consumer.on_message_process_failure(
+        Failure(MessageNotProcessed("Document of consumed message is not processed")),
+        nack_callback=lambda: nacks.append(True),
+    )
+
+    assert nacks == [True]
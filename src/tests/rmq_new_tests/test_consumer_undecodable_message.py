@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+from rmq.commands.consumer import Consumer  # noqa: E402
+from rmq.utils.item_batch import BATCH_CODEC_HEADER, BATCH_COUNT_HEADER  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self):
+        self.nacks = []
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def acknowledge_message(self, delivery_tag, multiple=False):
+        raise AssertionError("undecodable message must not be acked")
+
+    def negative_acknowledge_message(self, delivery_tag, requeue=True):
+        self.nacks.append((delivery_tag, requeue))
+
+
+@pytest.mark.parametrize(
+    "headers, body",
+    [
+        ({BATCH_CODEC_HEADER: "gzip"}, b""),
+        ({BATCH_CODEC_HEADER: "jsonl", BATCH_COUNT_HEADER: 2}, b'{"id": 1}'),
+        (None, b"not json"),
+    ],
+)
+def test_undecodable_message_is_rejected_and_polling_continues(headers, body):
+    consumer = Consumer()
+    consumer.rmq_connection = FakeConnection()
+    consumer._can_get_next_message = False
+
+    consumer.on_basic_get_message(
+        {
+            "method": SimpleNamespace(delivery_tag=7),
+            "properties": pika.BasicProperties(headers=headers),
+            "body": body,
+        }
+    )
+
+    assert consumer.rmq_connection.nacks == [(7, False)]
+    assert consumer._can_get_next_message is True
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from scrapy.http import Response
+from twisted.internet import defer
+
+from utils import ContentAddressedFileSaver
+from utils import file_saver
+
+
+@pytest.fixture
+def saver(tmp_path):
+    saver = ContentAddressedFileSaver(str(tmp_path / 'files'))
+    yield saver
+    saver.close()
+
+
+def image_response(body: bytes, url: str = 'https://example.com/covers/book.jpg?size=large') -> Response:
+    return Response(url, body=body, headers={'Content-Type': 'image/jpeg'})
+
+
+def test_file_is_stored_by_content_hash(saver):
+    content_hash = hashlib.sha256(b'cover').hexdigest()
+
+    path_to_file = saver._store(b'cover', '.jpg')
+
+    assert path_to_file == os.path.join(
+        saver.base_folder, content_hash[:2], content_hash[2:4], f'{content_hash}.jpg'
+    )
+    with open(path_to_file, 'rb') as file:
+        assert file.read() == b'cover'
+    assert (saver.stored_count, saver.duplicates_count) == (1, 0)
+
+
+def test_same_content_is_stored_once(saver):
+    first_path = saver._store(b'cover', '.jpg')
+    # path of stored copy is returned for other extension too
+    second_path = saver._store(b'cover', '.png')
+
+    assert second_path == first_path
+    assert (saver.stored_count, saver.duplicates_count) == (1, 1)
+
+
+def test_index_is_kept_between_runs(tmp_path):
+    saver = ContentAddressedFileSaver(str(tmp_path / 'files'))
+    path_to_file = saver._store(b'cover', '.jpg')
+    saver.close()
+
+    saver = ContentAddressedFileSaver(str(tmp_path / 'files'))
+    try:
+        assert saver._store(b'cover', '.jpg') == path_to_file
+        assert saver.duplicates_count == 1
+    finally:
+        saver.close()
+
+    index = sqlite3.connect(os.path.join(tmp_path / 'files', ContentAddressedFileSaver.index_filename))
+    assert index.execute('SELECT count(*) FROM files').fetchone() == (1,)
+    index.close()
+
+
+def test_concurrent_saves_share_one_copy(saver):
+    bodies = [b'cover-%d' % (index % 4) for index in range(64)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = list(executor.map(lambda body: saver._store(body, '.jpg'), bodies))
+
+    assert len(set(paths)) == 4
+    assert saver.stored_count == 4
+    assert saver.stored_count + saver.duplicates_count == len(bodies)
+
+
+def test_save_file_fires_with_path_and_original_filename(saver, monkeypatch):
+    monkeypatch.setattr(
+        file_saver.threads,
+        'deferToThreadPool',
+        lambda reactor, thread_pool, function, *args: defer.maybeDeferred(function, *args),
+    )
+    results = []
+
+    saver.save_file(image_response(b'cover')).addCallback(results.append)
+
+    path_to_file, original_filename = results[0]
+    assert original_filename == 'book.jpg'
+    assert path_to_file.endswith('.jpg')
+    assert os.path.isfile(path_to_file)
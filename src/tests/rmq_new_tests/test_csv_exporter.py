@@ -0,0 +1,296 @@
+import datetime
+import gzip
+import logging
+import os
+from concurrent.futures import Future
+from datetime import date
+
+import pytest
+from sqlalchemy import Column, Date, DateTime, Integer, String
+from sqlalchemy.orm import declarative_base
+from twisted.internet import defer
+
+pytest.importorskip("MySQLdb")
+
+from commands.base import base_csv_exporter  # noqa: E402
+from commands.base.base_csv_exporter import BaseCSVExporter  # noqa: E402
+from commands.base.export_watermark import ExportWatermark  # noqa: E402
+from commands.base.export_writers import BaseExportWriter, CSVExportWriter, GzipCSVExportWriter  # noqa: E402
+
+Base = declarative_base()
+
+
+class ExportedRow(Base):
+    __tablename__ = 'exported_rows'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String(255))
+    sent_to_customer = Column(Date)
+    updated_at = Column(DateTime)
+
+
+class RowsExporter(BaseCSVExporter):
+    table = ExportedRow
+
+
+class FakeWriter:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeReactor:
+    def __init__(self):
+        self.stopped = False
+        self.calls = []
+
+    def stop(self):
+        self.stopped = True
+
+    def callFromThread(self, function, *args):
+        self.calls.append(function)
+
+
+class FakeConnectionPool:
+    def __init__(self):
+        self.transaction = FakeTransaction()
+
+    def runInteraction(self, interaction, *args):
+        return defer.maybeDeferred(interaction, self.transaction, *args)
+
+
+class FakeTransaction:
+    def __init__(self, rows=()):
+        self.statements = []
+        self.rows = list(rows)
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeUpdateConnection:
+    def __init__(self, events):
+        self.events = events
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement):
+        self.events.append(('mark', statement.rsplit('IN ', 1)[-1]))
+
+    def commit(self):
+        pass
+
+
+def make_writer_class(events, durable_flush, fail_close=False):
+    class RecordingWriter(BaseExportWriter):
+        def open(self):
+            pass
+
+        def write_rows(self, rows):
+            events.append(('write', [row['id'] for row in rows]))
+
+        def flush(self):
+            pass
+
+        def close(self):
+            if fail_close:
+                raise OSError('No space left on device')
+            events.append(('close',))
+
+    RecordingWriter.durable_flush = durable_flush
+    return RecordingWriter
+
+
+class FakeProcessPoolExecutor:
+    """Shards are run synchronously, shard with None result fails"""
+
+    def __init__(self, results, **kwargs):
+        self.results = iter(results)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, function, command_path, file_extension, part_path, id_range):
+        future = Future()
+        rows = next(self.results)
+        writer = GzipCSVExportWriter(part_path, ['id'], write_header=False)
+        writer.open()
+        writer.write_rows(rows or [{'id': id_range[0]}])
+        if rows is None:
+            # worker is killed after flush, gzip member isn't finished
+            writer.flush()
+            future.set_exception(RuntimeError('A process in the process pool was terminated abruptly'))
+            return future
+        writer.close()
+        future.set_result((len(rows), ['id']))
+        return future
+
+
+class FakeFailure:
+    def getErrorMessage(self):
+        return 'Lock wait timeout exceeded'
+
+    def trap(self, *errors):
+        pass
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    reactor = FakeReactor()
+    monkeypatch.setattr(base_csv_exporter, 'reactor', reactor)
+    exporter = RowsExporter()
+    exporter.logger = logging.getLogger('RowsExporter')
+    exporter.reactor = reactor
+    exporter.headers = []
+    exporter.writer_class = CSVExportWriter
+    exporter._written_ids = []
+    return exporter
+
+
+def stream_rows(exporter, tmp_path, events, rows_count=5, **writer_options):
+    exporter.writer_class = make_writer_class(events, **writer_options)
+    exporter.file_path = str(tmp_path / 'export.csv')
+    exporter.stream_buffer_size = 2
+    exporter._update_connection = FakeUpdateConnection(events)
+    updated_at = datetime.datetime(2024, 3, 1, 12, 0)
+    rows = [
+        {'id': row_id, 'title': str(row_id), 'sent_to_customer': None, 'updated_at': updated_at}
+        for row_id in range(1, rows_count + 1)
+    ]
+    return exporter.stream_data(FakeTransaction(rows))
+
+
+def test_chunk_is_marked_by_single_statement(exporter):
+    transaction = FakeTransaction()
+
+    exporter.mark_exported(transaction, [1, 2, 3])
+    exporter.mark_exported(transaction, [])
+
+    assert len(transaction.statements) == 1
+    statement = transaction.statements[0]
+    assert statement.startswith('UPDATE exported_rows SET sent_to_customer=')
+    assert date.today().strftime('%Y-%m-%d') in statement
+    assert statement.endswith('WHERE exported_rows.id IN (1, 2, 3)')
+
+
+def test_failed_chunk_update_closes_writer_and_stops_export(exporter):
+    writer = FakeWriter()
+    exporter.writer = writer
+
+    exporter._on_chunk_update_error(FakeFailure())
+
+    assert writer.closed
+    assert exporter.writer is None
+    assert exporter.reactor.stopped
+
+
+def test_non_durable_writer_chunks_are_selected_past_written_rows(exporter):
+    exporter.writer_class = make_writer_class([], durable_flush=False)
+    exporter._written_ids = [[1, 2], [5, 8]]
+    transaction = FakeTransaction()
+
+    exporter.get_data(transaction, 2)
+
+    statement = transaction.statements[0]
+    assert 'exported_rows.id > 8' in statement
+    assert statement.endswith('ORDER BY exported_rows.id \n LIMIT 2')
+
+
+def test_durable_writer_rows_are_marked_after_each_flush(exporter, tmp_path):
+    events = []
+
+    assert stream_rows(exporter, tmp_path, events, durable_flush=True) == 5
+
+    assert events == [
+        ('write', [1, 2]), ('mark', '(1, 2)'),
+        ('write', [3, 4]), ('mark', '(3, 4)'),
+        ('write', [5]), ('mark', '(5)'),
+        ('close',),
+    ]
+
+
+def test_non_durable_writer_rows_are_marked_after_close(exporter, tmp_path):
+    events = []
+
+    stream_rows(exporter, tmp_path, events, durable_flush=False)
+
+    assert events == [
+        ('write', [1, 2]), ('write', [3, 4]), ('write', [5]),
+        ('close',),
+        ('mark', '(1, 2)'), ('mark', '(3, 4)'), ('mark', '(5)'),
+    ]
+
+
+def test_non_durable_writer_rows_are_not_marked_if_close_fails(exporter, tmp_path):
+    events = []
+
+    with pytest.raises(OSError):
+        stream_rows(exporter, tmp_path, events, durable_flush=False, fail_close=True)
+
+    assert [event for event in events if event[0] == 'mark'] == []
+    assert exporter._written_ids == []
+
+
+@pytest.mark.parametrize('fail_close', [False, True])
+def test_non_durable_writer_watermark_is_saved_after_close(exporter, tmp_path, fail_close):
+    exporter.use_watermark = True
+    exporter.watermark = ExportWatermark(str(tmp_path / 'watermarks' / 'RowsExporter.json'))
+
+    if fail_close:
+        with pytest.raises(OSError):
+            stream_rows(exporter, tmp_path, [], durable_flush=False, fail_close=True)
+        assert exporter.watermark.load() is None
+    else:
+        stream_rows(exporter, tmp_path, [], durable_flush=False)
+        assert exporter.watermark.load() == (datetime.datetime(2024, 3, 1, 12, 0), 5)
+
+
+def test_non_durable_writer_chunks_are_marked_after_export_is_finished(exporter, tmp_path):
+    events = []
+    exporter.writer_class = make_writer_class(events, durable_flush=False)
+    exporter.file_path = str(tmp_path / 'export.csv')
+    exporter.db_connection_pool = FakeConnectionPool()
+
+    exporter.export([{'id': 1, 'title': 'a'}, {'id': 2, 'title': 'b'}])
+    exporter.export([{'id': 3, 'title': 'c'}])
+    assert exporter.db_connection_pool.transaction.statements == []
+    assert exporter.reactor.calls == [exporter.produce_data] * 2
+
+    exporter.export([])
+
+    assert events == [('write', [1, 2]), ('write', [3]), ('close',)]
+    statements = exporter.db_connection_pool.transaction.statements
+    assert [statement.rsplit('IN ', 1)[-1] for statement in statements] == ['(1, 2)', '(3)']
+    assert exporter.reactor.stopped
+
+
+def test_parts_of_failed_shards_are_not_assembled_for_non_durable_writer(exporter, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        base_csv_exporter,
+        'ProcessPoolExecutor',
+        lambda **kwargs: FakeProcessPoolExecutor([[{'id': 1}], None, [{'id': 7}]]),
+    )
+    exporter.writer_class = GzipCSVExportWriter
+    exporter.file_extension = 'csv.gz'
+    exporter.file_path = str(tmp_path / 'export.csv.gz')
+    exporter.parallel_shards = 3
+
+    assert exporter.run_shards([(1, 4), (4, 7), (7, 10)]) == 2
+
+    with gzip.open(exporter.file_path, 'rt', encoding='utf-8') as file:
+        assert file.read().split() == ['id', '1', '7']
+    assert os.listdir(tmp_path) == ['export.csv.gz']
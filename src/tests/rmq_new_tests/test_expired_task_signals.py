@@ -0,0 +1,63 @@
+import time
+from types import SimpleNamespace
+
+import pika
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from rmq.extensions import RPCTaskConsumer
+from rmq.utils import RMQConstants, Task, TaskObserver
+
+DELIVERY_TAG_META_KEY = RMQConstants.DELIVERY_TAG_META_KEY.value
+
+
+def make_consumer(settings=None):
+    crawler = get_crawler(settings_dict=settings or {})
+    crawler.stats.open_spider(None)
+    consumer = RPCTaskConsumer(crawler)
+    spider = SimpleNamespace(processing_tasks=TaskObserver(), logger=SimpleNamespace(warning=print))
+    consumer._RPCTaskConsumer__spider = spider
+    consumer._can_interact = True
+    return consumer, spider
+
+
+def add_expired_task(spider, delivery_tag, nacks):
+    message = {
+        "method": pika.spec.Basic.Deliver(delivery_tag=delivery_tag),
+        "properties": pika.BasicProperties(),
+        "body": b'{"url": "https://example.com"}',
+    }
+    task = Task(message, nack_callback=lambda requeue: nacks.append((delivery_tag, requeue)))
+    task.deadline = time.monotonic() - 1
+    spider.processing_tasks.add_task(task)
+    return task
+
+
+class TestExpiredTaskSignals:
+    def test_late_signals_of_expired_task_are_ignored(self):
+        consumer, spider = make_consumer()
+        nacks = []
+        add_expired_task(spider, 1, nacks)
+        consumer._expire_tasks()
+        assert spider.processing_tasks.get_task(1) is None
+
+        request = Request("https://example.com", meta={DELIVERY_TAG_META_KEY: 1})
+        response = HtmlResponse(request.url, body=b"", request=request)
+        consumer.on_request_scheduled(request, spider)
+        consumer.on_request_dropped(request, spider)
+        consumer.on_callback_completed(response, spider)
+        consumer.on_item_scheduled(response, spider, 1)
+        consumer.on_item_scraped({}, response, spider)
+        consumer.on_item_dropped({}, response, None, spider)
+        consumer.on_item_error({}, response, None, spider)
+
+        assert nacks == [(1, False)]
+
+    def test_expired_task_requeue_setting(self):
+        consumer, spider = make_consumer()
+        consumer.task_timeout_requeue = True
+        nacks = []
+        add_expired_task(spider, 1, nacks)
+        consumer._expire_tasks()
+        assert nacks == [(1, True)]
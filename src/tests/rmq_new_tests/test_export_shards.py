@@ -0,0 +1,126 @@
+import csv
+import gzip
+import json
+import os
+
+import pytest
+
+# commands.base package imports MySQLdb
+pytest.importorskip("MySQLdb")
+
+from commands.base.export_shards import assemble_parts, split_id_range  # noqa: E402
+from commands.base.export_writers import (CSVExportWriter, GzipCSVExportWriter, GzipJsonLinesExportWriter,  # noqa: E402
+                                          JsonLinesExportWriter, ZstdCSVExportWriter, ZstdJsonLinesExportWriter)
+
+HEADERS = ['id', 'title']
+
+
+@pytest.mark.parametrize(
+    'min_id, max_id, count, expected',
+    [
+        (1, 10, 2, [(1, 6), (6, 11)]),
+        (1, 10, 3, [(1, 5), (5, 9), (9, 11)]),
+        (5, 5, 4, [(5, 6)]),
+        (1, 3, 8, [(1, 2), (2, 3), (3, 4)]),
+    ],
+)
+def test_split_id_range(min_id, max_id, count, expected):
+    assert split_id_range(min_id, max_id, count) == expected
+
+
+@pytest.mark.parametrize('count', [1, 3, 7, 16])
+def test_split_id_range_covers_every_id_once(count):
+    ranges = split_id_range(17, 1234, count)
+
+    assert len(ranges) <= count
+    assert ranges[0][0] == 17 and ranges[-1][1] == 1235
+    assert all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:]))
+
+
+def write_part(writer_class, part_path, rows):
+    writer = writer_class(str(part_path), HEADERS, write_header=False)
+    writer.open()
+    writer.write_rows(rows)
+    writer.close()
+
+
+def test_csv_parts_are_joined_in_order_after_single_header(tmp_path):
+    file_path = tmp_path / 'export.csv'
+    part_paths = [tmp_path / f'export.part{index:04d}.csv' for index in range(3)]
+    write_part(CSVExportWriter, part_paths[0], [{'id': 1, 'title': 'a'}, {'id': 2, 'title': 'b'}])
+    # empty shard leaves no (or empty) part
+    write_part(CSVExportWriter, part_paths[2], [{'id': 7, 'title': 'c'}])
+
+    assembled = assemble_parts(CSVExportWriter, str(file_path), HEADERS, [str(path) for path in part_paths])
+
+    assert assembled == [str(part_paths[0]), str(part_paths[2])]
+    with open(file_path, encoding='utf-8') as file:
+        assert list(csv.reader(file)) == [HEADERS, ['1', 'a'], ['2', 'b'], ['7', 'c']]
+    assert not any(path.exists() for path in part_paths)
+
+
+def test_gzip_parts_are_joined_as_members(tmp_path):
+    file_path = tmp_path / 'export.jsonl.gz'
+    part_paths = [tmp_path / f'export.part{index:04d}.jsonl.gz' for index in range(2)]
+    write_part(GzipJsonLinesExportWriter, part_paths[0], [{'id': 1, 'title': 'a'}])
+    write_part(GzipJsonLinesExportWriter, part_paths[1], [{'id': 2, 'title': 'b'}])
+
+    assemble_parts(GzipJsonLinesExportWriter, str(file_path), HEADERS, [str(path) for path in part_paths])
+
+    with gzip.open(file_path, 'rt', encoding='utf-8') as file:
+        assert [json.loads(line)['id'] for line in file] == [1, 2]
+
+
+class NotConcatenableWriter(CSVExportWriter):
+    concatenable = False
+
+
+def test_not_concatenable_parts_are_listed_in_manifest(tmp_path):
+    file_path = tmp_path / 'export.csv'
+    part_paths = [tmp_path / f'export.part{index:04d}.csv' for index in range(2)]
+    for index, part_path in enumerate(part_paths):
+        write_part(NotConcatenableWriter, part_path, [{'id': index, 'title': 'a'}])
+
+    assemble_parts(NotConcatenableWriter, str(file_path), HEADERS, [str(path) for path in part_paths])
+
+    assert not file_path.exists()
+    assert all(path.exists() for path in part_paths)
+    with open(f'{file_path}.manifest.json', encoding='utf-8') as file:
+        assert json.load(file) == {'parts': [path.name for path in part_paths]}
+
+
+def test_nothing_is_assembled_without_parts(tmp_path):
+    file_path = tmp_path / 'export.csv'
+
+    assert assemble_parts(CSVExportWriter, str(file_path), HEADERS, [str(tmp_path / 'missing.csv')]) == []
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize(
+    'writer_class, durable_flush',
+    [
+        (CSVExportWriter, True),
+        (JsonLinesExportWriter, True),
+        (GzipCSVExportWriter, False),
+        (GzipJsonLinesExportWriter, False),
+        (ZstdCSVExportWriter, False),
+        (ZstdJsonLinesExportWriter, False),
+    ],
+)
+def test_only_uncompressed_writers_are_durable_after_flush(writer_class, durable_flush):
+    assert writer_class.durable_flush is durable_flush
+
+
+def test_flushed_gzip_file_is_incomplete_until_close(tmp_path):
+    part_path = tmp_path / 'export.jsonl.gz'
+    writer = GzipJsonLinesExportWriter(str(part_path), HEADERS)
+    writer.open()
+    writer.write_rows([{'id': 1, 'title': 'a'}])
+    writer.flush()
+
+    # process crashes here: member of flushed file isn't finished
+    with pytest.raises(EOFError):
+        gzip.decompress(part_path.read_bytes())
+
+    writer.close()
+    assert json.loads(gzip.decompress(part_path.read_bytes())) == {'id': 1, 'title': 'a'}
@@ -0,0 +1,37 @@
+import datetime
+import os
+
+import pytest
+
+# commands.base package imports MySQLdb
+pytest.importorskip("MySQLdb")
+
+from commands.base.export_watermark import ExportWatermark  # noqa: E402
+
+
+def test_missing_watermark_starts_from_beginning(tmp_path):
+    assert ExportWatermark(str(tmp_path / 'watermarks' / 'Exporter.json')).load() is None
+
+
+def test_position_is_saved_and_loaded(tmp_path):
+    watermark = ExportWatermark(str(tmp_path / 'watermarks' / 'Exporter.json'))
+    updated_at = datetime.datetime(2024, 3, 1, 12, 30, 15, 250000)
+
+    watermark.save(updated_at, 42)
+    watermark.save(updated_at, 43)
+
+    assert watermark.load() == (updated_at, 43)
+    assert ExportWatermark(watermark.file_path).load() == (updated_at, 43)
+    assert os.listdir(tmp_path / 'watermarks') == ['Exporter.json']
+
+
+def test_failed_save_keeps_previous_position(tmp_path):
+    watermark = ExportWatermark(str(tmp_path / 'Exporter.json'))
+    updated_at = datetime.datetime(2024, 3, 1, 12, 30, 15)
+    watermark.save(updated_at, 42)
+
+    with pytest.raises(TypeError):
+        watermark.save(updated_at, object())
+
+    assert watermark.load() == (updated_at, 42)
+    assert os.listdir(tmp_path) == ['Exporter.json']
@@ -0,0 +1,146 @@
+import pika
+import pytest
+
+from rmq.connections.fake_broker import FakeBroker, FakeChannel, FakeSelectConnection
+
+QUEUE = 'fake_broker_queue'
+
+
+class Scheduled:
+    """Collects channel replies, run() delivers them like connection ioloop"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def __call__(self, callback):
+        self.callbacks.append(callback)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+@pytest.fixture
+def broker():
+    broker = FakeBroker()
+    broker.declare_queue(QUEUE)
+    return broker
+
+
+def make_channel(broker, channel_number=1):
+    scheduled = Scheduled()
+    return FakeChannel(broker, channel_number, scheduled), scheduled
+
+
+def publish(channel, *bodies):
+    for body in bodies:
+        channel.basic_publish(exchange='', routing_key=QUEUE, body=body)
+
+
+def consume(channel, scheduled):
+    deliveries = []
+    channel.basic_consume(
+        QUEUE, lambda _channel, method, _properties, body: deliveries.append((method, body))
+    )
+    scheduled.run()
+    return deliveries
+
+
+def test_prefetch_limits_unacked_deliveries(broker):
+    channel, scheduled = make_channel(broker)
+    publish(channel, b'1', b'2', b'3')
+    channel.basic_qos(prefetch_count=2)
+    deliveries = consume(channel, scheduled)
+
+    assert [body for _, body in deliveries] == [b'1', b'2']
+    assert len(broker.get_queue(QUEUE)) == 1
+
+    channel.basic_ack(deliveries[0][0].delivery_tag)
+    scheduled.run()
+    assert [body for _, body in deliveries] == [b'1', b'2', b'3']
+    assert len(broker.get_queue(QUEUE)) == 0
+
+
+def test_nack_requeue_redelivers_message_to_queue_head(broker):
+    channel, scheduled = make_channel(broker)
+    publish(channel, b'1', b'2')
+    channel.basic_qos(prefetch_count=1)
+    deliveries = consume(channel, scheduled)
+
+    channel.basic_nack(deliveries[0][0].delivery_tag, requeue=True)
+    scheduled.run()
+    method, body = deliveries[-1]
+    assert body == b'1'
+    assert method.redelivered
+
+    channel.basic_nack(method.delivery_tag, requeue=False)
+    scheduled.run()
+    method, body = deliveries[-1]
+    assert body == b'2'
+    assert not method.redelivered
+    assert broker.acked_count == 0
+
+
+def test_unknown_delivery_tag_closes_channel(broker):
+    channel, scheduled = make_channel(broker)
+    close_reasons = []
+    channel.add_on_close_callback(lambda _channel, reason: close_reasons.append(reason))
+
+    channel.basic_ack(42)
+    scheduled.run()
+
+    assert channel.is_closed
+    assert close_reasons[0].reply_code == 406
+
+
+def test_publisher_confirms(broker):
+    channel, scheduled = make_channel(broker)
+    confirms = []
+    channel.confirm_delivery(lambda frame: confirms.append(frame.method))
+    scheduled.run()
+
+    broker.nack_publishes = 1
+    publish(channel, b'1', b'2')
+    scheduled.run()
+
+    assert isinstance(confirms[0], pika.spec.Basic.Nack)
+    assert isinstance(confirms[1], pika.spec.Basic.Ack)
+    assert [confirm.delivery_tag for confirm in confirms] == [1, 2]
+    assert [message.body for message in broker.get_queue(QUEUE).messages] == [b'2']
+
+
+def test_unacked_messages_are_redelivered_when_channel_is_closed(broker):
+    channel, scheduled = make_channel(broker)
+    publish(channel, b'1', b'2')
+    deliveries = consume(channel, scheduled)
+    channel.basic_ack(deliveries[0][0].delivery_tag)
+    channel.close()
+
+    other_channel, other_scheduled = make_channel(broker, channel_number=2)
+    redeliveries = consume(other_channel, other_scheduled)
+
+    assert [(method.redelivered, body) for method, body in redeliveries] == [(True, b'2')]
+    assert broker.acked_count == 1
+
+
+def test_connection_closed_by_broker_closes_channels():
+    broker = FakeBroker()
+    closed = []
+
+    def on_close(connection, reason):
+        closed.append(reason)
+        connection.ioloop.stop()
+
+    connection = FakeSelectConnection(
+        broker=broker, on_open_callback=lambda connection: connection.ioloop.stop(), on_close_callback=on_close
+    )
+    connection.ioloop.start()
+    channel = connection.channel()
+
+    broker.close_connections()
+    connection.ioloop.start()
+
+    assert channel.is_closed
+    assert connection.is_closed
+    assert closed[0].reply_code == 320
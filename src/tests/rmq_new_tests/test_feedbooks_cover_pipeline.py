@@ -0,0 +1,132 @@
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from scrapy.http import Response
+from scrapy.settings import Settings
+from twisted.internet import defer
+
+pytest.importorskip("MySQLdb")
+
+from pipelines.feedbooks_cover_pipeline import FeedbooksCoverPipeline  # noqa: E402
+from pipelines.feedbooks_sqlalchemy_pipeline import FeedbooksSQLAlchemyPipeline  # noqa: E402
+from rmq.utils.sql_expressions import compile_expression  # noqa: E402
+from utils import file_saver  # noqa: E402
+
+
+class FakeStats:
+    def __init__(self):
+        self.values = Counter()
+
+    def inc_value(self, key, count=1):
+        self.values[key] += count
+
+
+class FakeTransaction:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def execute(self, query, params):
+        self.query, self.params = query, params
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    # saver thread pool is replaced by synchronous calls, reactor isn't running
+    monkeypatch.setattr(
+        file_saver.threads,
+        'deferToThreadPool',
+        lambda reactor, thread_pool, function, *args: defer.maybeDeferred(function, *args),
+    )
+    settings = Settings({
+        'COVERS_FOLDER': str(tmp_path / 'covers'),
+        'COVERS_SAVE_THREADS': 1,
+        'COVERS_CONCURRENT_DOWNLOADS': 2,
+        'COVERS_BATCH_SIZE': 100,
+        'COVERS_FLUSH_INTERVAL': 5,
+    })
+    crawler = SimpleNamespace(settings=settings, stats=FakeStats())
+    pipeline = FeedbooksCoverPipeline(crawler, {})
+    yield pipeline
+    pipeline.file_saver.close()
+
+
+def cover_response(url, body=b'cover'):
+    return Response(url, body=body, headers={'Content-Type': 'image/jpeg'})
+
+
+def test_equal_covers_are_saved_once_and_queued_for_update(pipeline):
+    first_url, second_url = 'https://example.com/a.jpg', 'https://example.com/b.jpg'
+    pipeline._downloading = {first_url: ['book-1', 'book-2'], second_url: ['book-3']}
+
+    pipeline._on_cover_downloaded(cover_response(first_url), first_url)
+    pipeline._on_cover_downloaded(cover_response(second_url), second_url)
+
+    image_filename = pipeline._saved_urls[first_url]
+    assert pipeline._saved_urls[second_url] == image_filename
+    assert not os.path.isabs(image_filename)
+    assert os.path.isfile(os.path.join(pipeline.file_saver.base_folder, image_filename))
+    assert pipeline._pending_updates == [
+        ('book-1', image_filename, first_url),
+        ('book-2', image_filename, first_url),
+        ('book-3', image_filename, second_url),
+    ]
+    assert pipeline.file_saver.duplicates_count == 1
+    assert pipeline.stats.values['covers/downloaded'] == 2
+    assert pipeline._downloading == {}
+
+
+def test_item_reaches_cover_pipeline_after_its_row_is_stored():
+    sql_pipeline = FeedbooksSQLAlchemyPipeline({})
+    interaction = defer.Deferred()
+    sql_pipeline.db_pool = SimpleNamespace(runInteraction=lambda function, item: interaction)
+    item = {'item_url': 'https://example.com/book', 'image_urls': ['https://example.com/a.jpg']}
+    passed_items = []
+
+    sql_pipeline.process_item(item, spider=None).addCallback(passed_items.append)
+    assert passed_items == []
+
+    interaction.callback(None)
+    assert passed_items == [item]
+
+
+def test_row_of_recrawled_book_is_updated():
+    item = {
+        field: None
+        for field in (
+            'title', 'authors', 'translators', 'series_name', 'series_number', 'categories', 'description',
+            'publication_date', 'publisher', 'isbn', 'paper_isbn', 'lang', 'page_count', 'ebook_format',
+            'ebook_size', 'price', 'currency',
+        )
+    }
+    item.update(item_url='https://example.com/book', image_urls=['https://example.com/b.jpg'])
+
+    query, _ = compile_expression(FeedbooksSQLAlchemyPipeline({}).build_store_stmt(item))
+
+    updated = query.split(' ON DUPLICATE KEY UPDATE ')[1]
+    assert 'image_url = VALUES(image_url)' in updated
+    assert 'item_url' not in updated
+    assert 'image_filename' not in updated
+
+
+def test_stored_cover_is_looked_up_by_image_url_it_was_saved_from(pipeline):
+    # row image_url is already overwritten by re-crawled item
+    transaction = FakeTransaction([{'item_url': 'book-1', 'image_filename_url': 'https://example.com/old.jpg'}])
+
+    stored = pipeline.select_stored_covers(transaction, ['book-1'])
+
+    assert transaction.query.startswith('SELECT books.item_url, books.image_filename_url')
+    assert stored == {'book-1': 'https://example.com/old.jpg'}
+
+
+def test_image_url_of_saved_cover_is_stored_with_its_path(pipeline):
+    transaction = FakeTransaction()
+
+    pipeline.update_image_filenames(transaction, [('book-1', 'ab/cd/cover.jpg', 'https://example.com/a.jpg')])
+
+    assert 'image_filename_url=CASE books.item_url' in transaction.query
+    assert 'https://example.com/a.jpg' in transaction.params
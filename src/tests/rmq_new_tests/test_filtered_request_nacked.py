@@ -8,16 +8,18 @@ from scrapy import Request
 from scrapy.crawler import CrawlerProcess
 from scrapy.signalmanager import dispatcher
 
+from rmq.connections.fake_broker import reset_fake_brokers
 from rmq_alternative.rmq_spider import RmqSpider
 from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
 from rmq_alternative.utils import signals as CustomSignals
 from rmq_alternative.utils.pika_blocking_connection import PikaBlockingConnection
-from tests.rmq_new_tests.constant import QUEUE_NAME
+from tests.rmq_new_tests.constant import QUEUE_NAME, get_test_settings
 
 
 @pytest.fixture
 def rabbit_setup():
-    rmq_connection = PikaBlockingConnection(QUEUE_NAME)
+    reset_fake_brokers()
+    rmq_connection = PikaBlockingConnection(QUEUE_NAME, settings=get_test_settings().copy_to_dict())
     rmq_connection.rabbit_channel.queue_delete(QUEUE_NAME)
     queue = rmq_connection.rabbit_channel.queue_declare(queue=QUEUE_NAME, durable=True)
     for index in range(2):
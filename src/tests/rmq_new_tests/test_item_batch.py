@@ -0,0 +1,108 @@
+import json
+from types import SimpleNamespace
+
+import pika
+import pytest
+from twisted.internet import task
+
+from rmq.utils import ItemBatcher, unpack_message
+from rmq.utils import item_batch
+from rmq.utils.item_batch import (
+    BATCH_CODEC_HEADER,
+    BATCH_COUNT_HEADER,
+    batch_item_count,
+    build_batch_properties,
+    split_batch,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(item_batch, "reactor", clock)
+    return clock
+
+
+def make_batcher(max_count=3, max_bytes=1024, linger=0.2, can_publish=lambda: True):
+    published = []
+    batcher = ItemBatcher(
+        lambda body, properties: published.append((body, properties)),
+        max_count=max_count,
+        max_bytes=max_bytes,
+        linger=linger,
+        can_publish=can_publish,
+    )
+    return batcher, published
+
+
+class TestUnpackMessage:
+    def test_single_message(self):
+        assert unpack_message(b'{"id": 1}') == [{"id": 1}]
+
+    def test_batch_round_trip(self):
+        messages = [json.dumps({"id": index}) for index in range(3)]
+        properties = build_batch_properties(len(messages))
+        body = item_batch.pack_messages(messages).encode("utf-8")
+
+        assert unpack_message(body, properties) == [{"id": 0}, {"id": 1}, {"id": 2}]
+        assert batch_item_count(properties) == 3
+        assert split_batch(body, properties) == messages
+
+    def test_unsupported_codec(self):
+        properties = pika.BasicProperties(headers={BATCH_CODEC_HEADER: "gzip"})
+        with pytest.raises(ValueError, match="Unsupported batch codec"):
+            unpack_message(b"", properties)
+
+    def test_count_mismatch(self):
+        properties = build_batch_properties(3)
+        properties.headers[BATCH_COUNT_HEADER] = 3
+        with pytest.raises(ValueError, match="Batch is corrupted"):
+            unpack_message(b'{"id": 1}\n{"id": 2}', properties)
+
+
+class TestItemBatcher:
+    def test_batch_is_published_when_count_is_reached(self, clock):
+        batcher, published = make_batcher(max_count=2)
+        batcher.add('{"id": 1}')
+        assert published == []
+        batcher.add('{"id": 2}')
+
+        assert len(published) == 1
+        body, properties = published[0]
+        assert unpack_message(body, properties) == [{"id": 1}, {"id": 2}]
+        assert len(batcher) == 0
+
+    def test_batch_is_published_before_bytes_limit_is_exceeded(self, clock):
+        batcher, published = make_batcher(max_count=10, max_bytes=20)
+        batcher.add('{"id": 1}')
+        batcher.add('{"id": 22222222}')
+
+        assert [batch_item_count(properties) for _, properties in published] == [1]
+        assert len(batcher) == 1
+
+    def test_batch_is_published_on_linger(self, clock):
+        batcher, published = make_batcher(linger=0.2)
+        batcher.add('{"id": 1}')
+        clock.advance(0.1)
+        assert published == []
+        clock.advance(0.1)
+        assert len(published) == 1
+
+    def test_linger_is_restarted_while_publishing_is_not_allowed(self, clock):
+        can_publish = SimpleNamespace(value=False)
+        batcher, published = make_batcher(linger=0.2, can_publish=lambda: can_publish.value)
+        batcher.add('{"id": 1}')
+        clock.advance(0.2)
+        assert published == []
+
+        can_publish.value = True
+        clock.advance(0.2)
+        assert len(published) == 1
+
+    def test_flush_cancels_linger(self, clock):
+        batcher, published = make_batcher()
+        batcher.add('{"id": 1}')
+        batcher.flush()
+        clock.advance(1)
+        assert len(published) == 1
+        assert clock.getDelayedCalls() == []
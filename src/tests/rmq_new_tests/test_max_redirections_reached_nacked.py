@@ -6,14 +6,13 @@ from scrapy import Request
 from scrapy.crawler import CrawlerProcess
 from scrapy.http import TextResponse
 from scrapy.signalmanager import dispatcher
-from scrapy.utils.project import get_project_settings
 
 from rmq.utils import get_import_full_name
 from rmq_alternative.rmq_spider import RmqSpider
 from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
 from rmq_alternative.utils import signals as CustomSignals
 from rmq_alternative.utils.pika_blocking_connection import PikaBlockingConnection
-from tests.rmq_new_tests.constant import QUEUE_NAME
+from tests.rmq_new_tests.constant import QUEUE_NAME, get_test_settings
 
 
 class Response301DownloaderMiddleware:
@@ -25,7 +24,7 @@ class Response301DownloaderMiddleware:
 
 @pytest.fixture
 def crawler():
-    settings = get_project_settings()
+    settings = get_test_settings()
     custom_settings = {
         "DOWNLOADER_MIDDLEWARES": {
             get_import_full_name(Response301DownloaderMiddleware): 1,
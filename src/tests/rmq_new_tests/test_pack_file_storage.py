@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+import pytest
+
+from utils import PackFileStorage
+from utils.pack_file_storage import RECORD_HEADER
+
+
+@pytest.fixture
+def folder(tmp_path):
+    return str(tmp_path / 'packs')
+
+
+@pytest.fixture
+def storage(folder):
+    storage = PackFileStorage(folder, max_pack_size=1024)
+    yield storage
+    storage.close()
+
+
+def test_content_is_stored_once_by_hash(storage):
+    file_id, is_stored = storage.put(b'cover')
+    duplicate_id, is_duplicate_stored = storage.put(b'cover')
+
+    assert file_id == duplicate_id == hashlib.sha256(b'cover').hexdigest()
+    assert (is_stored, is_duplicate_stored) == (True, False)
+    assert storage.get(file_id) == b'cover'
+    assert (storage.stored_count, storage.duplicates_count) == (1, 1)
+    with pytest.raises(KeyError):
+        storage.get(hashlib.sha256(b'missing').hexdigest())
+
+
+def test_packs_are_rolled_by_size(storage):
+    # two records (with headers) fit into pack
+    file_ids = [storage.put(bytes([index]) * 400)[0] for index in range(5)]
+
+    assert storage.pack_numbers() == [1, 2, 3]
+    assert [storage.get(file_id) for file_id in file_ids] == [bytes([index]) * 400 for index in range(5)]
+
+
+@pytest.mark.parametrize('merge', [False, True])
+def test_index_is_restored_on_reopen(folder, merge):
+    storage = PackFileStorage(folder, max_pack_size=1024)
+    file_ids = [storage.put(b'file-%d' % index)[0] for index in range(10)]
+    storage.delete(file_ids[0])
+    if merge:
+        storage.merge_index()
+    storage.close()
+
+    storage = PackFileStorage(folder, max_pack_size=1024)
+    try:
+        assert not storage.contains(file_ids[0])
+        assert [storage.get(file_id) for file_id in file_ids[1:]] == [b'file-%d' % index for index in range(1, 10)]
+        assert storage.put(b'file-1') == (file_ids[1], False)
+    finally:
+        storage.close()
+
+
+def test_readonly_storage_reads_while_writer_is_open(storage, folder):
+    file_id, _ = storage.put(b'cover')
+
+    reader = PackFileStorage(folder, readonly=True)
+    try:
+        assert reader.get(file_id) == b'cover'
+    finally:
+        reader.close()
+
+
+def test_second_writer_is_rejected(storage, folder):
+    with pytest.raises(RuntimeError):
+        PackFileStorage(folder)
+
+
+def test_compaction_removes_deleted_records(storage):
+    file_ids = [storage.put(bytes([index]) * 300)[0] for index in range(6)]
+    for file_id in file_ids[::2]:
+        storage.delete(file_id)
+    old_packs = storage.pack_numbers()
+
+    stats = storage.compact(min_garbage_ratio=0.3)
+
+    assert stats['packs_compacted'] == len(old_packs)
+    assert stats['records_moved'] == 3
+    assert stats['bytes_reclaimed'] == 3 * (RECORD_HEADER.size + 300)
+    assert not set(old_packs) & set(storage.pack_numbers())
+    assert [storage.contains(file_id) for file_id in file_ids] == [False, True] * 3
+    assert [storage.get(file_id) for file_id in file_ids[1::2]] == [bytes([index]) * 300 for index in (1, 3, 5)]
+    assert os.path.getsize(os.path.join(storage.folder, storage.log_index_filename)) == 0
+
+
+def test_torn_tail_of_crashed_run_is_truncated(folder):
+    storage = PackFileStorage(folder)
+    file_id, _ = storage.put(b'cover')
+    pack_path = storage._pack_path(storage.pack_numbers()[-1])
+    storage.close()
+    pack_size = os.path.getsize(pack_path)
+    with open(pack_path, 'ab') as file:
+        file.write(b'PKR1' + b'\x00' * 10)
+    with open(os.path.join(folder, PackFileStorage.log_index_filename), 'ab') as file:
+        file.write(b'\x01' * 7)
+
+    storage = PackFileStorage(folder)
+    try:
+        assert os.path.getsize(pack_path) == pack_size
+        other_id, _ = storage.put(b'other cover')
+        assert storage.get(file_id) == b'cover'
+        assert storage.get(other_id) == b'other cover'
+        assert [digest.hex() for digest, _, _ in storage.scan_pack(1)] == [file_id, other_id]
+    finally:
+        storage.close()
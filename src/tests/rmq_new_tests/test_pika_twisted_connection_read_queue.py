@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pika
+from twisted.internet import defer
+
+from rmq.connections.pika_twisted_connection import PikaTwistedConnection
+
+
+class FakeQueue:
+    """ClosableDeferredQueue stand-in: get() returns pending deferred when queue is empty"""
+
+    def __init__(self):
+        self.messages = []
+        self.waiting = []
+
+    def put(self, message):
+        if self.waiting:
+            self.waiting.pop(0).callback(message)
+        else:
+            self.messages.append(message)
+
+    def get(self):
+        if self.messages:
+            return defer.succeed(self.messages.pop(0))
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+
+class RaisingOwner:
+    def __init__(self):
+        self.delivery_tags = []
+
+    def on_message_consumed(self, msg_object):
+        self.delivery_tags.append(msg_object["method"].delivery_tag)
+        if msg_object["body"] == b"fail":
+            raise ValueError("owner failed")
+
+
+def make_message(delivery_tag, body):
+    return SimpleNamespace(
+        channel=None,
+        method=SimpleNamespace(delivery_tag=delivery_tag),
+        properties=None,
+        body=body,
+    )
+
+
+def make_connection(owner):
+    connection = PikaTwistedConnection(pika.ConnectionParameters(), "queue", owner, is_consumer=True)
+    connection._consuming = True
+    return connection
+
+
+class TestReadQueue:
+    def test_owner_error_on_waiting_delivery_keeps_consuming(self):
+        owner = RaisingOwner()
+        connection = make_connection(owner)
+        queue = FakeQueue()
+        connection._read_queue(queue)
+
+        queue.put(make_message(1, b"fail"))
+        queue.put(make_message(2, b"ok"))
+
+        assert owner.delivery_tags == [1, 2]
+        assert len(queue.waiting) == 1
+
+    def test_owner_error_on_drained_delivery_keeps_consuming(self):
+        owner = RaisingOwner()
+        connection = make_connection(owner)
+        queue = FakeQueue()
+        queue.messages = [make_message(1, b"ok"), make_message(2, b"fail"), make_message(3, b"ok")]
+        connection._read_queue(queue)
+
+        assert owner.delivery_tags == [1, 2, 3]
+        assert len(queue.waiting) == 1
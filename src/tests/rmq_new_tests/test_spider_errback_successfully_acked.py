@@ -6,7 +6,6 @@ from scrapy import Request
 from scrapy.crawler import CrawlerProcess
 from scrapy.http import HtmlResponse
 from scrapy.signalmanager import dispatcher
-from scrapy.utils.project import get_project_settings
 from twisted.python.failure import Failure
 
 from rmq.utils import get_import_full_name
@@ -14,7 +13,7 @@ from rmq_alternative.rmq_spider import RmqSpider
 from rmq_alternative.schemas.messages.base_rmq_message import BaseRmqMessage
 from rmq_alternative.utils import signals as CustomSignals
 from rmq_alternative.utils.pika_blocking_connection import PikaBlockingConnection
-from tests.rmq_new_tests.constant import QUEUE_NAME
+from tests.rmq_new_tests.constant import QUEUE_NAME, get_test_settings
 
 
 class Response400DownloaderMiddleware:
@@ -24,7 +23,7 @@ class Response400DownloaderMiddleware:
 
 @pytest.fixture
 def crawler():
-    settings = get_project_settings()
+    settings = get_test_settings()
     custom_settings = {
         "DOWNLOADER_MIDDLEWARES": {
             get_import_full_name(Response400DownloaderMiddleware): 1,
@@ -0,0 +1,57 @@
+import os
+
+from rmq.utils import SpillingBuffer
+
+
+def drain(buffer):
+    return [buffer.popleft() for _ in range(len(buffer))]
+
+
+class TestSpillingBuffer:
+    def test_overflow_is_spilled_and_replayed_in_order(self, tmp_path):
+        buffer = SpillingBuffer(memory_limit=2, spill_limit_bytes=1024, spill_dir=str(tmp_path))
+        messages = [f'{{"id": {index}}}' for index in range(7)]
+        assert all(buffer.append(message) for message in messages)
+        assert len(buffer) == 7
+        assert buffer.spilled_bytes > 0
+
+        assert drain(buffer) == messages
+        assert buffer.spilled_bytes == 0
+
+    def test_new_messages_follow_spilled_ones(self, tmp_path):
+        buffer = SpillingBuffer(memory_limit=1, spill_limit_bytes=1024, spill_dir=str(tmp_path))
+        for message in ("a", "b", "c"):
+            buffer.append(message)
+        assert buffer.popleft() == "a"
+        # memory has room again, but "d" must not overtake spilled "b" and "c"
+        buffer.append("d")
+        assert drain(buffer) == ["b", "c", "d"]
+
+    def test_append_is_rejected_when_spill_limit_is_reached(self, tmp_path):
+        buffer = SpillingBuffer(memory_limit=1, spill_limit_bytes=8, spill_dir=str(tmp_path))
+        assert buffer.append("a")
+        assert buffer.append("bbbb")
+        assert buffer.is_full()
+        assert buffer.append("c") is False
+        assert drain(buffer) == ["a", "bbbb"]
+
+    def test_spilling_is_disabled_without_spill_limit(self):
+        buffer = SpillingBuffer(memory_limit=1)
+        assert buffer.append("a")
+        assert buffer.append("b") is False
+
+    def test_requeued_messages_go_to_head(self, tmp_path):
+        buffer = SpillingBuffer(memory_limit=2, spill_limit_bytes=1024, spill_dir=str(tmp_path))
+        buffer.append("c")
+        buffer.requeue(["a", "b"])
+        assert drain(buffer) == ["a", "b", "c"]
+
+    def test_close_removes_segment(self, tmp_path):
+        buffer = SpillingBuffer(memory_limit=1, spill_limit_bytes=1024, spill_dir=str(tmp_path))
+        buffer.append("a")
+        buffer.append("b")
+        assert os.listdir(tmp_path)
+
+        buffer.close()
+        assert os.listdir(tmp_path) == []
+        assert len(buffer) == 1
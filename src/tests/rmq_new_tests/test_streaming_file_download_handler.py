@@ -0,0 +1,110 @@
+import io
+import os
+
+import pytest
+from scrapy import Request, signals
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.http_headers import Headers
+
+from utils.handlers import streaming_file_download_handler
+from utils.handlers.streaming_file_download_handler import (DOWNLOADED_FILE_META_KEY, STREAM_TO_FILE_META_KEY,
+                                                            StreamingFileDownloadHandler, StreamingScrapyAgent,
+                                                            TemporaryFileBuffer)
+
+
+class FakeTxResponse:
+    def __init__(self, code: int):
+        self.code = code
+        self.length = 10
+        self.headers = Headers({'Content-Type': ['application/pdf']})
+        self.readers = []
+
+    def deliverBody(self, reader):
+        self.readers.append(reader)
+
+
+@pytest.fixture
+def temp_folder(tmp_path):
+    return str(tmp_path / 'downloads')
+
+
+@pytest.fixture
+def crawler(temp_folder):
+    return get_crawler(settings_dict={'DOWNLOAD_STREAMING_TEMP_FOLDER': temp_folder})
+
+
+@pytest.fixture
+def handler(crawler):
+    return StreamingFileDownloadHandler(crawler.settings, crawler)
+
+
+def make_agent(handler, crawler):
+    return StreamingScrapyAgent(
+        buffers=handler._buffers,
+        temp_folder=handler._temp_folder,
+        contextFactory=handler._contextFactory,
+        pool=handler._pool,
+        crawler=crawler,
+    )
+
+
+def stream_request(**meta):
+    return Request('https://example.com/book.pdf', meta={STREAM_TO_FILE_META_KEY: True, **meta})
+
+
+def test_success_body_is_streamed_to_file(handler, crawler, temp_folder):
+    request = stream_request()
+    txresponse = FakeTxResponse(200)
+
+    make_agent(handler, crawler)._cb_bodyready(txresponse, request)
+
+    buffer = txresponse.readers[0]._bodybuf
+    assert isinstance(buffer, TemporaryFileBuffer)
+    assert request.meta[DOWNLOADED_FILE_META_KEY] == buffer.path
+    assert os.listdir(temp_folder) == [os.path.basename(buffer.path)]
+    buffer.discard()
+
+
+@pytest.mark.parametrize('status', [301, 404, 503])
+def test_redirect_and_error_bodies_are_not_streamed(handler, crawler, temp_folder, status):
+    request = stream_request()
+    txresponse = FakeTxResponse(status)
+
+    make_agent(handler, crawler)._cb_bodyready(txresponse, request)
+
+    assert isinstance(txresponse.readers[0]._bodybuf, io.BytesIO)
+    assert DOWNLOADED_FILE_META_KEY not in request.meta
+    assert handler._buffers == {}
+    assert os.listdir(temp_folder) == []
+
+
+def test_path_of_previous_download_is_not_kept(handler, monkeypatch):
+    # request.replace copies meta of redirected/retried request
+    request = stream_request(**{DOWNLOADED_FILE_META_KEY: '/tmp/download-previous.part'})
+    kept_paths = []
+
+    def download_request(agent, agent_request):
+        kept_paths.append(agent_request.meta.get(DOWNLOADED_FILE_META_KEY))
+        return defer.succeed(Response(agent_request.url, request=agent_request))
+
+    monkeypatch.setattr(streaming_file_download_handler.StreamingScrapyAgent, 'download_request', download_request)
+
+    handler.download_request(request, spider=None)
+
+    assert kept_paths == [None]
+
+
+def test_file_is_removed_when_callback_raises(handler, crawler, temp_folder):
+    buffer = TemporaryFileBuffer(temp_folder)
+    buffer.getvalue()
+    request = stream_request(**{DOWNLOADED_FILE_META_KEY: buffer.path})
+    response = Response(request.url, request=request)
+
+    crawler.signals.send_catch_log(
+        signal=signals.spider_error, failure=Failure(ValueError('parse failed')), response=response, spider=None
+    )
+
+    assert not os.path.exists(buffer.path)
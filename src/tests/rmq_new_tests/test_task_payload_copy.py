@@ -0,0 +1,63 @@
+import json
+from types import SimpleNamespace
+
+import pika
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from rmq.extensions import RPCTaskConsumer
+from rmq.utils import RMQConstants, TaskObserver
+
+MSG_BODY_META_KEY = RMQConstants.MSG_BODY_META_KEY.value
+
+
+class FakeConnection:
+    def __init__(self):
+        self.published = []
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def acknowledge_message(self, delivery_tag, multiple=False):
+        pass
+
+    def negative_acknowledge_message(self, delivery_tag, requeue=True):
+        pass
+
+    def publish_message(self, message, queue_name):
+        self.published.append((queue_name, json.loads(message)))
+
+
+class Spider:
+    def __init__(self):
+        self.processing_tasks = TaskObserver()
+        self.requests = []
+
+    def next_request(self, delivery_tag, body):
+        return Request("https://example.com")
+
+
+def test_mutated_request_meta_does_not_change_reply_payload():
+    crawler = get_crawler()
+    crawler.stats.open_spider(None)
+    crawler.engine = SimpleNamespace(crawl=lambda request: spider.requests.append(request))
+    consumer = RPCTaskConsumer(crawler)
+    spider = Spider()
+    consumer._RPCTaskConsumer__spider = spider
+    consumer.rmq_connection = FakeConnection()
+
+    consumer.on_basic_get_message({
+        "method": pika.spec.Basic.Deliver(delivery_tag=1),
+        "properties": pika.BasicProperties(reply_to="replies"),
+        "body": b'{"url": "https://example.com", "tags": ["a"]}',
+    })
+    msg_body = spider.requests[0].meta[MSG_BODY_META_KEY]
+    msg_body["url"] = "https://example.com/changed"
+    msg_body["tags"].append("b")
+
+    consumer._reply(spider.processing_tasks.get_task(1))
+
+    queue_name, reply = consumer.rmq_connection.published[0]
+    assert queue_name == "replies"
+    assert reply["url"] == "https://example.com"
+    assert reply["tags"] == ["a"]
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
 from .logger_mixin import LoggerMixin
 from .mysql_connection_string import mysql_connection_string
-from .file_saver import FileSaver
+from .file_saver import ContentAddressedFileSaver, FileSaver, PackFileSaver
+from .pack_file_storage import PackFileStorage
+from .proxy_pool import ProxyPool, ProxyState
@@ -1,8 +1,13 @@
 import cgi
+import hashlib
 import mimetypes
 import os
 import pathlib
 import re
+import shutil
+import sqlite3
+import tempfile
+import threading
 from html import unescape
 from typing import Optional, Tuple
 from uuid import uuid4
@@ -10,6 +15,33 @@ from urllib.parse import unquote
 
 from furl import furl
 from scrapy.http import Response
+from twisted.internet import reactor, threads
+from twisted.internet.defer import Deferred
+from twisted.python.threadpool import ThreadPool
+
+from .pack_file_storage import PackFileStorage
+
+
+def parse_original_filename(response: Response) -> str:
+    if 'Content-Type' in response.headers:
+        content_type: str = response.headers['Content-Type'].decode()
+        if content_type.startswith('image/') or \
+           content_type.startswith('audio/') or \
+           content_type.startswith('application/pdf'):
+            raw_filename: str = furl(response.url).path.segments[-1]
+            raw_filename = re.search('^[^?;#.]*', raw_filename).group() + mimetypes.guess_extension(content_type)
+        else:
+            raise Exception('Unsupported content type')
+    elif 'Content-Disposition' in response.headers:
+        _, params = cgi.parse_header(response.headers['Content-Disposition'].decode())
+        if 'filename*' in params:
+            raw_filename: str = unquote(unescape(params['filename*'])).lstrip("utf-8''")
+        else:
+            raw_filename: str = unescape(params['filename'])
+    else:
+        raise Exception('Unsupported file type')
+
+    return re.sub('[~/]', '_', raw_filename)
 
 
 class FileSaver:
@@ -73,38 +105,158 @@ class FileSaver:
         filename_prefix: str = '',
         filename: Optional[str] = None
     ) -> Tuple[str, str]:
-        if 'Content-Type' in response.headers:
-            content_type: str = response.headers['Content-Type'].decode()
-            if content_type.startswith('image/') or \
-               content_type.startswith('audio/') or \
-               content_type.startswith('application/pdf'):
-                raw_filename: str = furl(response.url).path.segments[-1]
-                raw_filename = re.search('^[^?;#.]*', raw_filename).group() + mimetypes.guess_extension(content_type)
-            else:
-                raise Exception('Unsupported content type')
-        elif 'Content-Disposition' in response.headers:
-            _, params = cgi.parse_header(response.headers['Content-Disposition'].decode())
-            if 'filename*' in params:
-                raw_filename: str = unquote(unescape(params['filename*'])).lstrip("utf-8''")
-            else:
-                raw_filename: str = unescape(params['filename'])
-        else:
-            raise Exception('Unsupported file type')
+        original_filename = parse_original_filename(response)
+        path_to_file = self._get_path_to_file(original_filename, filename_prefix, filename)
+
+        with open(path_to_file, 'wb') as writer:
+            writer.write(response.body)
+
+        self._on_file_saved()
+        return path_to_file, original_filename
+
+    def save_downloaded_file(
+        self,
+        response: Response,
+        downloaded_file_path: str,
+        filename_prefix: str = '',
+        filename: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """Moves file downloaded by StreamingFileDownloadHandler (body isn't in response) to bucket"""
+        original_filename = parse_original_filename(response)
+        path_to_file = self._get_path_to_file(original_filename, filename_prefix, filename)
 
-        original_filename = re.sub('[~/]', '_', raw_filename)
+        shutil.move(downloaded_file_path, path_to_file)
+
+        self._on_file_saved()
+        return path_to_file, original_filename
+
+    def _get_path_to_file(self, original_filename: str, filename_prefix: str, filename: Optional[str]) -> str:
         file_type = pathlib.Path(original_filename).suffix
 
         if not filename:
             filename: str = str(uuid4().hex)
         filename = filename_prefix + filename
 
-        path_to_file: str = os.path.join(self.select_folder, f'{filename}{file_type}')
-
-        with open(path_to_file, 'wb') as writer:
-            writer.write(response.body)
+        return os.path.join(self.select_folder, f'{filename}{file_type}')
 
+    def _on_file_saved(self) -> None:
         self._increment_folder_size()
         if self._is_folder_full():
             self._change_folder()
 
-        return path_to_file, original_filename
+
+class ContentAddressedFileSaver:
+    """Stores files by sha256 of content: <base_folder>/<ab>/<cd>/<sha256><ext>.
+
+    Writes are done on dedicated thread pool, save_file returns Deferred. Content which is
+    already stored (by sqlite hash index) is not written again, so repeated files share one copy.
+    """
+
+    index_filename: str = '.content_index.sqlite3'
+
+    def __init__(self, base_folder: str, max_threads: int = 4):
+        self.base_folder: str = os.path.abspath(base_folder)
+        os.makedirs(self.base_folder, exist_ok=True)
+        self.stored_count: int = 0
+        self.duplicates_count: int = 0
+
+        self._index_lock = threading.Lock()
+        self.open_storage()
+        self.thread_pool = ThreadPool(minthreads=1, maxthreads=max_threads, name='ContentAddressedFileSaver')
+        self.thread_pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', self.close)
+
+    def save_file(self, response: Response) -> Deferred:
+        """Deferred fires with (path_to_file, original_filename)"""
+        original_filename = parse_original_filename(response)
+        file_type = pathlib.Path(original_filename).suffix
+        d = threads.deferToThreadPool(reactor, self.thread_pool, self._store, response.body, file_type)
+        d.addCallback(lambda path_to_file: (path_to_file, original_filename))
+        return d
+
+    def open_storage(self) -> None:
+        # connection is shared by pool threads, access is serialized by index lock
+        self._index = sqlite3.connect(
+            os.path.join(self.base_folder, self.index_filename), isolation_level=None, check_same_thread=False
+        )
+        self._index.execute('PRAGMA journal_mode=WAL')
+        self._index.execute('PRAGMA synchronous=NORMAL')
+        self._index.execute('CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, path TEXT NOT NULL)')
+
+    def close_storage(self) -> None:
+        with self._index_lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def get_path(self, content_hash: str, file_type: str) -> str:
+        return os.path.join(self.base_folder, content_hash[:2], content_hash[2:4], f'{content_hash}{file_type}')
+
+    def _store(self, body: bytes, file_type: str) -> str:
+        content_hash = hashlib.sha256(body).hexdigest()
+        with self._index_lock:
+            row = self._index.execute('SELECT path FROM files WHERE hash = ?', (content_hash,)).fetchone()
+            if row is not None:
+                self.duplicates_count += 1
+        if row is not None:
+            return os.path.join(self.base_folder, row[0])
+
+        path_to_file = self.get_path(content_hash, file_type)
+        folder = os.path.dirname(path_to_file)
+        os.makedirs(folder, exist_ok=True)
+        # same content may be saved concurrently: file is replaced atomically with equal content
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as writer:
+                writer.write(body)
+            os.replace(tmp_path, path_to_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._index_lock:
+            cursor = self._index.execute(
+                'INSERT OR IGNORE INTO files (hash, path) VALUES (?, ?)',
+                (content_hash, os.path.relpath(path_to_file, self.base_folder)),
+            )
+            # same content saved concurrently by other thread is indexed already
+            if cursor.rowcount:
+                self.stored_count += 1
+            else:
+                self.duplicates_count += 1
+        return path_to_file
+
+    def close(self) -> None:
+        if self.thread_pool.started:
+            self.thread_pool.stop()
+        self.close_storage()
+
+
+class PackFileSaver(ContentAddressedFileSaver):
+    """Appends files to rolling pack files of PackFileStorage instead of one file per content.
+
+    save_file fires with (file id + extension, original_filename), content is read by
+    storage.get(file id). Only one process may write to base_folder.
+    """
+
+    def __init__(self, base_folder: str, max_pack_size: int = 1024 ** 3, max_threads: int = 4):
+        self.max_pack_size: int = max_pack_size
+        super().__init__(base_folder, max_threads)
+
+    def open_storage(self) -> None:
+        self.storage = PackFileStorage(self.base_folder, self.max_pack_size)
+
+    def close_storage(self) -> None:
+        with self._index_lock:
+            if self.storage is not None:
+                self.storage.close()
+                self.storage = None
+
+    def _store(self, body: bytes, file_type: str) -> str:
+        file_id, is_stored = self.storage.put(body)
+        with self._index_lock:
+            if is_stored:
+                self.stored_count += 1
+            else:
+                self.duplicates_count += 1
+        return f'{file_id}{file_type}'
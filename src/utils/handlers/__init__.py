@@ -1 +1,6 @@
 from .rotating_proxies_download_handler import RotatingProxiesDownloadHandler
+from .streaming_file_download_handler import (
+    DOWNLOADED_FILE_META_KEY,
+    STREAM_TO_FILE_META_KEY,
+    StreamingFileDownloadHandler,
+)
@@ -0,0 +1,127 @@
+import logging
+import os
+import tempfile
+from typing import Dict
+
+from scrapy import Spider, Request, signals
+from scrapy.core.downloader.handlers.http11 import ScrapyAgent
+from scrapy.core.downloader.handlers.http import HTTPDownloadHandler
+
+
+# custom_settings = {
+#     "DOWNLOAD_HANDLERS": {
+#         'http': 'utils.handlers.StreamingFileDownloadHandler',
+#         'https': 'utils.handlers.StreamingFileDownloadHandler'
+#     },
+# }
+# Request(url, meta={STREAM_TO_FILE_META_KEY: True}): body of 2xx response is empty,
+# downloaded file path is response.meta[DOWNLOADED_FILE_META_KEY] (see FileSaver.save_downloaded_file).
+# Bodies of redirects and error responses are read into memory as usual
+
+STREAM_TO_FILE_META_KEY = 'stream_to_file'
+DOWNLOADED_FILE_META_KEY = 'downloaded_file_path'
+
+
+class TemporaryFileBuffer:
+    """BytesIO replacement for scrapy response reader: received chunks are written to temporary file,
+    so memory used by download is bounded by file buffer size"""
+
+    def __init__(self, folder: str):
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix='download-', suffix='.part')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+
+    def truncate(self, size: int) -> None:
+        # download max size is exceeded
+        self._file.seek(size)
+        self._file.truncate(size)
+
+    def getvalue(self) -> bytes:
+        """Called once, when response is finished: response body is empty"""
+        self._file.close()
+        return b''
+
+    def discard(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingScrapyAgent(ScrapyAgent):
+    def __init__(self, *, buffers: Dict[Request, TemporaryFileBuffer], temp_folder: str, **kwargs):
+        super().__init__(**kwargs)
+        self._buffers = buffers
+        self._temp_folder = temp_folder
+
+    def _cb_bodyready(self, txresponse, request):
+        if not 200 <= txresponse.code < 300:
+            return super()._cb_bodyready(txresponse, request)
+        deliver_body = txresponse.deliverBody
+
+        def deliver_body_to_file(reader):
+            buffer = TemporaryFileBuffer(self._temp_folder)
+            self._buffers[request] = buffer
+            request.meta[DOWNLOADED_FILE_META_KEY] = buffer.path
+            reader._bodybuf = buffer
+            deliver_body(reader)
+
+        txresponse.deliverBody = deliver_body_to_file
+        return super()._cb_bodyready(txresponse, request)
+
+
+class StreamingFileDownloadHandler(HTTPDownloadHandler):
+    """Streams bodies of requests with STREAM_TO_FILE_META_KEY meta to temporary files.
+
+    Temporary file is removed if download fails or request callback raises,
+    otherwise it is owned by spider.
+    """
+
+    logger = logging.getLogger(name=__name__)
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        self._temp_folder = settings.get('DOWNLOAD_STREAMING_TEMP_FOLDER') or tempfile.gettempdir()
+        os.makedirs(self._temp_folder, exist_ok=True)
+        self._buffers: Dict[Request, TemporaryFileBuffer] = {}
+        if crawler is not None:
+            crawler.signals.connect(self._on_spider_error, signal=signals.spider_error)
+
+    def download_request(self, request: Request, spider: Spider):
+        if not request.meta.get(STREAM_TO_FILE_META_KEY):
+            return super().download_request(request, spider)
+        # body is not decompressed by HttpCompressionMiddleware: it isn't in response
+        request.headers['Accept-Encoding'] = 'identity'
+        # path of previous download is copied by request.replace (redirects, retries)
+        request.meta.pop(DOWNLOADED_FILE_META_KEY, None)
+        agent = StreamingScrapyAgent(
+            buffers=self._buffers,
+            temp_folder=self._temp_folder,
+            contextFactory=self._contextFactory,
+            pool=self._pool,
+            maxsize=getattr(spider, 'download_maxsize', self._default_maxsize),
+            warnsize=getattr(spider, 'download_warnsize', self._default_warnsize),
+            fail_on_dataloss=self._fail_on_dataloss,
+            crawler=self._crawler,
+        )
+        d = agent.download_request(request)
+        d.addCallbacks(self._on_downloaded, self._on_download_failed, [request], None, [request])
+        return d
+
+    def _on_downloaded(self, response, request: Request):
+        self._buffers.pop(request, None)
+        return response
+
+    def _on_download_failed(self, failure, request: Request):
+        buffer = self._buffers.pop(request, None)
+        if buffer is not None:
+            buffer.discard()
+            request.meta.pop(DOWNLOADED_FILE_META_KEY, None)
+        return failure
+
+    def _on_spider_error(self, failure, response, spider):
+        downloaded_file_path = response.meta.get(DOWNLOADED_FILE_META_KEY) if response.request else None
+        if downloaded_file_path and os.path.exists(downloaded_file_path):
+            os.remove(downloaded_file_path)
@@ -0,0 +1,311 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+# record: magic, sha256 digest, data length, data
+RECORD_HEADER = struct.Struct('<4s32sQ')
+RECORD_MAGIC = b'PKR1'
+# index entry: sha256 digest, pack number, data offset, data length
+INDEX_ENTRY = struct.Struct('<32sIQQ')
+TOMBSTONE_PACK = 0xFFFFFFFF
+
+Location = Tuple[int, int, int]
+
+
+class PackFileStorage:
+    """Files appended to rolling pack files (<folder>/pack-000001.pack ...), file id is sha256 of content.
+
+    Index maps file id to (pack, offset, length): recent entries are appended to index.log and kept
+    in memory, merged entries are kept in sorted index.sorted which is mmap-ed and binary searched.
+    Only one process may write to folder (lock file), readers open storage with readonly=True.
+    """
+
+    pack_filename_format: str = 'pack-{:06d}.pack'
+    pack_filename_pattern = re.compile(r'^pack-(\d{6})\.pack$')
+    sorted_index_filename: str = 'index.sorted'
+    log_index_filename: str = 'index.log'
+    lock_filename: str = '.lock'
+    # index.log is merged into index.sorted on close when it has more entries
+    merge_threshold: int = 100000
+
+    def __init__(self, folder: str, max_pack_size: int = 1024 ** 3, readonly: bool = False):
+        self.folder: str = os.path.abspath(folder)
+        self.max_pack_size: int = max_pack_size
+        self.readonly: bool = readonly
+        self.stored_count: int = 0
+        self.duplicates_count: int = 0
+        self._lock = threading.RLock()
+        self._readers: Dict[int, int] = {}
+        self._sorted_mmap: Optional[mmap.mmap] = None
+        self._recent: Dict[bytes, Location] = {}
+
+        if not readonly:
+            os.makedirs(self.folder, exist_ok=True)
+            self._lock_file = open(os.path.join(self.folder, self.lock_filename), 'a+')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise RuntimeError(f'Pack storage {self.folder} is used by another process')
+
+        self._open_sorted_index()
+        self._load_log_index()
+        if not readonly:
+            self._log_file = open(self._path(self.log_index_filename), 'ab')
+            pack_numbers = self.pack_numbers()
+            if pack_numbers:
+                self._truncate_torn_tail(pack_numbers[-1])
+            self._open_pack(pack_numbers[-1] if pack_numbers else 1)
+
+    def put(self, data: bytes) -> Tuple[str, bool]:
+        """Returns (file id, True if data is stored, False if same content is stored already)"""
+        digest = hashlib.sha256(data).digest()
+        with self._lock:
+            if self._lookup(digest) is not None:
+                self.duplicates_count += 1
+                return digest.hex(), False
+            self._append_record(digest, data)
+            self.stored_count += 1
+        return digest.hex(), True
+
+    def get(self, file_id: str) -> bytes:
+        location = self._lookup(bytes.fromhex(file_id))
+        if location is None:
+            raise KeyError(file_id)
+        pack_number, offset, length = location
+        return os.pread(self._reader(pack_number), length, offset)
+
+    def contains(self, file_id: str) -> bool:
+        return self._lookup(bytes.fromhex(file_id)) is not None
+
+    def delete(self, file_id: str) -> None:
+        """Data is removed from pack by compaction"""
+        digest = bytes.fromhex(file_id)
+        with self._lock:
+            if self._lookup(digest) is not None:
+                self._append_index(digest, (TOMBSTONE_PACK, 0, 0))
+
+    def pack_numbers(self) -> list:
+        return sorted(
+            int(match.group(1))
+            for match in map(self.pack_filename_pattern.match, os.listdir(self.folder))
+            if match
+        )
+
+    def scan_pack(self, pack_number: int) -> Iterator[Tuple[bytes, int, int]]:
+        """Yields (digest, data offset, data length) of pack records, torn tail record is skipped"""
+        fd = self._reader(pack_number)
+        pack_size = os.fstat(fd).st_size
+        offset = 0
+        while offset + RECORD_HEADER.size <= pack_size:
+            magic, digest, length = RECORD_HEADER.unpack(os.pread(fd, RECORD_HEADER.size, offset))
+            data_offset = offset + RECORD_HEADER.size
+            if magic != RECORD_MAGIC or data_offset + length > pack_size:
+                break
+            yield digest, data_offset, length
+            offset = data_offset + length
+
+    def compact(self, min_garbage_ratio: float = 0.3) -> Dict[str, int]:
+        """Rewrites live records of packs with garbage (deleted/duplicate/torn records) share of
+        at least min_garbage_ratio to current pack and removes these packs"""
+        stats = {'packs_compacted': 0, 'records_moved': 0, 'bytes_reclaimed': 0}
+        with self._lock:
+            # current pack is not compacted: records are moved to new pack
+            self._roll_pack()
+            compacted = []
+            for pack_number in self.pack_numbers():
+                if pack_number == self._pack_number:
+                    continue
+                pack_size = os.fstat(self._reader(pack_number)).st_size
+                live = [
+                    (digest, offset, length)
+                    for digest, offset, length in self.scan_pack(pack_number)
+                    if self._lookup(digest) == (pack_number, offset, length)
+                ]
+                live_size = sum(RECORD_HEADER.size + length for _, _, length in live)
+                # empty pack is left by compaction which had nothing to move
+                if pack_size and (pack_size - live_size) / pack_size < min_garbage_ratio:
+                    continue
+                for digest, offset, length in live:
+                    data = os.pread(self._reader(pack_number), length, offset)
+                    self._append_record(digest, data)
+                stats['packs_compacted'] += 1
+                stats['records_moved'] += len(live)
+                stats['bytes_reclaimed'] += pack_size - live_size
+                compacted.append(pack_number)
+            # moved records must be durable before old packs are removed
+            self.sync()
+            for pack_number in compacted:
+                os.close(self._readers.pop(pack_number))
+                os.remove(self._pack_path(pack_number))
+            self.merge_index()
+        return stats
+
+    def merge_index(self) -> None:
+        """Merges index.log into index.sorted (tombstones are dropped)"""
+        with self._lock:
+            recent = sorted(self._recent.items())
+            tmp_path = self._path(f'{self.sorted_index_filename}.tmp')
+            with open(tmp_path, 'wb') as file:
+                for digest, location in self._merge_entries(recent):
+                    if location[0] != TOMBSTONE_PACK:
+                        file.write(INDEX_ENTRY.pack(digest, *location))
+                file.flush()
+                os.fsync(file.fileno())
+            self._close_sorted_index()
+            os.replace(tmp_path, self._path(self.sorted_index_filename))
+            self._open_sorted_index()
+            # log entries replayed after crash before truncation are equal to merged ones
+            self._log_file.truncate(0)
+            self._recent = {}
+
+    def sync(self) -> None:
+        with self._lock:
+            for file in (self._pack_file, self._log_file):
+                file.flush()
+                os.fsync(file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if not self.readonly:
+                self.sync()
+                if len(self._recent) > self.merge_threshold:
+                    self.merge_index()
+                self._pack_file.close()
+                self._log_file.close()
+                self._lock_file.close()
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers = {}
+            self._close_sorted_index()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.folder, filename)
+
+    def _pack_path(self, pack_number: int) -> str:
+        return self._path(self.pack_filename_format.format(pack_number))
+
+    def _open_pack(self, pack_number: int) -> None:
+        self._pack_number = pack_number
+        self._pack_file = open(self._pack_path(pack_number), 'ab')
+        self._pack_size = self._pack_file.tell()
+
+    def _truncate_torn_tail(self, pack_number: int) -> None:
+        """Torn record of crashed run is removed, so records appended after it stay scannable
+        (it is not indexed: index entry is written after record)"""
+        valid_size = 0
+        for _digest, offset, length in self.scan_pack(pack_number):
+            valid_size = offset + length
+        if valid_size != os.fstat(self._reader(pack_number)).st_size:
+            os.truncate(self._pack_path(pack_number), valid_size)
+
+    def _roll_pack(self) -> None:
+        self._pack_file.flush()
+        os.fsync(self._pack_file.fileno())
+        self._pack_file.close()
+        self._open_pack(self._pack_number + 1)
+
+    def _append_record(self, digest: bytes, data: bytes) -> None:
+        record_size = RECORD_HEADER.size + len(data)
+        if self._pack_size and self._pack_size + record_size > self.max_pack_size:
+            self._roll_pack()
+        self._pack_file.write(RECORD_HEADER.pack(RECORD_MAGIC, digest, len(data)))
+        self._pack_file.write(data)
+        # record is visible to pread readers before it is indexed
+        self._pack_file.flush()
+        location = (self._pack_number, self._pack_size + RECORD_HEADER.size, len(data))
+        self._pack_size += record_size
+        self._append_index(digest, location)
+
+    def _append_index(self, digest: bytes, location: Location) -> None:
+        self._log_file.write(INDEX_ENTRY.pack(digest, *location))
+        self._log_file.flush()
+        self._recent[digest] = location
+
+    def _reader(self, pack_number: int) -> int:
+        fd = self._readers.get(pack_number)
+        if fd is None:
+            with self._lock:
+                fd = self._readers.get(pack_number)
+                if fd is None:
+                    fd = os.open(self._pack_path(pack_number), os.O_RDONLY)
+                    self._readers[pack_number] = fd
+        return fd
+
+    def _lookup(self, digest: bytes) -> Optional[Location]:
+        location = self._recent.get(digest)
+        if location is None:
+            location = self._sorted_lookup(digest)
+        if location is None or location[0] == TOMBSTONE_PACK:
+            return None
+        return location
+
+    def _sorted_lookup(self, digest: bytes) -> Optional[Location]:
+        index = self._sorted_mmap
+        if index is None:
+            return None
+        low, high = 0, len(index) // INDEX_ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            position = middle * INDEX_ENTRY.size
+            if index[position:position + 32] < digest:
+                low = middle + 1
+            else:
+                high = middle
+        position = low * INDEX_ENTRY.size
+        if position < len(index) and index[position:position + 32] == digest:
+            return INDEX_ENTRY.unpack_from(index, position)[1:]
+        return None
+
+    def _merge_entries(self, recent: list) -> Iterator[Tuple[bytes, Location]]:
+        """Sorted index entries merged with sorted recent entries, recent ones take precedence"""
+        index = self._sorted_mmap
+        count = len(index) // INDEX_ENTRY.size if index is not None else 0
+        position, recent_position = 0, 0
+        while position < count or recent_position < len(recent):
+            if position < count:
+                digest, *location = INDEX_ENTRY.unpack_from(index, position * INDEX_ENTRY.size)
+            if recent_position < len(recent) and (
+                position >= count or recent[recent_position][0] <= digest
+            ):
+                recent_digest, recent_location = recent[recent_position]
+                recent_position += 1
+                if position < count and recent_digest == digest:
+                    position += 1
+                yield recent_digest, recent_location
+            else:
+                position += 1
+                yield digest, tuple(location)
+
+    def _open_sorted_index(self) -> None:
+        path = self._path(self.sorted_index_filename)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                self._sorted_mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._sorted_mmap = None
+
+    def _close_sorted_index(self) -> None:
+        if self._sorted_mmap is not None:
+            self._sorted_mmap.close()
+            self._sorted_mmap = None
+
+    def _load_log_index(self) -> None:
+        path = self._path(self.log_index_filename)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as file:
+            data = file.read()
+        # torn tail entry of crashed run is ignored
+        complete_size = len(data) - len(data) % INDEX_ENTRY.size
+        for position in range(0, complete_size, INDEX_ENTRY.size):
+            digest, *location = INDEX_ENTRY.unpack_from(data, position)
+            self._recent[digest] = tuple(location)
+        if complete_size != len(data) and not self.readonly:
+            with open(path, 'r+b') as file:
+                file.truncate(complete_size)
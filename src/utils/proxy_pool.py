@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from furl import furl
+from w3lib.http import basic_auth_header
+
+
+class ProxyState:
+    """Proxy with precomputed Proxy-Authorization header and health statistics"""
+
+    __slots__ = (
+        'proxy', 'auth_header', 'name', 'success_rate', 'latency',
+        'consecutive_failures', 'cooldown_until', 'position',
+    )
+
+    def __init__(self, proxy: str, auth: Optional[str] = None):
+        if 'http' not in proxy:
+            proxy = 'http://{}'.format(proxy)
+        self.proxy: str = proxy
+        self.auth_header: Optional[bytes] = basic_auth_header(*auth.split(':', 1)) if auth else None
+        # stats key without credentials
+        self.name: str = furl(proxy).netloc.rsplit('@', 1)[-1]
+        self.success_rate: float = 1.0
+        self.latency: float = 0.0  # seconds, exponential moving average
+        self.consecutive_failures: int = 0
+        self.cooldown_until: float = 0.0
+        self.position: int = -1  # index in available list, -1 - proxy is in cooldown
+
+    @property
+    def score(self) -> float:
+        return self.success_rate / (1.0 + self.latency)
+
+
+class ProxyPool:
+    """Proxies selected by health score in O(1).
+
+    Random mode uses power of two choices: one of two random available proxies is taken with
+    probability proportional to its score, so traffic is shifted to fast and successful proxies
+    without sorting or hammering single best one. Failed (banned, timed out) proxy is put into
+    cooldown, which doubles with each consecutive failure up to cooldown_max.
+    Cooldowns are kept in heap, proxies are returned to available list when they expire.
+    """
+
+    def __init__(
+        self,
+        proxy_items: List[Dict],
+        cooldown_base: float = 30,
+        cooldown_max: float = 1800,
+        ewma_alpha: float = 0.1,
+    ):
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self.ewma_alpha = ewma_alpha
+        self.proxies: Dict[str, ProxyState] = {}
+        for proxy_item in proxy_items:
+            state = ProxyState(proxy_item['proxy'], proxy_item.get('auth'))
+            self.proxies[state.proxy] = state
+        self._available: List[ProxyState] = []
+        for state in self.proxies.values():
+            self._make_available(state)
+        self._cooldowns: List[Tuple[float, int, ProxyState]] = []
+        self._sequence = itertools.count()
+        self._next_position: int = 0
+
+    def __len__(self) -> int:
+        return len(self.proxies)
+
+    @property
+    def available_count(self) -> int:
+        return len(self._available)
+
+    def get(self, proxy: Optional[str]) -> Optional[ProxyState]:
+        return self.proxies.get(proxy) if proxy else None
+
+    def choose(self) -> ProxyState:
+        available = self._get_available()
+        if available is None:
+            return self._cooldowns[0][2]
+        first, second = random.choice(available), random.choice(available)
+        total = first.score + second.score
+        if total <= 0:
+            return first
+        return first if random.random() * total < first.score else second
+
+    def next_in_order(self) -> ProxyState:
+        available = self._get_available()
+        if available is None:
+            return self._cooldowns[0][2]
+        state = available[self._next_position % len(available)]
+        self._next_position += 1
+        return state
+
+    def record_success(self, state: ProxyState, latency: Optional[float] = None) -> None:
+        alpha = self.ewma_alpha
+        state.success_rate += alpha * (1.0 - state.success_rate)
+        if latency is not None:
+            state.latency = latency if not state.latency else state.latency + alpha * (latency - state.latency)
+        state.consecutive_failures = 0
+
+    def record_failure(self, state: ProxyState) -> Optional[float]:
+        """Returns cooldown duration, None if proxy is in cooldown already
+        (failures of requests sent before cooldown do not extend it)"""
+        state.success_rate -= self.ewma_alpha * state.success_rate
+        if state.position < 0:
+            return None
+        state.consecutive_failures += 1
+        cooldown = min(self.cooldown_base * 2 ** (state.consecutive_failures - 1), self.cooldown_max)
+        state.cooldown_until = time.monotonic() + cooldown
+        self._remove_available(state)
+        heapq.heappush(self._cooldowns, (state.cooldown_until, next(self._sequence), state))
+        return cooldown
+
+    def _get_available(self) -> Optional[List[ProxyState]]:
+        """None if all proxies are in cooldown: proxy with earliest cooldown end is used then"""
+        now = time.monotonic()
+        while self._cooldowns and self._cooldowns[0][0] <= now:
+            _, _, state = heapq.heappop(self._cooldowns)
+            self._make_available(state)
+        return self._available or None
+
+    def _make_available(self, state: ProxyState) -> None:
+        state.position = len(self._available)
+        self._available.append(state)
+
+    def _remove_available(self, state: ProxyState) -> None:
+        # swap with last one, so removal is O(1)
+        last = self._available.pop()
+        if last is not state:
+            self._available[state.position] = last
+            last.position = state.position
+        state.position = -1